@@ -1,37 +1,52 @@
 import json
-import sys
-import boto3
-import botocore
+import botocore.exceptions
 from os import environ
 import logging
 import uuid
 import time
+import random
+import re
+import base64
+import hashlib
+import hmac
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from decimal import Decimal
+import dynamo
+import cache
+import serializer
+import search_index
+import change_feed
+import etag
+import codec
+import compression
+import instrumentation
+import export
+import idempotency
+import throttle
+import recent_view
+import note_stats
+import bulk_delete
+import validation
 '''
-DecimalEncoder:
-The following routines added to ensure that JSON-ified outputs don't have raw floats
+parse_float:
+DynamoDB won't take raw floats, so numbers we generate go in as Decimals.
+Everything going back out is JSON-ified by serializer.dumps()
 
 '''
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Decimal):
-            return str(obj)
-        return json.JSONEncoder.default(self, obj)
-
 def parse_float(value):
     return Decimal(str(value))
 '''
 Set up our environment
+The DynamoDB client behind 'table' is only built on first use (see dynamo.py), so
+importing this module stays cheap on a cold start.
 '''
-my_config = botocore.config.Config(region_name='us-east-1')
-db = boto3.resource('dynamodb', config=my_config)
-
 tablename = None
 table = None
 if __name__ != '__main__':
     tablename = environ['TABLE_NAME']
-    table = db.Table(tablename)
+    table = instrumentation.instrumentTable(throttle.throttleTable(dynamo.DynamoTable(tablename)))
     logging.basicConfig(level=logging.INFO)
 else:
     tablename = 'notes_table_dummy'
@@ -40,20 +55,160 @@ else:
 if tablename == None:
     raise Exception("Cannot find environment variable TABLE_NAME")
 
+
+
+'''
+Besides the notes the table holds derived items, each kind in partitions of its own:
+
+    search#<user_id>#<term>   search postings (search_index.py)
+    changes#<user_id>         the change feed (change_feed.py)
+    stats#<user_id>           note counters (note_stats.py)
+    recent#<user_id>          the recent-notes view (recent_view.py)
+    idem#<user_id>#<key>      Idempotency-Key records (idempotency.py)
+
+None of those partition keys is ever a user's own user_id, so GET /notes doesn't see
+them, and none of the items has a note_id, so they stay out of note_id-index.  The
+modules only build keys, items and request parameters; the I/O is done here.
+'''
+
+
+
+'''
+Swap in a different table object, e.g. the in-memory stand-in the tests and benchmarks
+use.  Anything with DynamoTable's methods (and a 'name') will do; it gets the same
+retry/throttling and instrumentation wrappers as the real table.  The note cache is emptied as well, since it
+holds notes read from the old table.
+
+'''
+def setTable(newtable):
+    global table, tablename
+    table = instrumentation.instrumentTable(throttle.throttleTable(newtable))
+    if newtable is not None:
+        tablename = newtable.name
+    if notecache:
+        notecache.clear()
+    if idemcache:
+        idemcache.clear()
+
 logger = logging.getLogger('sls_notes_backend_handlers')
 
+# read-through cache for GET /note/n/{note_id}, kept for the life of the container
+notecache = cache.noteCacheFromEnvironment()
+idemcache = cache.idempotencyCacheFromEnvironment()
+
 
 '''
 Add CORS global enablement to headers
+'encoding' is the Content-Encoding of the body; 'identity' marks a response that could
+have been compressed but wasn't, which still needs the Vary header for caches.
 
 '''
 
-def getResponseHeaders():
+def getResponseHeaders(extra=None, encoding=None):
     d = {'Access-Control-Allow-Orgin' : '*'} #enable CORS from everywhere
+    if extra:
+        d.update(extra)
+    if encoding:
+        d['Vary'] = 'Accept-Encoding'
+        if encoding != 'identity':
+            d['Content-Encoding'] = encoding
     return d
 
 
 
+'''
+Read a request header whatever case the client sent it in
+(HTTP header names are case-insensitive, the event's dict is not)
+
+'''
+def getHeader(headers, name):
+    if not headers:
+        return None
+    if name in headers:
+        return headers[name]
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+
+'''
+The 400 every handler answers a bad request with; 'message' is usually the ValueError
+raised by validation.py or bulk_delete.py
+
+'''
+def badRequest(mylambdafunction, message):
+    return {
+        'statusCode': 400,
+        'headers': getResponseHeaders(),
+        'body': json.dumps({'error': f"{mylambdafunction}() - {message}"})
+    }
+
+
+
+'''
+JSON-ify a response body, timed as the 'serialize' phase (see instrumentation.py)
+
+'''
+def dumps(obj):
+    with instrumentation.phase('serialize'):
+        return serializer.dumps(obj)
+
+
+
+'''
+Request body as text; API Gateway base64s bodies whose type is a binary media type
+
+'''
+def getBody(event):
+    body = event.get('body')
+    if body and event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
+
+
+'''
+Compress a 200 response body when the client accepts it and the body is big enough
+to be worth it (see compression.py)
+
+'''
+def encodeResponse(event, response):
+    body = response.get('body')
+    coding = None
+    if body and len(body) >= compression.COMPRESS_MIN:
+        coding = compression.negotiate(getHeader(event.get('headers'), 'Accept-Encoding'))
+    if coding:
+        with instrumentation.phase('compress'):
+            response['body'] = compression.compressBody(body, coding)
+        response['isBase64Encoded'] = True
+    headers = response.get('headers')
+    if coding and headers and 'ETag' in headers:
+        # a strong tag names one representation: the compressed body gets its own
+        headers['ETag'] = etag.codedTag(headers['ETag'], coding)
+    response['headers'] = getResponseHeaders(headers, coding or 'identity')
+    return response
+
+
+'''
+304 for a conditional GET, carrying the tag of the form the client holds (the coded
+tag when it was sent a compressed body)
+
+'''
+def notModified(event, headers):
+    tag = headers['ETag']
+    coding = compression.negotiate(getHeader(event.get('headers'), 'Accept-Encoding'))
+    if coding and etag.codedTag(tag, coding) in (getHeader(event.get('headers'), 'If-None-Match') or ''):
+        headers['ETag'] = etag.codedTag(tag, coding)
+    return {
+        'statusCode': 304,
+        'headers': getResponseHeaders(headers, 'identity')
+    }
+
+
+
 '''
 Slurp user_id from headers
 
@@ -75,83 +230,394 @@ def getUserName(headers):
     return None
 
 
+
 '''
-Route: POST /note
+Stamp a new note Item with the owner, an auto-generated note_id and the
+unixtime 'timestamp'/'expires' fields (the same stamping POST /note does).
+The bulk importer passes the note's original time as dt and a deterministic note_id;
+expiry always counts from now, so old notes don't arrive already expired.
 
 '''
-def add_note_handler(event, context):
-    mylambdafunction='add_note'
+def stampNote(item, user_id, user_name, dt=None, note_id=None):
+    item['user_id'] = user_id
+    item['user_name'] = user_name
+    # auto-generate a note id from the user name and a GUID
+    item['note_id'] = note_id or user_id + ':' + str(uuid.uuid4())
+    now = datetime.now()
+    if dt is None:
+        dt = now
+    # in production, we wouldn't expire peoples notes
+    expires = max(dt, now) + timedelta(days=180)
+    # these are in 'unixtime', but the mktime returns a float so we turn it to a decimal
+    item['timestamp'] = parse_float(time.mktime(dt.timetuple()))
+    item['expires'] = parse_float(time.mktime(expires.timetuple()))
+    # files the note under its expiry day in expires-index, for the purge job
+    item[bulk_delete.EXPIRY_BUCKET] = bulk_delete.expiryBucket(user_id, item['expires'])
+    # bumped by every update; the ETag of the note is derived from it
+    item['version'] = 1
+    return item
+
+
+
+'''
+BatchWriteItem helpers:
+DynamoDB takes at most 25 put/delete requests per BatchWriteItem call, and may hand
+some of them back as UnprocessedItems when the table is throttling. We retry those
+with exponential backoff (plus jitter) and report whatever is still left over.
+
+'''
+BATCH_WRITE_MAX = 25
+BATCH_WRITE_RETRIES = 5
+BATCH_WRITE_BACKOFF = 0.05 # seconds, doubled on every retry
+
+def chunkList(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def batchWriteItems(requests):
+    unprocessed = []
+    for chunk in chunkList(requests, BATCH_WRITE_MAX):
+        pending = {tablename: chunk}
+        attempt = 0
+        while pending:
+            data = table.batch_write_item(RequestItems=pending)
+            pending = data.get('UnprocessedItems') or {}
+            if not pending:
+                break
+            attempt = attempt + 1
+            if attempt > BATCH_WRITE_RETRIES:
+                unprocessed.extend(pending.get(tablename, []))
+                break
+            delay = BATCH_WRITE_BACKOFF * (2 ** (attempt - 1))
+            time.sleep(delay + random.uniform(0, delay))
+    return unprocessed
 
+
+
+'''
+BatchGetItem helper:
+At most 100 keys per BatchGetItem call; UnprocessedKeys are retried with the same
+backoff as the batch writes.  Returns the items found (content decoded, see codec.py),
+in no particular order.
+
+'''
+BATCH_GET_MAX = 100
+
+def batchGetItems(keys):
+    found = []
+    for chunk in chunkList(keys, BATCH_GET_MAX):
+        pending = {tablename: {'Keys': chunk}}
+        attempt = 0
+        while pending:
+            data = table.batch_get_item(RequestItems=pending)
+            found.extend(codec.decodeNotes(data.get('Responses', {}).get(tablename, [])))
+            pending = data.get('UnprocessedKeys') or {}
+            if not pending:
+                break
+            attempt = attempt + 1
+            if attempt > BATCH_WRITE_RETRIES:
+                logger.warning(f"batchGetItems() giving up on {len(pending[tablename]['Keys'])} keys")
+                break
+            delay = BATCH_WRITE_BACKOFF * (2 ** (attempt - 1))
+            time.sleep(delay + random.uniform(0, delay))
+    return found
+
+
+
+'''
+Split a note reference into (note_id, user_id, timestamp).
+
+A note_id is '<user_id>:<uuid>', so the partition key is always recoverable.  Clients
+that also know the note's timestamp can send '<note_id>:<timestamp>', which gives us
+the whole primary key; otherwise timestamp is None and we have to go via the GSI.
+'''
+def parseNoteRef(ref):
+    timestamp = None
+    note_id = ref
+    head, sep, tail = ref.rpartition(':')
+    if sep and tail.isdigit() and ':' in head:
+        note_id = head
+        timestamp = int(tail)
+    user_id = note_id.split(':', 1)[0]
+    return note_id, user_id, timestamp
+
+
+
+'''
+Look up a single note through the note_id GSI (the slow path)
+
+'''
+def queryNoteById(note_id):
+    params = {
+        'IndexName': 'note_id-index',
+        'KeyConditionExpression': 'note_id = :note_id',
+        'ExpressionAttributeValues': {
+            ':note_id': note_id
+        },
+        'Limit': 1
+    }
+    data = table.query(**params)
+    if data and data.get('Items'):
+        return codec.decodeNote(data['Items'][0])
+    return None
+
+
+
+'''
+Sort key of a user's newest note, or None when they have none (one item read;
+the user's partition only holds notes, derived items live under prefixed ones)
+
+'''
+def newestTimestamp(user_id):
+    data = table.query(
+        TableName=tablename,
+        KeyConditionExpression='user_id = :uid',
+        ExpressionAttributeValues={':uid': user_id},
+        ProjectionExpression='#ts',
+        ExpressionAttributeNames={'#ts': 'timestamp'},
+        Limit=1,
+        ScanIndexForward=False
+    )
+    items = data.get('Items') if data else None
+    return int(items[0]['timestamp']) if items else None
+
+
+
+'''
+Put a new note without replacing one already stored under its key (a batch may have
+stamped notes a few seconds ahead): on a clash the note is restamped after the user's
+newest note and tried again.
+
+'''
+PUT_NOTE_RETRIES = 3
+
+def putNewNote(item):
+    for attempt in range(PUT_NOTE_RETRIES):
+        try:
+            return table.put_item(
+                TableName=tablename,
+                Item=codec.encodeNote(item),
+                ConditionExpression='attribute_not_exists(user_id)'
+            )
+        except botocore.exceptions.ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException' or attempt == PUT_NOTE_RETRIES - 1:
+                raise
+        newest = newestTimestamp(item['user_id'])
+        item['timestamp'] = parse_float(max(int(item['timestamp']), newest or 0) + 1)
+'''
+Keep the search index (see search_index.py) in step with a note write.
+A note touches one posting item per changed term, so the updates go out in parallel.
+The note itself is already written by the time we get here, so an index failure is
+logged rather than failing the request (a client retry would only duplicate the note).
+
+'''
+INDEX_WORKERS = 8
+
+def updateSearchIndex(user_id, old_note, new_note):
+    applyIndexUpdates(user_id, search_index.indexUpdates(user_id, old_note, new_note))
+
+def applyIndexUpdates(user_id, updates):
+    if not updates:
+        return
+    def apply(params):
+        try:
+            data = table.update_item(**params)
+            if params.get('ReturnValues') and 'notes' not in data.get('Attributes', {}):
+                table.delete_item(**search_index.postingCleanup(params['Key']))
+        except botocore.exceptions.ClientError as err:
+            # DELETE on a posting that isn't there, or one refilled before the cleanup
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
     try:
-        # parse body from event
-        body = None
-        if 'body' in event:
-            body = json.loads(event['body'])
+        if len(updates) == 1:
+            apply(updates[0])
         else:
-            item = None
-            eventkeys = ""
-            for key in body.keys():
-                eventkeys = eventkeys + " " + key
-            return {
-                'statusCode': 400,
-                'error': f"{mylambdafunction}() - Cannot find 'body' in event",
-                'event': event
-            }
-        # parse item from body
-        if 'Item' in body:
-            item = body['Item']
-        else:
-            bodykeys = ""
-            for key in body.keys():
-                bodykeys = bodykeys + " " + key
+            with ThreadPoolExecutor(max_workers=min(INDEX_WORKERS, len(updates))) as pool:
+                list(pool.map(instrumentation.bind(apply), updates))
+    except botocore.exceptions.ClientError as err:
+        logger.error(f"applyIndexUpdates() failed for {user_id}: {err.response['Error']['Code']} {err.response['Error']['Message']}")
+
+
+'''
+Append to the user's change feed (see change_feed.py) after notes were written.
+Like the search index this runs after the note write has succeeded, so a failure is
+logged instead of failing the request.  A single change is a conditional put so two
+containers that pick the same microsecond can't overwrite each other's entry.
+
+'''
+CHANGE_PUT_RETRIES = 3
+
+def recordChanges(user_id, op, notes):
+    if not notes:
+        return
+    try:
+        if len(notes) > 1:
+            unprocessed = batchWriteItems([{'PutRequest': {'Item': change_feed.changeItem(user_id, op, note)}} for note in notes])
+            if unprocessed:
+                logger.error(f"recordChanges() dropped {len(unprocessed)} changes for {user_id}")
+            return
+        for attempt in range(CHANGE_PUT_RETRIES):
+            try:
+                table.put_item(
+                    Item=change_feed.changeItem(user_id, op, notes[0]),
+                    ConditionExpression='attribute_not_exists(user_id)'
+                )
+                return
+            except botocore.exceptions.ClientError as err:
+                if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        logger.error(f"recordChanges() could not find a free change slot for {user_id}")
+    except botocore.exceptions.ClientError as err:
+        logger.error(f"recordChanges() failed for {user_id}: {err.response['Error']['Code']} {err.response['Error']['Message']}")
+
+
+'''
+Move the user's note counters (see note_stats.py) after notes were written; like the
+change feed a failure is logged, and the reconciliation job fixes the drift.
+
+'''
+def updateStats(user_id, delta):
+    params = note_stats.statsUpdate(user_id, delta)
+    if params is None:
+        return
+    try:
+        table.update_item(TableName=tablename, **params)
+    except botocore.exceptions.ClientError as err:
+        logger.error(f"updateStats() failed for {user_id}: {err.response['Error']['Code']} {err.response['Error']['Message']}")
+
+
+'''
+Idempotency-Key handling for POST /note (see idempotency.py).
+claimIdempotencyKey() returns None when this request owns the key and should go ahead,
+otherwise the response to send instead: the original one for a retry, 409 while the
+first attempt is still in flight, 422 when the key was used for a different body.
+Finished responses are also kept in idemcache, so a retry storm hitting a warm
+container is answered without touching DynamoDB.
+
+'''
+def replayResponse(response):
+    return {
+        'statusCode': response['statusCode'],
+        'headers': getResponseHeaders({'Idempotent-Replayed': 'true'}),
+        'body': response['body']
+    }
+
+def claimIdempotencyKey(user_id, key, request_hash):
+    cached = idemcache.get((user_id, key)) if idemcache else None
+    if cached is None:
+        try:
+            table.put_item(TableName=tablename, **idempotency.claimParams(user_id, key, request_hash))
+            return None
+        except botocore.exceptions.ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        record = table.get_item(TableName=tablename, Key=idempotency.recordKey(user_id, key), ConsistentRead=True).get('Item') or {}
+        response = idempotency.storedResponse(record)
+        if response is None:
             return {
-                'statusCode': 400,
-                'error': f"{mylambdafunction}() - Cannot find 'Item' in body",
-                'bodykeys': bodykeys,
-                'body': json.dumps(body, cls=DecimalEncoder)
+                'statusCode': 409,
+                'headers': getResponseHeaders({'Retry-After': '1'}),
+                'body': json.dumps({'error': f"A request with this {idempotency.HEADER} is still in progress"})
             }
+        cached = (record.get('request'), response)
+        if idemcache:
+            idemcache.put((user_id, key), cached)
+    if cached[0] != request_hash:
+        return {
+            'statusCode': 422,
+            'headers': getResponseHeaders(),
+            'body': json.dumps({'error': f"{idempotency.HEADER} was already used for a different request"})
+        }
+    return replayResponse(cached[1])
+
+def completeIdempotencyKey(user_id, key, request_hash, response):
+    # the note is written by now, so a failure here is logged and the client still gets
+    # its response; the pending claim then lapses with its lease
+    try:
+        table.update_item(TableName=tablename, **idempotency.completeParams(user_id, key, response))
+    except botocore.exceptions.ClientError as err:
+        logger.error(f"completeIdempotencyKey() failed for {user_id}: {err.response['Error']['Code']}")
+        return
+    if idemcache:
+        idemcache.put((user_id, key), (request_hash, response))
+
+def releaseIdempotencyKey(user_id, key):
+    # the write failed: free the key so the client's retry can run
+    try:
+        table.delete_item(TableName=tablename, Key=idempotency.recordKey(user_id, key),
+                          ConditionExpression='#state = :pending',
+                          ExpressionAttributeNames={'#state': 'state'},
+                          ExpressionAttributeValues={':pending': 'pending'})
+    except botocore.exceptions.ClientError as err:
+        logger.error(f"releaseIdempotencyKey() failed for {user_id}: {err.response['Error']['Code']}")
+
+
+'''
+Route: POST /note
+
+Send an 'Idempotency-Key' header to make retries safe: a repeat of the same request
+within the window gets the first response back instead of creating another note.
+'''
+@instrumentation.instrument('add_note')
+@throttle.guard
+def add_note_handler(event, context):
+    mylambdafunction='add_note'
 
+    try:
         # parse user information from headers
-        item['user_id'] = getUserId(event['headers'])
-        if item['user_id'] is None:
-            return {
-                'statusCode': 400,
-                'error': "Cannot find 'app_user_id'  in headers",
-                'data': json.dumps(event, cls=DecimalEncoder)
-            }
+        headers = event.get('headers') or {}
+        user_id = getUserId(headers)
+        user_name = getUserName(headers)
+        if user_id is None or user_name is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' and 'app_user_name' in 'headers'")
 
-        item['user_name'] = getUserName(event['headers'])
-        if item['user_name'] is None:
-            return {
-                'statusCode': 400,
-                'error': "Cannot find 'app_user_name' in 'headers'",
-                'headers': json.dumps(headers, cls=DecimalEncoder)
-            }
-
-        # auto-generate a note id from the user name and a GUID
-        item['note_id'] = item['user_id'] + ':' + str(uuid.uuid4())
-        dt = datetime.now()
-        # in production, we wouldn't expire peoples notes
-        expires = dt + timedelta(days=180)
-        # these are in 'unixtime', but the mktime returns a float so we turn it to a decimal
-        item['timestamp'] = parse_float(time.mktime(dt.timetuple()))
-        item['expires'] = parse_float(time.mktime(expires.timetuple()))
+        # parse and check the item before anything goes to the table
+        try:
+            with instrumentation.phase('parse'):
+                body = validation.parseBody(getBody(event), validation.NOTE_BODY_MAX)
+                if 'Item' not in body:
+                    raise ValueError("Cannot find 'Item' in body")
+                item = body['Item']
+            with instrumentation.phase('validate'):
+                validation.NEW_NOTE.check(item, reserve=validation.stampBytes(user_id, user_name))
+        except ValueError as err:
+            return badRequest(mylambdafunction, err)
+
+        idem_key = getHeader(headers, idempotency.HEADER)
+        if idem_key is not None and not idempotency.validKey(idem_key):
+            return badRequest(mylambdafunction, f"Invalid '{idempotency.HEADER}' header")
+
+        stampNote(item, user_id, user_name)
         if table != None:
-            table.put_item(
-                TableName=tablename,
-                Item=item
-            )
+            if idem_key is not None:
+                request_hash = idempotency.requestHash(getBody(event))
+                replay = claimIdempotencyKey(user_id, idem_key, request_hash)
+                if replay is not None:
+                    return replay
+            try:
+                putNewNote(item)
+            except botocore.exceptions.ClientError:
+                if idem_key is not None:
+                    releaseIdempotencyKey(user_id, idem_key)
+                raise
+            if notecache:
+                notecache.invalidateKey(user_id, item['timestamp'])
+            updateSearchIndex(user_id, None, item)
+            recordChanges(user_id, 'put', [item])
+            updateStats(user_id, note_stats.statsDelta(None, item))
             response = {
                 'statusCode': 200,
-                'body': json.dumps(item, cls=DecimalEncoder)
+                'body': dumps(item)
             }
+            if idem_key is not None:
+                completeIdempotencyKey(user_id, idem_key, request_hash, response)
             return response
         else:
             # Called from the command line
             logger.debug(f"{mylambdafunction} Not updating table - TEST mode")
             response = {
                 'statusCode': 200,
-                'body': json.dumps(event, cls=DecimalEncoder)
+                'body': dumps(event)
             }
             return response
 
@@ -177,47 +643,150 @@ def add_note_handler(event, context):
             }
             return errorresponse
 '''
-Route: DELETE /note/t/{timestamp}
+Route: POST /notes/batch
 
-Use user_id/timestamp to find and delete a particular note.
-user_id is in headers, and timestamp is part of the event.pathParameters
+Body is {"Items": [...]}; every Item gets the same stamping as POST /note and the
+whole lot is written with BatchWriteItem in chunks of 25.  The notes are stamped one
+second apart from now (or from after the user's newest note) onwards, so a batch never
+replaces notes already stored.  The response carries a per-item result so offline
+clients know which of their queued notes made it.
 '''
-def delete_note_handler(event, context):
-    mylambdafunction='delete_note'
+BATCH_ADD_MAX_ITEMS = 100
+
+@instrumentation.instrument('add_notes_batch')
+@throttle.guard
+def add_notes_batch_handler(event, context):
+    mylambdafunction='add_notes_batch'
     try:
-        timestamp = None
-        # parse the timestamp from the event.pathParameters
-        if 'pathParameters' in event:
-            timestamp = event['pathParameters']['timestamp']
+        # parse user information from headers
+        user_id = getUserId(event.get('headers') or {})
+        user_name = getUserName(event.get('headers') or {})
+        if user_id is None or user_name is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' and 'app_user_name' in 'headers'")
+
+        # parse the list of items from the body and check every one of them
+        try:
+            with instrumentation.phase('parse'):
+                body = validation.parseBody(getBody(event), validation.BATCH_BODY_MAX)
+                items = body.get('Items')
+                if not isinstance(items, list) or len(items) == 0:
+                    raise ValueError("'Items' must be a non-empty list")
+                if len(items) > BATCH_ADD_MAX_ITEMS:
+                    raise ValueError(f"at most {BATCH_ADD_MAX_ITEMS} Items per request")
+            with instrumentation.phase('validate'):
+                reserve = validation.stampBytes(user_id, user_name)
+                for i, item in enumerate(items):
+                    validation.NEW_NOTE.check(item, f"Items[{i}]", reserve)
+        except ValueError as err:
+            return badRequest(mylambdafunction, err)
+
+        # timestamp is the sort key, and BatchWriteItem puts overwrite whatever is at their
+        # keys, so the batch gets one second each counting forward from now or from just
+        # after the user's newest note, whichever is later.  That keeps the queue order and
+        # never lands on a stored note; only two batches for the same user racing each
+        # other can still collide.
+        start = int(time.time())
+        if table != None:
+            newest = newestTimestamp(user_id)
+            if newest is not None:
+                start = max(start, newest + 1)
+        for i, item in enumerate(items):
+            stampNote(item, user_id, user_name, datetime.fromtimestamp(start + i))
+
+        unprocessed = []
+        if table != None:
+            unprocessed = batchWriteItems([{'PutRequest': {'Item': codec.encodeNote(item)}} for item in items])
+            unwritten = set(request['PutRequest']['Item']['note_id'] for request in unprocessed)
+            for item in items:
+                if notecache:
+                    notecache.invalidateKey(user_id, item['timestamp'])
+                if item['note_id'] not in unwritten:
+                    updateSearchIndex(user_id, None, item)
+            written = [item for item in items if item['note_id'] not in unwritten]
+            recordChanges(user_id, 'put', written)
+            updateStats(user_id, note_stats.addDeltas(note_stats.statsDelta(None, item) for item in written))
+        else:
+            # Called from the command line
+            logger.debug(f"{mylambdafunction} Not updating table - TEST mode")
+
+        failed = set(request['PutRequest']['Item']['note_id'] for request in unprocessed)
+        results = []
+        for item in items:
+            results.append({
+                'note_id': item['note_id'],
+                'timestamp': item['timestamp'],
+                'status': 'failed' if item['note_id'] in failed else 'written'
+            })
+        response = {
+            # 207 - Multi-Status tells the client to look at the per-item results
+            'statusCode': 207 if failed else 200,
+            'headers': getResponseHeaders(),
+            'body': dumps({'Items': results, 'failed': len(failed)})
+        }
+        return response
+
+
+    # bad things happened, let's see if we can handle it ourselves
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError': # Generic error
+            # We grab the message, request ID, and HTTP code to give to customer support
+            logger.critical(mylambdafunction + ' Error Message: {}'.format(err.response['Error']['Message']))
+            logger.critical(mylambdafunction + ' Request ID: {}'.format(err.response['ResponseMetadata']['RequestId']))
+            logger.critical(mylambdafunction + ' Http code: {}'.format(err.response['ResponseMetadata']['HTTPStatusCode']))
+            raise err
         else:
-            # bad json sent in headers
             errbody= {
-                'error' : f"{mylambdafunction}() - Cant find 'timestamp' in 'pathParameters'"
+                'lambdafunction' : mylambdafunction,
+                'code' : err.response['Error']['Code'],
+                'message' : err.response['Error']['Message']
             }
             errorresponse = {
-                'statusCode': 400,
-                'error': json.dumps( errbody ),
-                'data': json.dumps(event, cls=DecimalEncoder)
+                'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
+                'headers': getResponseHeaders(),
+                'body': json.dumps( errbody )
             }
             return errorresponse
+'''
+Route: DELETE /note/t/{timestamp}
+
+Use user_id/timestamp to find and delete a particular note.
+user_id is in headers, and timestamp is part of the event.pathParameters
+'''
+@instrumentation.instrument('delete_note')
+@throttle.guard
+def delete_note_handler(event, context):
+    mylambdafunction='delete_note'
+    try:
+        # parse the timestamp from the event.pathParameters
+        timestamp = (event.get('pathParameters') or {}).get('timestamp')
+        try:
+            timestamp = int(timestamp)
+        except (TypeError, ValueError):
+            return badRequest(mylambdafunction, "'timestamp' in 'pathParameters' must be an integer")
 
         # parse the user_id from the headers
-        user_id = getUserId(event['headers'])
+        user_id = getUserId(event.get('headers') or {})
         if user_id is None:
-            return {
-                'statusCode': 400,
-                'error': "Cannot find 'app_user_id' in 'headers'",
-                'data': json.dumps(event, cls=DecimalEncoder)
-            }
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' in 'headers'")
 
         params = {
             'Key':{
                 'user_id': user_id,
-                'timestamp': int(timestamp)
-            }
+                'timestamp': timestamp
+            },
+            # the old note tells us which search postings to drop
+            'ReturnValues': 'ALL_OLD'
         }
         if table:
-            table.delete_item(**params)
+            data = table.delete_item(**params)
+            if notecache:
+                notecache.invalidateKey(user_id, timestamp)
+            if data.get('Attributes'):
+                codec.decodeNote(data['Attributes'])
+                updateSearchIndex(user_id, data['Attributes'], None)
+                # the tombstone a syncing client needs to drop its copy
+                recordChanges(user_id, 'delete', [data['Attributes']])
+                updateStats(user_id, note_stats.statsDelta(data['Attributes'], None))
         else:
             logger.info(f"Running {mylambdafunction}() in testmode")
         response = {
@@ -257,19 +826,15 @@ Get the contents of a note from the note_id held in the pathParameter
 '''
 
 
+@instrumentation.instrument('get_note')
+@throttle.guard
 def get_note_handler(event, context):
     mylambdafunction='get_note'
     try:
         # parse note_id from the event.pathParamter
-        note_id = None
-        if 'pathParameters' in event and 'note_id' in event['pathParameters']:
-            note_id = event['pathParameters']['note_id']
-        else:
-            return {
-                'statusCode': 404,
-                'headers': json.dumps(getResponseHeaders()),
-                'error': 'No note_id in pathParameters'
-            }
+        note_id = (event.get('pathParameters') or {}).get('note_id')
+        if not note_id:
+            return badRequest(mylambdafunction, "Cannot find 'note_id' in 'pathParameters'")
 
         # query parameters are to find a note where the note_id field matches
         params = {
@@ -286,18 +851,30 @@ def get_note_handler(event, context):
             return json.dumps(params)
 
 
-        data = table.query(**params)
-        if data and 'Items' in data:
-            return {
+        note = notecache.get(note_id) if notecache else None
+        if note is None:
+            data = table.query(**params)
+            if data and data.get('Items'):
+                note = codec.decodeNote(data['Items'][0])
+                if notecache:
+                    notecache.putNote(note)
+        if notecache:
+            logger.debug(f"{mylambdafunction} note cache {notecache.stats()}")
+        if note is not None:
+            tag = etag.noteTag(note)
+            if etag.matches(getHeader(event.get('headers'), 'If-None-Match'), tag):
+                # the client already holds this version: skip the body altogether
+                return notModified(event, {'ETag': tag})
+            return encodeResponse(event, {
                 'statusCode': 200,
-                'headers': json.dumps(getResponseHeaders()),
-                'body': json.dumps(data['Items'][0],  cls=DecimalEncoder)
-            }
+                'headers': {'ETag': tag},
+                'body': dumps(note)
+            })
         else:
             # no such note, return 204 - No Content
             return {
                 'statusCode': 204,
-                'headers': json.dumps(getResponseHeaders())
+                'headers': getResponseHeaders()
             }
 
 
@@ -317,7 +894,7 @@ def get_note_handler(event, context):
             }
             errorresponse = {
                 'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
-                'headers': json.dumps(getResponseHeaders()),
+                'headers': getResponseHeaders(),
                 'body': 
                 json.dumps( errbody )
             }
@@ -325,64 +902,84 @@ def get_note_handler(event, context):
 
 
 '''
-Route: GET /notes
+Route: GET /notes/by-id?ids=<ref>,<ref>,...
 
-Get multiple notes from the user (max count=5, default), user_id is in the headers
+Resolve many notes in one invocation.  Each ref is a note_id, optionally followed by
+':<timestamp>'.  Refs with a timestamp are fetched from the base table with
+BatchGetItem; the rest fall back to concurrent note_id-index queries.
 '''
-def get_notes_handler(event, context):
-    mylambdafunction='get_notes'
+GET_BY_ID_MAX = 100
+GET_BY_ID_WORKERS = 8
+
+@instrumentation.instrument('get_notes_by_id')
+@throttle.guard
+def get_notes_by_id_handler(event, context):
+    mylambdafunction='get_notes_by_id'
     try:
-        # parse limit from queryStringParameters
-        query = event['queryStringParameters']
-        limit = query['limit'] if query and 'limit' in query else 5
-        # parse user_id from headers
-        user_id = getUserId(event['headers'])
-        if user_id is None:
-            return {
-                'statusCode': 404,
-                'headers': json.dumps(getResponseHeaders()),
-                'error': "Cannot find 'app_user_id' in 'headers'",
-                'data': json.dumps(event, cls=DecimalEncoder)
-            }
+        # parse the list of note refs from queryStringParameters
+        query = event.get('queryStringParameters') or {}
+        refs = []
+        for ref in (query.get('ids') or '').split(','):
+            ref = ref.strip()
+            if ref and ref not in refs:
+                refs.append(ref)
+        if len(refs) == 0:
+            return badRequest(mylambdafunction, "No 'ids' in queryStringParameters")
+        if len(refs) > GET_BY_ID_MAX:
+            return badRequest(mylambdafunction, f"at most {GET_BY_ID_MAX} ids per request")
 
-        # query to get all notes (up to limit) matching field user_id
-        params = {
-            'TableName': tablename,
-            'KeyConditionExpression': 'user_id = :uid',
-            'ExpressionAttributeValues': {
-                ':uid':  user_id
-            },
-            'Limit': limit,
-            'ScanIndexForward': False
+        parsed = [parseNoteRef(ref) for ref in refs]
 
-        }
+        # cached notes cost nothing
+        found = {}
+        if notecache:
+            for note_id, user_id, timestamp in parsed:
+                note = notecache.get(note_id)
+                if note is not None:
+                    found[note_id] = note
 
-        # possibly get start time to set up an exclusive start key
-        startTimeStamp = int(query['start']) if query and 'start' in query else 0
-        if(startTimeStamp > 0):
-            params['exclusiveStartKey'] = {
-                'user_id': user_id,
-                'timestamp': startTimeStamp
+        keys = []
+        for note_id, user_id, timestamp in parsed:
+            if timestamp is not None and note_id not in found:
+                key = {'user_id': user_id, 'timestamp': timestamp}
+                if key not in keys:
+                    keys.append(key)
+        if table is None:
+            # running from command line, just dump the keys we would fetch
+            return json.dumps({'Keys': keys, 'refs': refs})
 
-            }
-        
-        data = None
-        if table:
-            data = table.query(**params)
-        else:
-            # running from the command line
-            data = params
-            logger.info("Running "+mylambdafunction+"() in testmode")
-        
-        response = {
+        # fast path: one BatchGetItem round trip for every key we could recover
+        for item in batchGetItems(keys):
+            found[item['note_id']] = item
+            if notecache:
+                notecache.putNote(item)
+
+        # slow path: refs without a timestamp (or with a stale one) go to the GSI
+        fallback = [note_id for note_id, user_id, timestamp in parsed if note_id not in found]
+        fallback = list(dict.fromkeys(fallback))
+        if fallback:
+            workers = min(GET_BY_ID_WORKERS, len(fallback))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for note_id, item in zip(fallback, pool.map(instrumentation.bind(queryNoteById), fallback)):
+                    if item is not None:
+                        found[note_id] = item
+                        if notecache:
+                            notecache.putNote(item)
+
+        items = []
+        missing = []
+        for ref, (note_id, user_id, timestamp) in zip(refs, parsed):
+            if note_id in found:
+                items.append(found[note_id])
+            else:
+                missing.append(ref)
+        return encodeResponse(event, {
             'statusCode': 200,
-            'headers': json.dumps(getResponseHeaders()),
-            'body': json.dumps(data,cls=DecimalEncoder)
-        }
-        return response
+            'body': dumps({'Items': items, 'missing': missing})
+        })
 
 
-    # handle bad stuff
+    # bad things happened
     except botocore.exceptions.ClientError as err:
         if err.response['Error']['Code'] == 'InternalError': # Generic error
             # We grab the message, request ID, and HTTP code to give to customer support
@@ -398,108 +995,587 @@ def get_notes_handler(event, context):
             }
             errorresponse = {
                 'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
-                'headers': json.dumps(getResponseHeaders()),
+                'headers': getResponseHeaders(),
                 'body': json.dumps( errbody )
             }
             return errorresponse
 
+
 '''
-Route: PATCH /note
+Opaque pagination cursors for GET /notes:
+The LastEvaluatedKey of a page is boiled down to its sort key, base64url'd and signed
+with an HMAC bound to the requesting user, so a cursor can't be forged or replayed
+against somebody else's partition.  Set CURSOR_SECRET per stage; without it we fall
+back to a key derived from the table name.  The HMAC only covers ?cursor=: the legacy
+?start=<timestamp> still takes any sort key, which is no more than a forged cursor
+could reach, since the Query is always on the caller's own partition.
 
 '''
+NOTES_PAGE_DEFAULT = 5
+NOTES_PAGE_MAX = 100
+CURSOR_SECRET = (environ.get('CURSOR_SECRET') or 'sls-notes:' + tablename).encode('utf-8')
 
-def update_note_handler(event, context):
-    mylambdafunction='update_notes'
-    try:
-        # try and parse body from event
-        body = None
-        if 'body' in event:
-            body = json.loads(event['body'])
-        else:
-            item = None
-            eventkeys = ""
-            # try to build up a debug string of the top level keys in the map to figure out where we messed up
-            for key in body.keys():
-                eventkeys = eventkeys + " " + key
-            return {
-                'statusCode': 400,
-                'headers': json.dumps(getResponseHeaders()),
-                'error': f"{mylambdafunction}() - Cannot find 'body' in event",
-                'event': event
-            }
-        # parse item from body
-        if 'Item' in body:
-            item = body['Item']
-        else:
-            bodykeys = ""
-            for key in body.keys():
-                bodykeys = bodykeys + " " + key
-            return {
-                'statusCode': 400,
-                'error': f"{mylambdafunction}() - Cannot find 'Item' in body",
-                'bodykeys': bodykeys,
-                'headers': json.dumps(getResponseHeaders()),
-                'body': json.dumps(body, cls=DecimalEncoder)
-            }
+def b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
 
-        # parse user information from headers
-        item['user_id'] = getUserId(event['headers'])
-        if item['user_id'] is None:
-            return {
-                'statusCode': 400,
-                'error': "Cannot find 'app_user_id'  in headers",
-                'headers': json.dumps(getResponseHeaders()),
-                'data': json.dumps(event, cls=DecimalEncoder)
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def signCursor(user_id, payload):
+    digest = hmac.new(CURSOR_SECRET, (user_id + '|' + payload).encode('utf-8'), hashlib.sha256).digest()
+    return b64encode(digest[:12])
+
+def encodeCursor(lastkey, user_id):
+    payload = b64encode(str(lastkey['timestamp']).encode('utf-8'))
+    return payload + '.' + signCursor(user_id, payload)
+
+def decodeCursor(cursor, user_id):
+    payload, sep, signature = cursor.partition('.')
+    if not sep or not hmac.compare_digest(signature, signCursor(user_id, payload)):
+        return None
+    try:
+        timestamp = Decimal(b64decode(payload).decode('utf-8'))
+    except (ValueError, ArithmeticError):
+        return None
+    return {
+        'user_id': user_id,
+        'timestamp': timestamp
+    }
+
+
+'''
+Field projection for listings:
+?fields=title,cat picks the attributes to return and ?view=summary is the preset the
+list view renders.  Either becomes a ProjectionExpression with every name aliased
+(timestamp is a reserved word), so DynamoDB leaves the rest - notably content - on the
+server.  The key attributes and note_id are always included so items stay addressable,
+and version so the page still gets a cheap ETag.
+
+'''
+NOTE_KEY_FIELDS = ('user_id', 'timestamp', 'note_id', 'version')
+NOTE_VIEWS = {
+    'summary': ('title', 'cat')
+}
+PROJECTION_MAX_FIELDS = 20
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]{0,63}$')
+
+'''
+Returns the list of attributes to project, None for the whole item, or raises
+ValueError for an unknown view or a malformed field name.
+'''
+def parseProjection(query):
+    if not query:
+        return None
+    fields = []
+    if query.get('view'):
+        if query['view'] not in NOTE_VIEWS:
+            raise ValueError(f"unknown view '{query['view']}'")
+        fields.extend(NOTE_VIEWS[query['view']])
+    if query.get('fields'):
+        for name in query['fields'].split(','):
+            name = name.strip()
+            if not name:
+                continue
+            if not FIELD_NAME.match(name):
+                raise ValueError(f"invalid field '{name}'")
+            fields.append(name)
+    if not fields:
+        return None
+    projected = list(NOTE_KEY_FIELDS)
+    for name in fields:
+        if name not in projected:
+            projected.append(name)
+    if len(projected) > PROJECTION_MAX_FIELDS:
+        raise ValueError(f"at most {PROJECTION_MAX_FIELDS} fields")
+    return projected
+
+def projectionParams(fields):
+    names = {'#p' + str(i): name for i, name in enumerate(fields)}
+    return ', '.join(names), names
+
+
+'''
+Route: GET /notes
+
+Get multiple notes from the user (max count=5, default), user_id is in the headers.
+The body is {"Items": [...], "Count": n, "next": <cursor or null>}; pass 'next' back
+as ?cursor= to fetch the following page.  ?fields= / ?view=summary trim each item.
+?from= / ?to= (unixtime, inclusive) restrict the page to a range of the timestamp sort
+key, which the Query does with BETWEEN (or >= / <= when only one end is given).
+'''
+def parseTimeRange(query):
+    bounds = []
+    for name in ('from', 'to'):
+        value = query.get(name) if query else None
+        if value in (None, ''):
+            bounds.append(None)
+            continue
+        try:
+            bounds.append(int(value))
+        except ValueError:
+            raise ValueError(f"'{name}' must be a unixtime integer")
+    if bounds[0] is not None and bounds[1] is not None and bounds[0] > bounds[1]:
+        raise ValueError("'from' is after 'to'")
+    return bounds
+
+def rangeCondition(params, start, end):
+    if start is None and end is None:
+        return
+    params.setdefault('ExpressionAttributeNames', {})['#ts'] = 'timestamp'
+    if start is not None and end is not None:
+        params['KeyConditionExpression'] += ' AND #ts BETWEEN :from AND :to'
+    elif start is not None:
+        params['KeyConditionExpression'] += ' AND #ts >= :from'
+    else:
+        params['KeyConditionExpression'] += ' AND #ts <= :to'
+    if start is not None:
+        params['ExpressionAttributeValues'][':from'] = start
+    if end is not None:
+        params['ExpressionAttributeValues'][':to'] = end
+
+'''
+The first page of GET /notes from the user's recent view (see recent_view.py), shaped
+like the Query result it replaces, or None when the view can't answer it.
+
+'''
+def recentPage(user_id, limit, fields):
+    view = table.get_item(TableName=tablename, Key=recent_view.viewKey(user_id)).get('Item')
+    notes = recent_view.firstPage(view, limit)
+    if notes is None:
+        return None
+    if fields:
+        projected = codec.projectedFields(fields)
+        notes = [{name: value for name, value in note.items() if name in projected} for note in notes]
+    result = {
+        'Items': notes,
+        'Count': len(notes)
+    }
+    if len(notes) == limit:
+        # a Limit-ed Query hands back a LastEvaluatedKey whenever the page is full
+        result['LastEvaluatedKey'] = {'user_id': user_id, 'timestamp': notes[-1]['timestamp']}
+    return result
+
+@instrumentation.instrument('get_notes')
+@throttle.guard
+def get_notes_handler(event, context):
+    mylambdafunction='get_notes'
+    try:
+        # parse limit from queryStringParameters, capped server side
+        query = event['queryStringParameters']
+        try:
+            limit = int(query['limit']) if query and 'limit' in query else NOTES_PAGE_DEFAULT
+            # legacy ?start=<timestamp>, superseded by ?cursor=
+            legacy_start = int(query['start']) if query and query.get('start') not in (None, '') else 0
+        except (TypeError, ValueError):
+            return badRequest(mylambdafunction, "'limit' and 'start' must be integers")
+        limit = max(1, min(limit, NOTES_PAGE_MAX))
+        try:
+            fields = parseProjection(query)
+            start, end = parseTimeRange(query)
+        except ValueError as err:
+            return badRequest(mylambdafunction, err)
+        # parse user_id from headers
+        user_id = getUserId(event.get('headers') or {})
+        if user_id is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' in 'headers'")
+
+        # query to get all notes (up to limit) matching field user_id
+        params = {
+            'TableName': tablename,
+            'KeyConditionExpression': 'user_id = :uid',
+            'ExpressionAttributeValues': {
+                ':uid':  user_id
+            },
+            'Limit': limit,
+            'ScanIndexForward': False
+
+        }
+        if fields:
+            params['ProjectionExpression'], params['ExpressionAttributeNames'] = projectionParams(codec.projectedFields(fields))
+        rangeCondition(params, start, end)
+
+        # resume from an opaque cursor handed out with the previous page, or (legacy)
+        # from a bare start timestamp
+        startKey = None
+        if query and query.get('cursor'):
+            startKey = decodeCursor(query['cursor'], user_id)
+            if startKey is None:
+                return badRequest(mylambdafunction, "Invalid 'cursor'")
+        elif legacy_start > 0:
+            startKey = {
+                'user_id': user_id,
+                'timestamp': legacy_start
+            }
+        if startKey:
+            params['ExclusiveStartKey'] = startKey
+
+        data = None
+        headers = getResponseHeaders()
+        if table:
+            result = None
+            if startKey is None and start is None and end is None and limit <= recent_view.VIEW_SIZE:
+                result = recentPage(user_id, limit, fields)
+            if result is None:
+                result = table.query(**params)
+            data = {
+                'Items': codec.decodeNotes(result.get('Items', [])),
+                'Count': result.get('Count', 0),
+                'next': encodeCursor(result['LastEvaluatedKey'], user_id) if 'LastEvaluatedKey' in result else None
+            }
+            headers['ETag'] = etag.pageTag(data['Items'], data['next'], ','.join(fields or ()))
+            if etag.matches(getHeader(event.get('headers'), 'If-None-Match'), headers['ETag']):
+                return notModified(event, headers)
+        else:
+            # running from the command line
+            data = params
+            logger.info("Running "+mylambdafunction+"() in testmode")
+
+        response = {
+            'statusCode': 200,
+            'headers': headers,
+            'body': dumps(data)
+        }
+        return encodeResponse(event, response)
+
+
+    # handle bad stuff
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError': # Generic error
+            # We grab the message, request ID, and HTTP code to give to customer support
+            logger.critical(mylambdafunction + ' Error Message: {}'.format(err.response['Error']['Message']))
+            logger.critical(mylambdafunction + ' Request ID: {}'.format(err.response['ResponseMetadata']['RequestId']))
+            logger.critical(mylambdafunction + ' Http code: {}'.format(err.response['ResponseMetadata']['HTTPStatusCode']))
+            raise err
+        else:
+            errbody= {
+                'lambdafunction' : mylambdafunction,
+                'code' : err.response['Error']['Code'],
+                'message' : err.response['Error']['Message']
+            }
+            errorresponse = {
+                'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
+                'headers': getResponseHeaders(),
+                'body': json.dumps( errbody )
             }
-        item['user_name'] = getUserName(event['headers'])
-        if item['user_name'] is None:
+            return errorresponse
+
+'''
+Route: GET /notes/search?q=<words>&limit=<n>
+
+Full-text search over the user's note titles and content.  Reads one posting item per
+query term, intersects them, and fetches the newest 'limit' matching notes by key.
+'''
+SEARCH_PAGE_DEFAULT = 20
+
+@instrumentation.instrument('search_notes')
+@throttle.guard
+def search_notes_handler(event, context):
+    mylambdafunction='search_notes'
+    try:
+        query = event.get('queryStringParameters') or {}
+        terms = search_index.queryTerms(query.get('q') or '')
+        if not terms:
+            return badRequest(mylambdafunction, "'q' has no searchable words")
+        try:
+            limit = int(query['limit']) if 'limit' in query else SEARCH_PAGE_DEFAULT
+        except (TypeError, ValueError):
+            return badRequest(mylambdafunction, "'limit' must be an integer")
+        limit = max(1, min(limit, NOTES_PAGE_MAX))
+        # parse user_id from headers
+        user_id = getUserId(event.get('headers') or {})
+        if user_id is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' in 'headers'")
+
+        keys = [search_index.postingKey(user_id, term) for term in terms]
+        if table is None:
+            # running from the command line
+            logger.info("Running "+mylambdafunction+"() in testmode")
             return {
-                'statusCode': 400,
-                'error': "Cannot find 'app_user_name' in 'headers'",
-                'headers': json.dumps(headers, cls=DecimalEncoder)
+                'statusCode': 200,
+                'headers': getResponseHeaders(),
+                'body': dumps({'Keys': keys})
+            }
+
+        matched = search_index.matchTimestamps(batchGetItems(keys), terms)
+        notes = batchGetItems([{'user_id': user_id, 'timestamp': ts} for ts in matched[:limit]])
+        notes.sort(key=lambda note: note['timestamp'], reverse=True)
+        return encodeResponse(event, {
+            'statusCode': 200,
+            'body': dumps({'Items': notes, 'Count': len(notes), 'matches': len(matched)})
+        })
+
+
+    # handle bad stuff
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError': # Generic error
+            # We grab the message, request ID, and HTTP code to give to customer support
+            logger.critical(mylambdafunction + ' Error Message: {}'.format(err.response['Error']['Message']))
+            logger.critical(mylambdafunction + ' Request ID: {}'.format(err.response['ResponseMetadata']['RequestId']))
+            logger.critical(mylambdafunction + ' Http code: {}'.format(err.response['ResponseMetadata']['HTTPStatusCode']))
+            raise err
+        else:
+            errbody= {
+                'lambdafunction' : mylambdafunction,
+                'code' : err.response['Error']['Code'],
+                'message' : err.response['Error']['Message']
+            }
+            errorresponse = {
+                'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
+                'headers': getResponseHeaders(),
+                'body': json.dumps( errbody )
             }
-        # parse timestamp from item
-        if item['timestamp'] is None:
+            return errorresponse
+
+'''
+Route: GET /notes/changes?since=<watermark>&limit=<n>
+
+Incremental sync: everything that happened to the user's notes after 'since' (the
+'watermark' returned by the previous call).  The body is
+{"Items": [notes created or updated], "deleted": [{"note_id", "timestamp"}],
+ "watermark": <pass back as since>, "more": <true if another call is needed>}.
+A watermark older than the feed's retention gets a 410 carrying a fresh watermark:
+re-fetch GET /notes in full and sync from that watermark afterwards.
+Changes show up change_feed.SAFETY_LAG (5 s by default) after they were made: reads
+stop that far behind the present so a change still landing from another container
+can't be skipped by a watermark that already moved past it.
+'''
+CHANGES_PAGE_DEFAULT = 100
+CHANGES_PAGE_MAX = 1000
+
+@instrumentation.instrument('get_note_changes')
+@throttle.guard
+def get_note_changes_handler(event, context):
+    mylambdafunction='get_note_changes'
+    try:
+        query = event.get('queryStringParameters') or {}
+        try:
+            since = int(query.get('since', 0))
+            limit = int(query['limit']) if 'limit' in query else CHANGES_PAGE_DEFAULT
+        except (TypeError, ValueError):
+            return badRequest(mylambdafunction, "'since' and 'limit' must be integers")
+        limit = max(1, min(limit, CHANGES_PAGE_MAX))
+        # parse user_id from headers
+        user_id = getUserId(event.get('headers') or {})
+        if user_id is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' in 'headers'")
+
+        now = change_feed.sequence()
+        horizon = change_feed.horizon(now)
+        if since < change_feed.oldestWatermark(now):
             return {
-                'statusCode': 400,
-                'error': "Cannot find 'timestamp' in 'Item'",
-                'headers': json.dumps(item, cls=DecimalEncoder)
+                'statusCode': 410,
+                'headers': getResponseHeaders(),
+                'body': json.dumps({'error': f"{mylambdafunction}() - 'since' is older than the change feed, re-fetch all notes", 'watermark': horizon})
             }
-        timestamp = item['timestamp']
-        if item['note_id'] is None:
+        if since >= horizon:
+            # nothing is settled past the watermark yet
+            return encodeResponse(event, {
+                'statusCode': 200,
+                'body': dumps({'Items': [], 'deleted': [], 'watermark': since, 'more': False})
+            })
+
+        params = {
+            'TableName': tablename,
+            'KeyConditionExpression': 'user_id = :feed AND #ts BETWEEN :after AND :horizon',
+            'ExpressionAttributeNames': {
+                '#ts': 'timestamp'
+            },
+            'ExpressionAttributeValues': {
+                ':feed': change_feed.feedKey(user_id),
+                ':after': since + 1,
+                ':horizon': horizon
+            },
+            'Limit': limit,
+            'ScanIndexForward': True
+        }
+        if table is None:
+            # running from the command line
+            logger.info("Running "+mylambdafunction+"() in testmode")
             return {
-                'statusCode': 400,
-                'error': "Cannot find 'note_id' in 'Item'",
-                'headers': json.dumps(item, cls=DecimalEncoder)
+                'statusCode': 200,
+                'headers': getResponseHeaders(),
+                'body': dumps(params)
+            }
+
+        result = table.query(**params)
+        changes = result.get('Items', [])
+        latest = change_feed.collapse(changes)
+        live = [change['note_ts'] for change in latest if change['op'] != 'delete']
+        found = {}
+        if live:
+            for note in batchGetItems([{'user_id': user_id, 'timestamp': ts} for ts in live]):
+                found[note['timestamp']] = note
+        notes = []
+        deleted = []
+        for change in latest:
+            note = found.get(change['note_ts'])
+            if note is not None:
+                notes.append(note)
+            else:
+                # deleted, or written and then deleted before this sync
+                deleted.append({'note_id': change['note_ref'], 'timestamp': change['note_ts']})
+        data = {
+            'Items': notes,
+            'deleted': deleted,
+            'watermark': changes[-1]['timestamp'] if changes else since,
+            'more': 'LastEvaluatedKey' in result
+        }
+        return encodeResponse(event, {
+            'statusCode': 200,
+            'body': dumps(data)
+        })
+
+
+    # handle bad stuff
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError': # Generic error
+            # We grab the message, request ID, and HTTP code to give to customer support
+            logger.critical(mylambdafunction + ' Error Message: {}'.format(err.response['Error']['Message']))
+            logger.critical(mylambdafunction + ' Request ID: {}'.format(err.response['ResponseMetadata']['RequestId']))
+            logger.critical(mylambdafunction + ' Http code: {}'.format(err.response['ResponseMetadata']['HTTPStatusCode']))
+            raise err
+        else:
+            errbody= {
+                'lambdafunction' : mylambdafunction,
+                'code' : err.response['Error']['Code'],
+                'message' : err.response['Error']['Message']
+            }
+            errorresponse = {
+                'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
+                'headers': getResponseHeaders(),
+                'body': json.dumps( errbody )
             }
+            return errorresponse
+
+'''
+Route: PATCH /note
+
+PATCH semantics: only the attributes present in Item are written, through a generated
+UpdateExpression (attributes set to null are removed).  'timestamp' and 'note_id'
+identify the note and can't be changed; 'expires' is refreshed and 'version' bumped
+in the same call.
+'''
+IMMUTABLE_FIELDS = ('user_id', 'user_name', 'timestamp', 'note_id', 'expires', 'version') + codec.STORED_FIELDS
+
+def buildNoteUpdate(item, expires):
+    names = {'#expires': 'expires', '#version': 'version'}
+    values = {':expires': expires, ':one': 1}
+    sets = ['#expires = :expires']
+    removes = []
+    changes = {}
+    stored = {}
+    for name in item:
+        if name in IMMUTABLE_FIELDS:
+            continue
+        changes[name] = item[name]
+        if name == codec.CONTENT_FIELD:
+            # large content goes in compressed, replacing whichever form was there
+            stored.update(codec.storedContent(item[name]))
+        else:
+            stored[name] = item[name]
+    for i, name in enumerate(sorted(stored)):
+        alias = '#a' + str(i)
+        names[alias] = name
+        if stored[name] is None:
+            removes.append(alias)
+        else:
+            values[':v' + str(i)] = stored[name]
+            sets.append(alias + ' = :v' + str(i))
+    expression = 'SET ' + ', '.join(sets)
+    if removes:
+        expression = expression + ' REMOVE ' + ', '.join(removes)
+    expression = expression + ' ADD #version :one'
+    return expression, names, values, changes
+
+
+@instrumentation.instrument('update_note')
+@throttle.guard
+def update_note_handler(event, context):
+    mylambdafunction='update_notes'
+    try:
+        # parse user information from headers
+        user_id = getUserId(event.get('headers') or {})
+        user_name = getUserName(event.get('headers') or {})
+        if user_id is None or user_name is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' and 'app_user_name' in 'headers'")
+
+        # parse and check the changes before anything goes to the table
+        try:
+            with instrumentation.phase('parse'):
+                body = validation.parseBody(getBody(event), validation.NOTE_BODY_MAX)
+                if 'Item' not in body:
+                    raise ValueError("Cannot find 'Item' in body")
+                item = body['Item']
+            with instrumentation.phase('validate'):
+                validation.NOTE_UPDATE.check(item)
+        except ValueError as err:
+            return badRequest(mylambdafunction, err)
+        item['user_id'] = user_id
+        item['user_name'] = user_name
+        timestamp = item['timestamp']
+
         # we are going to update the note, but not modify the time stamp because it is a key element
         # however, we will update the expiration date.
         # note that for production, there should be no expiration times
         expires = datetime.now() + timedelta(days=180)
         unix_expires = parse_float(time.mktime(expires.timetuple()))
-        item['expires'] = unix_expires
-        data = None
+        expression, names, values, changes = buildNoteUpdate(item, unix_expires)
+        # touching an indexed field means diffing search terms against the old version,
+        # and moving 'cat' means moving a counter; ALL_OLD hands the old version back
+        # without an extra read, otherwise UPDATED_NEW is all we need
+        indexed = any(name in changes for name in search_index.INDEXED_FIELDS)
+        needs_old = indexed or 'cat' in changes
+        values[':nid'] = item['note_id']
         params = {
             'TableName': tablename,
-            'Item': item,
-            'ConditionExpression': '#t = :t',
-            'ExpressionAttributeNames': {
-                '#t': 'timestamp'
+            'Key': {
+                'user_id': item['user_id'],
+                'timestamp': timestamp
             },
-            'ExpressionAttributeValues': {
-                ':t': timestamp
-            }
+            'UpdateExpression': expression,
+            # the note_id has to match too, so a stale or made-up one can't edit the note
+            'ConditionExpression': 'attribute_exists(user_id) AND note_id = :nid',
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+            'ReturnValues': 'ALL_OLD' if needs_old else 'UPDATED_NEW'
         }
+        updated = {}
         if table:
-            data = table.put_item(**params)
+            data = table.update_item(**params)
+            if notecache:
+                notecache.invalidate(item['note_id'])
+                notecache.invalidateKey(item['user_id'], timestamp)
+            if needs_old:
+                old = codec.decodeNote(data.get('Attributes', {}))
+                new = dict(old, user_id=item['user_id'], timestamp=timestamp, note_id=item['note_id'])
+                for name, value in changes.items():
+                    if value is None:
+                        new.pop(name, None)
+                    else:
+                        new[name] = value
+                if indexed:
+                    updateSearchIndex(item['user_id'], old, new)
+                updateStats(item['user_id'], note_stats.statsDelta(old, new))
+                updated = {name: value for name, value in changes.items() if value is not None}
+                updated['version'] = old.get('version', 0) + 1
+            else:
+                updated = data.get('Attributes', {})
+            recordChanges(item['user_id'], 'update', [{'note_id': item['note_id'], 'timestamp': timestamp}])
         else:
             # called from the command line
             logger.debug('Not updating table - TEST mode')
-        
+            updated = params
+
+        result = {
+            'user_id': item['user_id'],
+            'timestamp': timestamp,
+            'note_id': item['note_id']
+        }
+        result.update(updated)
         response = {
             'statusCode': 200,
-            'headers': json.dumps(getResponseHeaders()),
-            'body': json.dumps(item, cls=DecimalEncoder)
+            'headers': getResponseHeaders({'ETag': etag.noteTag(result)} if 'version' in result else None),
+            'body': dumps(result)
         }
         return response
 
@@ -519,13 +1595,500 @@ def update_note_handler(event, context):
             }
             errorresponse = {
                 'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
-                'headers': json.dumps(getResponseHeaders()),
+                'headers': getResponseHeaders(),
                 'body': json.dumps( errbody )
             }
             if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                errorresponse['debug'] = f"No matching notes with timestamp='{timestamp}'"
+                errorresponse['debug'] = f"No matching notes with timestamp='{timestamp}' and note_id='{item['note_id']}'"
+
+            return errorresponse
+'''
+Export job (not an API route): invoked directly with
+{"user_id": "...", "bucket": "...", "prefix": "..."}; bucket defaults to EXPORT_BUCKET
+and prefix to 'exports/<user_id>/'.  Writes the user's notes as NDJSON parts to S3
+(see export.py) and stops EXPORT_MARGIN_MS before the Lambda timeout; invoke it again
+with the same event until it returns complete=true.
+'''
+EXPORT_MARGIN_MS = 30000
+
+@instrumentation.instrument('export_notes')
+@throttle.guard
+def export_notes_handler(event, context):
+    user_id = event.get('user_id')
+    bucket = event.get('bucket') or environ.get('EXPORT_BUCKET')
+    if not user_id or not bucket:
+        return badRequest('export_notes', "'user_id' and 'bucket' (or EXPORT_BUCKET) are required")
+    sink = export.S3Sink(bucket, event.get('prefix') or 'exports/' + user_id + '/')
+    should_stop = None
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        should_stop = lambda: context.get_remaining_time_in_millis() < EXPORT_MARGIN_MS
+    state = export.exportNotes(table, user_id, sink, should_stop=should_stop)
+    logger.info(f"export_notes() {user_id}: {state['notes']} notes in {state['parts']} parts, complete={state['complete']}")
+    return {
+        'statusCode': 200,
+        'body': dumps(state)
+    }
+
+
+
+'''
+Bulk deletes (see bulk_delete.py).
+deleteNotes() removes notes of one user, as read from the table, with BatchWriteItem
+and applies the side effects of the ones that went in one go: the search postings
+(one DELETE per term), the change feed tombstones, the note counters and the cache.
+It returns the notes BatchWriteItem couldn't delete.
+
+'''
+def deleteNotes(user_id, notes):
+    if not notes:
+        return []
+    unprocessed = batchWriteItems([{'DeleteRequest': {'Key': {'user_id': user_id, 'timestamp': note['timestamp']}}} for note in notes])
+    failed = set(request['DeleteRequest']['Key']['timestamp'] for request in unprocessed)
+    deleted = [note for note in notes if note['timestamp'] not in failed]
+    if notecache:
+        for note in notes:
+            notecache.invalidateKey(user_id, note['timestamp'])
+    applyIndexUpdates(user_id, search_index.bulkIndexUpdates(user_id, deleted, 'DELETE'))
+    recordChanges(user_id, 'delete', deleted)
+    updateStats(user_id, note_stats.addDeltas(note_stats.statsDelta(note, None) for note in deleted))
+    return [note for note in notes if note['timestamp'] in failed]
+
+def resolveNoteRefs(user_id, refs):
+    found = {}
+    parsed = [parseNoteRef(ref) for ref in refs]
+    # only the caller's own notes, whatever the refs say
+    parsed = [(note_id, timestamp) for note_id, owner, timestamp in parsed if owner == user_id]
+    keys = [{'user_id': user_id, 'timestamp': timestamp} for note_id, timestamp in parsed if timestamp is not None]
+    for item in batchGetItems(keys):
+        found[item['note_id']] = item
+    fallback = list(dict.fromkeys(note_id for note_id, timestamp in parsed if note_id not in found))
+    if fallback:
+        with ThreadPoolExecutor(max_workers=min(GET_BY_ID_WORKERS, len(fallback))) as pool:
+            for item in pool.map(instrumentation.bind(queryNoteById), fallback):
+                if item is not None and item['user_id'] == user_id:
+                    found[item['note_id']] = item
+    return list(found.values())
+
+def queryNoteRange(user_id, start, end, limit):
+    params = {
+        'TableName': tablename,
+        'KeyConditionExpression': 'user_id = :uid',
+        'ExpressionAttributeValues': {
+            ':uid': user_id
+        },
+        'ScanIndexForward': True
+    }
+    rangeCondition(params, start, end)
+    notes = []
+    while True:
+        params['Limit'] = limit - len(notes)
+        data = table.query(**params)
+        notes.extend(codec.decodeNotes(data.get('Items', [])))
+        if 'LastEvaluatedKey' not in data:
+            return notes, False
+        if len(notes) >= limit:
+            return notes, True
+        params['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+def deadline(context, margin_ms):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return lambda: context.get_remaining_time_in_millis() < margin_ms
+
+
+'''
+Route: DELETE /notes
+
+Delete many of the user's notes in one request; the body names them by timestamps,
+by note_ids or by a time range (see bulk_delete.py).  Answers
+{"deleted": n, "failed": [timestamps], "more": bool}; while "more" is true, send the
+same request again.
+'''
+BULK_DELETE_MARGIN_MS = 500
+
+@instrumentation.instrument('delete_notes')
+@throttle.guard
+def delete_notes_handler(event, context):
+    mylambdafunction='delete_notes'
+    try:
+        user_id = getUserId(event.get('headers') or {})
+        if user_id is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' in 'headers'")
+        try:
+            with instrumentation.phase('parse'):
+                body = validation.parseBody(getBody(event), validation.BATCH_BODY_MAX)
+            with instrumentation.phase('validate'):
+                mode, value = bulk_delete.parseRequest(body)
+        except ValueError as err:
+            return badRequest(mylambdafunction, err)
+        if not table:
+            logger.info(f"Running {mylambdafunction}() in testmode")
+            return {
+                'statusCode': 200,
+                'headers': getResponseHeaders(),
+                'body': dumps({'mode': mode, 'value': value})
+            }
+
+        more = False
+        if mode == 'timestamps':
+            notes = batchGetItems([{'user_id': user_id, 'timestamp': timestamp} for timestamp in value])
+        elif mode == 'note_ids':
+            notes = resolveNoteRefs(user_id, value)
+        else:
+            notes, more = queryNoteRange(user_id, value[0], value[1], bulk_delete.MAX_NOTES)
+
+        should_stop = deadline(context, BULK_DELETE_MARGIN_MS)
+        deleted = 0
+        failed = []
+        for chunk in chunkList(notes, bulk_delete.DELETE_CHUNK):
+            if should_stop and should_stop():
+                more = True
+                break
+            left = deleteNotes(user_id, chunk)
+            deleted += len(chunk) - len(left)
+            failed.extend(note['timestamp'] for note in left)
+        return {
+            'statusCode': 200,
+            'headers': getResponseHeaders(),
+            'body': dumps({'deleted': deleted, 'failed': failed, 'more': more})
+        }
+
+
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError': # Generic error
+            # We grab the message, request ID, and HTTP code to give to customer support
+            logger.critical(mylambdafunction + ' Error Message: {}'.format(err.response['Error']['Message']))
+            logger.critical(mylambdafunction + ' Request ID: {}'.format(err.response['ResponseMetadata']['RequestId']))
+            logger.critical(mylambdafunction + ' Http code: {}'.format(err.response['ResponseMetadata']['HTTPStatusCode']))
+            raise err
+        else:
+            errbody= {
+                'lambdafunction' : mylambdafunction,
+                'code' : err.response['Error']['Code'],
+                'message' : err.response['Error']['Message']
+            }
+            errorresponse = {
+                'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
+                'headers': getResponseHeaders(),
+                'body': json.dumps( errbody )
+            }
+            return errorresponse
+
+
+
+'''
+Scheduled purge of expired notes (see bulk_delete.py): PURGE_WORKERS workers query
+the expiry buckets of the last few days in expires-index, fetch the notes they name
+and delete them per user.  Invoked with {"scan": true} it walks the whole table in
+PURGE_SCAN_SEGMENTS Scan segments instead, for notes written before the index.  The
+job stops before its timeout and the next run starts over; everything deleted is gone
+from the index and the scan by then.
+
+'''
+PURGE_WORKERS = int(environ.get('PURGE_WORKERS', 8))
+PURGE_SCAN_SEGMENTS = int(environ.get('PURGE_SCAN_SEGMENTS', 4))
+PURGE_MARGIN_MS = 30000
+
+def purgeNotes(notes):
+    by_user = {}
+    for note in notes:
+        by_user.setdefault(note['user_id'], []).append(note)
+    return sum(len(user_notes) - len(deleteNotes(user_id, user_notes)) for user_id, user_notes in by_user.items())
+
+def purgeBucket(bucket, now, should_stop=None):
+    params = dict(TableName=tablename, **bulk_delete.expiredQueryParams(bucket, now))
+    purged = 0
+    while True:
+        if should_stop and should_stop():
+            return purged, False
+        data = table.query(**params)
+        keys = [{'user_id': item['user_id'], 'timestamp': item['timestamp']} for item in data.get('Items', [])]
+        purged += purgeNotes(batchGetItems(keys))
+        if 'LastEvaluatedKey' not in data:
+            return purged, True
+        params['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+def purgeSegment(segment, total, now, should_stop=None):
+    params = dict(TableName=tablename, **bulk_delete.expiredScanParams(segment, total, now))
+    purged = 0
+    while True:
+        if should_stop and should_stop():
+            return purged, False
+        data = table.scan(**params)
+        purged += purgeNotes(codec.decodeNotes(data.get('Items', [])))
+        if 'LastEvaluatedKey' not in data:
+            return purged, True
+        params['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+@instrumentation.instrument('purge_expired')
+def purge_expired_handler(event, context):
+    now = int(time.time())
+    should_stop = deadline(context, PURGE_MARGIN_MS)
+    if isinstance(event, dict) and event.get('scan'):
+        work = lambda segment: purgeSegment(segment, PURGE_SCAN_SEGMENTS, now, should_stop)
+        parts = range(PURGE_SCAN_SEGMENTS)
+        workers = PURGE_SCAN_SEGMENTS
+    else:
+        work = lambda bucket: purgeBucket(bucket, now, should_stop)
+        parts = bulk_delete.expiredBuckets(now)
+        workers = PURGE_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(instrumentation.bind(work), parts))
+    purged = sum(count for count, complete in results)
+    complete = all(complete for count, complete in results)
+    logger.info(f"purge_expired() deleted {purged} expired notes, complete={complete}")
+    return {
+        'purged': purged,
+        'complete': complete
+    }
+
+
+'''
+Route: GET /notes/stats
+
+The user's note counts, {"notes": n, "categories": {"<cat>": n, ...}}, read from one
+counter item (see note_stats.py) whatever the number of notes.
+'''
+@instrumentation.instrument('get_note_stats')
+@throttle.guard
+def get_note_stats_handler(event, context):
+    mylambdafunction='get_note_stats'
+    try:
+        user_id = getUserId(event.get('headers') or {})
+        if user_id is None:
+            return badRequest(mylambdafunction, "Cannot find 'app_user_id' in 'headers'")
+        item = None
+        if table:
+            item = table.get_item(TableName=tablename, Key=note_stats.statsKey(user_id)).get('Item')
+        else:
+            logger.info(f"Running {mylambdafunction}() in testmode")
+        return {
+            'statusCode': 200,
+            'headers': getResponseHeaders(),
+            'body': dumps(note_stats.summary(item))
+        }
+
 
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] == 'InternalError': # Generic error
+            # We grab the message, request ID, and HTTP code to give to customer support
+            logger.critical(mylambdafunction + ' Error Message: {}'.format(err.response['Error']['Message']))
+            logger.critical(mylambdafunction + ' Request ID: {}'.format(err.response['ResponseMetadata']['RequestId']))
+            logger.critical(mylambdafunction + ' Http code: {}'.format(err.response['ResponseMetadata']['HTTPStatusCode']))
+            raise err
+        else:
+            errbody= {
+                'lambdafunction' : mylambdafunction,
+                'code' : err.response['Error']['Code'],
+                'message' : err.response['Error']['Message']
+            }
+            errorresponse = {
+                'statusCode': err.response['ResponseMetadata']['HTTPStatusCode'],
+                'headers': getResponseHeaders(),
+                'body': json.dumps( errbody )
+            }
             return errorresponse
+
+
+
+'''
+Reconciliation of the note counters, run on a schedule (and once after deployment).
+Invoked with {"user_id": ...} it recounts that one user.  Otherwise it scans the whole
+table in STATS_SCAN_SEGMENTS parallel segments, and every user whose counters look
+off is recounted on its own: the stats item is read before the user's notes, so an
+ADD that lands during the recount changes 'revision' and the correction is skipped
+until the next run rather than overwriting it.
+The scan stops STATS_SCAN_MARGIN_MS before the Lambda timeout and the recounts
+STATS_MARGIN_MS before it; the job then returns complete=false with where it got to,
+and is invoked again with that result as its event until it returns complete=true.
+A user whose notes straddle the stop is only half counted and so looks off; the
+recount puts that right (or finds nothing to fix).
+
+'''
+STATS_SCAN_SEGMENTS = int(environ.get('STATS_SCAN_SEGMENTS', 4))
+STATS_SCAN_MARGIN_MS = 120000
+STATS_MARGIN_MS = 15000
+
+def reconcileUser(user_id):
+    seen = table.get_item(TableName=tablename, Key=note_stats.statsKey(user_id), ConsistentRead=True).get('Item')
+    params = {
+        'TableName': tablename,
+        'KeyConditionExpression': 'user_id = :uid',
+        'ExpressionAttributeValues': {
+            ':uid': user_id
+        },
+        'ProjectionExpression': '#cat',
+        'ExpressionAttributeNames': {
+            '#cat': 'cat'
+        },
+        'ConsistentRead': True
+    }
+    counted = {}
+    while True:
+        data = table.query(**params)
+        for name, value in note_stats.countNotes(data.get('Items', [])).items():
+            counted[name] = counted.get(name, 0) + value
+        if 'LastEvaluatedKey' not in data:
+            break
+        params['ExclusiveStartKey'] = data['LastEvaluatedKey']
+    counted = {name: value for name, value in counted.items() if value}
+    if counted == note_stats.counters(seen) or (not counted and seen is None):
+        return False
+    try:
+        table.put_item(TableName=tablename, **note_stats.reconcileParams(user_id, counted, seen))
+    except botocore.exceptions.ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info(f"reconcile_stats() {user_id} changed while counting, left for the next run")
+        return False
+    logger.info(f"reconcile_stats() {user_id}: {note_stats.counters(seen)} -> {counted}")
+    return True
+
+def scanStatsSegment(segment, total, start=None, should_stop=None):
+    counted = {}
+    seen = {}
+    params = {
+        'TableName': tablename,
+        'Segment': segment,
+        'TotalSegments': total
+    }
+    if start:
+        params['ExclusiveStartKey'] = start
+    while True:
+        if should_stop and should_stop():
+            return counted, seen, params.get('ExclusiveStartKey'), False
+        data = table.scan(**params)
+        for item in data.get('Items', []):
+            if 'note_id' in item:
+                counted.setdefault(item['user_id'], Counter()).update(note_stats.statsDelta(None, item))
+            elif note_stats.isStatsKey(item['user_id']):
+                seen[item['user_id'][len(note_stats.STATS_PREFIX):]] = item
+        if 'LastEvaluatedKey' not in data:
+            return counted, seen, None, True
+        params['ExclusiveStartKey'] = data['LastEvaluatedKey']
+
+@instrumentation.instrument('reconcile_stats')
+def reconcile_stats_handler(event, context):
+    event = event if isinstance(event, dict) else {}
+    if event.get('user_id'):
+        fixed = reconcileUser(event['user_id'])
+        return {
+            'users': 1,
+            'fixed': int(fixed)
+        }
+    # where an earlier invocation stopped: per segment, the key to go on from or done
+    segments = event.get('segments') or [{'cursor': None, 'done': False} for _ in range(STATS_SCAN_SEGMENTS)]
+    scan_stop = deadline(context, STATS_SCAN_MARGIN_MS)
+    should_stop = deadline(context, STATS_MARGIN_MS)
+
+    def scan(segment):
+        if segments[segment]['done']:
+            return {}, {}, None, True
+        return scanStatsSegment(segment, len(segments), segments[segment]['cursor'], scan_stop)
+
+    counted = {}
+    seen = {}
+    with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        results = list(pool.map(instrumentation.bind(scan), range(len(segments))))
+    for segment, (segment_counted, segment_seen, cursor, done) in enumerate(results):
+        # a user's notes all sit in one partition, so in one segment
+        counted.update(segment_counted)
+        seen.update(segment_seen)
+        segments[segment] = {'cursor': serializer.plain(cursor), 'done': done}
+    users = set(counted) | set(seen)
+    pending = list(event.get('pending') or [])
+    pending.extend(user_id for user_id in users if counted.get(user_id, {}) != note_stats.counters(seen.get(user_id)))
+    fixed = 0
+    while pending and not (should_stop and should_stop()):
+        fixed += reconcileUser(pending.pop())
+    complete = not pending and all(segment['done'] for segment in segments)
+    logger.info(f"reconcile_stats() {len(users)} users, {fixed} fixed, complete={complete}")
+    result = {
+        'users': len(users),
+        'fixed': fixed,
+        'complete': complete
+    }
+    if not complete:
+        result['segments'] = segments
+        result['pending'] = pending
+    return result
+
+
+
+'''
+DynamoDB stream consumer for the notes table: rebuilds the recent view of every user
+whose notes changed in the batch (see recent_view.py).  A user whose rebuild fails is
+reported back by its first record's sequence number, so Lambda retries from there
+(the function is set up with ReportBatchItemFailures).
+
+'''
+def refreshRecentView(user_id):
+    data = table.query(TableName=tablename, **recent_view.queryParams(user_id))
+    table.put_item(TableName=tablename, Item=recent_view.buildView(user_id, data.get('Items', [])))
+
+@instrumentation.instrument('recent_view_stream')
+@throttle.guard
+def recent_view_stream_handler(event, context):
+    failures = []
+    users = recent_view.streamUsers(event.get('Records') or [])
+    for user_id, sequence in users.items():
+        try:
+            refreshRecentView(user_id)
+        except botocore.exceptions.ClientError as err:
+            logger.error(f"recent_view_stream() failed for {user_id}: {err.response['Error']['Code']} {err.response['Error']['Message']}")
+            failures.append({'itemIdentifier': sequence})
+    return {
+        'batchItemFailures': failures
+    }
+
+
+
+'''
+Single entry point:
+When the stack is deployed from template-router.yaml, every route is served by one
+function whose handler is app.router_handler.  API Gateway hands us the route template
+in event['resource'] (e.g. '/note/t/{timestamp}'), so dispatch is one dict lookup on
+(httpMethod, resource) into the same handlers the per-route functions use.
+
+'''
+ROUTES = {
+    ('POST', '/note'): add_note_handler,
+    ('POST', '/notes/batch'): add_notes_batch_handler,
+    ('DELETE', '/note/t/{timestamp}'): delete_note_handler,
+    ('GET', '/note/n/{note_id}'): get_note_handler,
+    ('GET', '/notes/by-id'): get_notes_by_id_handler,
+    ('GET', '/notes'): get_notes_handler,
+    ('GET', '/notes/search'): search_notes_handler,
+    ('GET', '/notes/changes'): get_note_changes_handler,
+    ('GET', '/notes/stats'): get_note_stats_handler,
+    ('DELETE', '/notes'): delete_notes_handler,
+    ('PATCH', '/note'): update_note_handler,
+}
+ROUTE_METHODS = {}
+for method, resource in ROUTES:
+    ROUTE_METHODS.setdefault(resource, []).append(method)
+
+def router_handler(event, context):
+    method = (event.get('httpMethod') or '').upper()
+    resource = event.get('resource') or ''
+    handler = ROUTES.get((method, resource))
+    if handler is not None:
+        return handler(event, context)
+    if resource in ROUTE_METHODS:
+        headers = getResponseHeaders()
+        headers['Allow'] = ', '.join(ROUTE_METHODS[resource])
+        return {
+            'statusCode': 405,
+            'headers': headers,
+            'body': json.dumps({'error': f"Method {method} not allowed on {resource}"})
+        }
+    return {
+        'statusCode': 404,
+        'headers': getResponseHeaders(),
+        'body': json.dumps({'error': f"No route for {method} {resource}"})
+    }
+
+
 ##########################################################################################
 if __name__ == '__main__':
     c = {"foo":"bar"}
@@ -555,6 +2118,6 @@ if __name__ == '__main__':
 #    print ("\n\ndelete_note_handler() Returning:\n" + json.dumps(delete_note_handler(e,c), indent=4))
 #    print ("\n\nget_note_handler() Returning:\n" + json.dumps(get_note_handler(e,c), indent=4))
 #    print ("\n\nget_notes_handler() Returning:\n" + json.dumps(get_notes_handler(e,c), indent=4))
-#    print ("\n\nupdate_note_handler() Returning:\n" + json.dumps(update_note_handler(e,c), indent=4, cls=DecimalEncoder))
+#    print ("\n\nupdate_note_handler() Returning:\n" + json.dumps(serializer.plain(update_note_handler(e,c)), indent=4))
     
 
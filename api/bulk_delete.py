@@ -0,0 +1,117 @@
+import time
+import zlib
+from os import environ
+'''
+bulk_delete:
+Request parsing and query parameters for DELETE /notes and the expired-note purge job.
+
+DELETE /notes takes a JSON body naming the notes in exactly one way,
+
+    {"timestamps": [1723331552, ...]}        the notes' sort keys
+    {"note_ids": ["<note_id>", ...]}         note_ids, optionally '<note_id>:<timestamp>'
+    {"from": 1723000000, "to": 1723999999}   a range of timestamps (either end optional)
+
+An invocation deletes at most MAX_NOTES notes, DELETE_CHUNK at a time, and answers
+"more": true when there are more; sending the same request again carries on.
+
+The purge job finds expired notes in expires-index, a sparse KEYS_ONLY index on
+'expires_bucket' (the expiry day plus one of EXPIRY_SHARDS shards picked by user) and
+'expires', querying the last PURGE_LOOKBACK_DAYS days of buckets in parallel.
+
+'''
+MAX_NOTES = 1000
+MAX_REFS = MAX_NOTES
+DELETE_CHUNK = 100
+
+
+def _int(value, name):
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' must be a unixtime integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a unixtime integer")
+
+
+'''
+Returns (mode, value) for a DELETE /notes body, or raises ValueError.
+'value' is a list of timestamps, a list of note refs, or a (from, to) pair.
+
+'''
+def parseRequest(body):
+    if not isinstance(body, dict):
+        raise ValueError("body must be a JSON object")
+    given = [name for name in ('timestamps', 'note_ids') if name in body]
+    if 'from' in body or 'to' in body:
+        given.append('range')
+    if len(given) != 1:
+        raise ValueError("give exactly one of 'timestamps', 'note_ids' or 'from'/'to'")
+    mode = given[0]
+    if mode == 'range':
+        start = _int(body['from'], 'from') if body.get('from') is not None else None
+        end = _int(body['to'], 'to') if body.get('to') is not None else None
+        if start is None and end is None:
+            raise ValueError("'from' or 'to' is required")
+        if start is not None and end is not None and start > end:
+            raise ValueError("'from' is after 'to'")
+        return mode, (start, end)
+    values = body[mode]
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"'{mode}' must be a non-empty list")
+    if len(values) > MAX_REFS:
+        raise ValueError(f"at most {MAX_REFS} {mode} per request")
+    if mode == 'timestamps':
+        return mode, list(dict.fromkeys(_int(value, 'timestamps') for value in values))
+    if not all(isinstance(value, str) and value for value in values):
+        raise ValueError("'note_ids' must be strings")
+    return mode, list(dict.fromkeys(values))
+
+
+def expiredScanParams(segment, total, now=None):
+    if now is None:
+        now = int(time.time())
+    return {
+        'Segment': segment,
+        'TotalSegments': total,
+        'FilterExpression': 'attribute_exists(note_id) AND expires < :now',
+        'ExpressionAttributeValues': {
+            ':now': now
+        }
+    }
+
+
+EXPIRY_INDEX = 'expires-index'
+EXPIRY_BUCKET = 'expires_bucket'
+EXPIRY_SHARDS = int(environ.get('EXPIRY_SHARDS', 8))
+PURGE_LOOKBACK_DAYS = int(environ.get('PURGE_LOOKBACK_DAYS', 7))
+DAY = 86400
+
+
+def expiryBucket(user_id, expires):
+    return '%d#%d' % (int(expires) // DAY, zlib.crc32(user_id.encode('utf-8')) % EXPIRY_SHARDS)
+
+
+def expiredBuckets(now=None, days=None):
+    if now is None:
+        now = int(time.time())
+    today = int(now) // DAY
+    days = PURGE_LOOKBACK_DAYS if days is None else days
+    return ['%d#%d' % (day, shard) for day in range(today - days, today + 1) for shard in range(EXPIRY_SHARDS)]
+
+
+def expiredQueryParams(bucket, now=None):
+    if now is None:
+        now = int(time.time())
+    return {
+        'IndexName': EXPIRY_INDEX,
+        'KeyConditionExpression': '#bucket = :bucket AND expires < :now',
+        'ProjectionExpression': 'user_id, #ts',
+        'ExpressionAttributeNames': {
+            '#bucket': EXPIRY_BUCKET,
+            '#ts': 'timestamp'
+        },
+        'ExpressionAttributeValues': {
+            ':bucket': bucket,
+            ':now': now
+        }
+    }
@@ -0,0 +1,125 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+'''
+cache:
+Per-container caches that survive across warm invocations.
+
+TTLCache is a bounded LRU whose entries also expire after 'ttl' seconds, with
+hit/miss/eviction counters so we can see whether it is earning its keep.
+NoteCache keys notes by note_id and also remembers each note's primary key
+(user_id, timestamp), because DELETE /note/t/{timestamp} only knows the latter.
+
+'''
+class TTLCache(object):
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, deadline = entry
+            if deadline <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, self.clock() + self.ttl)
+            while len(self.entries) > self.maxsize:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    # subclasses hook this to keep secondary indexes in step; caller holds the lock
+    def _remove(self, key):
+        del self.entries[key]
+
+
+class NoteCache(TTLCache):
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        super().__init__(maxsize, ttl, clock)
+        self.keys = {}
+
+    def putNote(self, note):
+        if 'note_id' not in note:
+            return
+        self.put(note['note_id'], dict(note))
+        with self.lock:
+            if note['note_id'] in self.entries and 'timestamp' in note:
+                self.keys[(note.get('user_id'), note['timestamp'])] = note['note_id']
+
+    def invalidateKey(self, user_id, timestamp):
+        with self.lock:
+            note_id = self.keys.get((user_id, timestamp))
+            if note_id is not None and note_id in self.entries:
+                self._remove(note_id)
+
+    def _remove(self, key):
+        value, deadline = self.entries.pop(key)
+        self.keys.pop((value.get('user_id'), value.get('timestamp')), None)
+
+
+'''
+Build the note cache from NOTE_CACHE_SIZE (entries, 0 turns it off) and
+NOTE_CACHE_TTL (seconds).  Returns None when caching is disabled.
+
+'''
+def noteCacheFromEnvironment(environ=os.environ):
+    size = int(environ.get('NOTE_CACHE_SIZE', '256'))
+    ttl = float(environ.get('NOTE_CACHE_TTL', '30'))
+    if size <= 0 or ttl <= 0:
+        return None
+    return NoteCache(size, ttl)
+
+
+'''
+Build the in-container cache of finished idempotent responses from
+IDEMPOTENCY_CACHE_SIZE and IDEMPOTENCY_CACHE_TTL, like the note cache.
+
+'''
+def idempotencyCacheFromEnvironment(environ=os.environ):
+    size = int(environ.get('IDEMPOTENCY_CACHE_SIZE', '256'))
+    ttl = float(environ.get('IDEMPOTENCY_CACHE_TTL', '300'))
+    if size <= 0 or ttl <= 0:
+        return None
+    return TTLCache(size, ttl)
@@ -0,0 +1,86 @@
+import threading
+import time
+from os import environ
+'''
+change_feed:
+A per-user log of note writes that GET /notes/changes reads to sync a client.
+Every create, update and delete appends one item to 'changes#<user_id>':
+
+    timestamp = microseconds since the epoch when the change was recorded
+    op        = 'put' | 'update' | 'delete'
+    note_ref  = the note's note_id
+    note_ts   = the note's timestamp (its sort key)
+    expires   = unixtime after which the TTL sweeper drops the change
+
+A change's timestamp comes from the writing container's clock before its put lands,
+so reads stop SAFETY_LAG behind the present (CHANGE_FEED_LAG_SECONDS, default 5, more
+than a write's time in flight) and a late change still sorts after any watermark
+handed out.  Changes are kept for RETENTION_DAYS; an older watermark gets a 410.
+
+'''
+FEED_PREFIX = 'changes#'
+RETENTION_DAYS = 30
+SAFETY_LAG = int(environ.get('CHANGE_FEED_LAG_SECONDS', 5)) * 1000000 # microseconds
+
+_lock = threading.Lock()
+_last = 0
+
+
+def feedKey(user_id):
+    return FEED_PREFIX + user_id
+
+
+def isFeedKey(user_id):
+    return isinstance(user_id, str) and user_id.startswith(FEED_PREFIX)
+
+
+def sequence():
+    # microsecond clock, forced strictly increasing within the container so the
+    # changes of one batch never share a sort key
+    global _last
+    with _lock:
+        _last = max(time.time_ns() // 1000, _last + 1)
+        return _last
+
+
+'''
+The newest sequence a read may return: SAFETY_LAG behind now.
+
+'''
+def horizon(now=None):
+    if now is None:
+        now = sequence()
+    return now - SAFETY_LAG
+
+
+def oldestWatermark(now=None):
+    if now is None:
+        now = sequence()
+    return now - RETENTION_DAYS * 86400 * 1000000
+
+
+def changeItem(user_id, op, note, seq=None):
+    if seq is None:
+        seq = sequence()
+    return {
+        'user_id': feedKey(user_id),
+        'timestamp': seq,
+        'op': op,
+        'note_ref': note['note_id'],
+        'note_ts': note['timestamp'],
+        'expires': seq // 1000000 + RETENTION_DAYS * 86400
+    }
+
+
+'''
+Fold a run of change items (oldest first) down to the last change per note, keeping
+the order in which each note last changed.
+
+'''
+def collapse(changes):
+    latest = {}
+    for change in changes:
+        key = change['note_ts']
+        latest.pop(key, None)
+        latest[key] = change
+    return list(latest.values())
@@ -0,0 +1,115 @@
+import zlib
+from os import environ
+'''
+codec:
+Storage encoding for note content.
+
+DynamoDB bills reads per 4 KB and writes per 1 KB of item size, and note text
+compresses well, so content at or above COMPRESS_THRESHOLD bytes (UTF-8) is stored as
+
+    content_z     = zlib-compressed UTF-8 content (Binary)
+    content_codec = 'zlib'
+
+in place of the plain 'content' string.  Content that doesn't shrink is left alone.
+Handlers call encodeNote() on the way into the table and decodeNote() on the way out,
+so clients, the search index and the note cache only ever see 'content'.
+
+NOTE_COMPRESS_THRESHOLD sets the threshold (default 1024 bytes, 0 turns compression
+off); NOTE_COMPRESS_LEVEL sets the zlib level (default 6).
+
+'''
+CONTENT_FIELD = 'content'
+STORED_FIELD = 'content_z'
+CODEC_FIELD = 'content_codec'
+CODEC = 'zlib'
+# attributes only the codec writes
+STORED_FIELDS = (STORED_FIELD, CODEC_FIELD)
+
+
+def _setting(name, default):
+    try:
+        return int(environ.get(name, default))
+    except ValueError:
+        return default
+
+
+COMPRESS_THRESHOLD = _setting('NOTE_COMPRESS_THRESHOLD', 1024)
+COMPRESS_LEVEL = _setting('NOTE_COMPRESS_LEVEL', 6)
+
+
+def compress(text):
+    if COMPRESS_THRESHOLD <= 0 or not isinstance(text, str):
+        return None
+    raw = text.encode('utf-8')
+    if len(raw) < COMPRESS_THRESHOLD:
+        return None
+    packed = zlib.compress(raw, COMPRESS_LEVEL)
+    # the codec attribute names cost bytes too
+    if len(packed) + len(STORED_FIELD) + len(CODEC_FIELD) + len(CODEC) >= len(raw):
+        return None
+    return packed
+
+
+'''
+The attributes to store for a new content value: either the compressed pair or the plain
+string, with the other representation set to None (i.e. to be removed).  A content of
+None removes all of them.
+
+'''
+def storedContent(text):
+    if text is None:
+        return {CONTENT_FIELD: None, STORED_FIELD: None, CODEC_FIELD: None}
+    packed = compress(text)
+    if packed is None:
+        return {CONTENT_FIELD: text, STORED_FIELD: None, CODEC_FIELD: None}
+    return {CONTENT_FIELD: None, STORED_FIELD: packed, CODEC_FIELD: CODEC}
+
+
+'''
+Copy of a note as it should be written with put_item / BatchWriteItem.
+
+'''
+def encodeNote(note):
+    if CONTENT_FIELD not in note:
+        return note
+    stored = dict(note)
+    for name, value in storedContent(note[CONTENT_FIELD]).items():
+        if value is None:
+            stored.pop(name, None)
+        else:
+            stored[name] = value
+    return stored
+
+
+'''
+Turn a stored note back into its client form, in place.  Handles projected items
+that carry only some of the attributes.
+
+'''
+def decodeNote(note):
+    if not note or STORED_FIELD not in note:
+        return note
+    packed = note.pop(STORED_FIELD)
+    codec = note.pop(CODEC_FIELD, CODEC)
+    if codec != CODEC:
+        raise ValueError(f"unknown content codec '{codec}'")
+    # boto3 hands Binary attributes back wrapped in a Binary object
+    packed = getattr(packed, 'value', packed)
+    note[CONTENT_FIELD] = zlib.decompress(bytes(packed)).decode('utf-8')
+    return note
+
+
+def decodeNotes(notes):
+    for note in notes:
+        decodeNote(note)
+    return notes
+
+
+'''
+The stored attribute names to project when a client asks for 'content'.
+
+'''
+def projectedFields(fields):
+    if CONTENT_FIELD in fields:
+        return list(fields) + [name for name in STORED_FIELDS if name not in fields]
+    return fields
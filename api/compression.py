@@ -0,0 +1,80 @@
+import base64
+import gzip
+from os import environ
+'''
+compression:
+Content-Encoding negotiation for API Gateway responses.
+
+negotiate() picks the best coding the client lists in Accept-Encoding (brotli when the
+brotli module is installed, then gzip), honouring q-values and q=0 exclusions.
+compressBody() encodes a JSON body and base64s it, since a Lambda proxy response body
+must be text; the handler marks the response isBase64Encoded and API Gateway turns it
+back into bytes (the API needs '*/*' among its binary media types for that).
+
+Bodies shorter than RESPONSE_COMPRESS_MIN bytes (default 1400, about one packet) go
+out as they are: below that the CPU time costs more than the bytes saved.
+RESPONSE_COMPRESS_LEVEL sets the gzip level (default 5); brotli uses BROTLI_QUALITY.
+
+'''
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _setting(name, default):
+    try:
+        return int(environ.get(name, default))
+    except ValueError:
+        return default
+
+
+COMPRESS_MIN = _setting('RESPONSE_COMPRESS_MIN', 1400)
+GZIP_LEVEL = _setting('RESPONSE_COMPRESS_LEVEL', 5)
+BROTLI_QUALITY = 5
+
+
+def supported():
+    # in order of preference
+    if brotli is not None:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+'''
+The coding to use for a client's Accept-Encoding header, or None for identity.
+
+'''
+def negotiate(accept_encoding):
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+    best = None
+    best_weight = 0.0
+    for coding in supported():
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compressBody(body, coding):
+    raw = body.encode('utf-8')
+    if coding == 'br':
+        packed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        packed = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    return base64.b64encode(packed).decode('ascii')
@@ -0,0 +1,162 @@
+import os
+'''
+dynamo:
+A small stand-in for boto3's Table resource, built on the low-level DynamoDB client.
+
+The resource layer is expensive to load (it parses the resource model JSON and builds
+classes on the fly), and app.py used to build it at import time with a hard-coded
+region.  DynamoTable keeps the same call signatures the handlers already use - plain
+Python values in, plain Python values out - but only creates the client on the first
+call, from a Config with connection pooling and TCP keep-alive turned on.
+
+'''
+
+'''
+Client configuration, all overridable per stage through environment variables.
+The region comes from the Lambda runtime (AWS_REGION) unless DYNAMODB_REGION is set.
+
+'''
+def clientConfig():
+    import botocore.config
+    return botocore.config.Config(
+        region_name=os.environ.get('DYNAMODB_REGION') or os.environ.get('AWS_REGION') or None,
+        max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', '10')),
+        tcp_keepalive=True,
+        connect_timeout=float(os.environ.get('DYNAMODB_CONNECT_TIMEOUT', '1')),
+        read_timeout=float(os.environ.get('DYNAMODB_READ_TIMEOUT', '2')),
+        # one attempt by default: throttle.py retries within the invocation's deadline
+        retries={
+            'mode': os.environ.get('DYNAMODB_RETRY_MODE', 'standard'),
+            'max_attempts': int(os.environ.get('DYNAMODB_MAX_ATTEMPTS', '1'))
+        }
+    )
+
+
+_client = None
+
+def getClient():
+    global _client
+    if _client is None:
+        # boto3 is only imported once a handler actually needs DynamoDB
+        import boto3
+        _client = boto3.client(
+            'dynamodb',
+            config=clientConfig(),
+            endpoint_url=os.environ.get('DYNAMODB_ENDPOINT_URL') or None
+        )
+    return _client
+
+
+_serializer = None
+_deserializer = None
+
+def serialize(value):
+    global _serializer
+    if _serializer is None:
+        from boto3.dynamodb.types import TypeSerializer
+        _serializer = TypeSerializer()
+    return _serializer.serialize(value)
+
+def deserialize(value):
+    global _deserializer
+    if _deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+        _deserializer = TypeDeserializer()
+    return _deserializer.deserialize(value)
+
+def toWire(item):
+    return {k: serialize(v) for k, v in item.items()}
+
+def fromWire(item):
+    return {k: deserialize(v) for k, v in item.items()}
+
+
+# request parameters / response fields that hold an item or a key
+_ITEM_PARAMS = ('Item', 'Key', 'ExclusiveStartKey', 'ExpressionAttributeValues')
+_ITEM_RESULTS = ('Item', 'Attributes', 'LastEvaluatedKey')
+
+
+class DynamoTable(object):
+    '''
+    Table-shaped facade over the low-level client.  Any object with the same methods
+    (see tests/fake_table.py) can be dropped in as app.table instead.
+    '''
+    def __init__(self, name, client=None):
+        self.name = name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = getClient()
+        return self._client
+
+    def _request(self, params):
+        request = dict(params)
+        request['TableName'] = self.name
+        for field in _ITEM_PARAMS:
+            if field in request:
+                request[field] = toWire(request[field])
+        return request
+
+    def _result(self, data):
+        for field in _ITEM_RESULTS:
+            if field in data:
+                data[field] = fromWire(data[field])
+        if 'Items' in data:
+            data['Items'] = [fromWire(item) for item in data['Items']]
+        return data
+
+    def put_item(self, **params):
+        return self._result(self.client.put_item(**self._request(params)))
+
+    def get_item(self, **params):
+        return self._result(self.client.get_item(**self._request(params)))
+
+    def delete_item(self, **params):
+        return self._result(self.client.delete_item(**self._request(params)))
+
+    def update_item(self, **params):
+        return self._result(self.client.update_item(**self._request(params)))
+
+    def query(self, **params):
+        return self._result(self.client.query(**self._request(params)))
+
+    def scan(self, **params):
+        return self._result(self.client.scan(**self._request(params)))
+
+    '''
+    Batch calls take and return RequestItems keyed by table name, like the resource's
+    batch_write_item()/batch_get_item(), so UnprocessedItems/UnprocessedKeys can be fed
+    straight back in on retry.
+    '''
+    def batch_write_item(self, RequestItems, **params):
+        wire = {}
+        for name, requests in RequestItems.items():
+            wire[name] = [self._writeRequest(request, toWire) for request in requests]
+        data = self.client.batch_write_item(RequestItems=wire, **params)
+        unprocessed = {}
+        for name, requests in (data.get('UnprocessedItems') or {}).items():
+            unprocessed[name] = [self._writeRequest(request, fromWire) for request in requests]
+        data['UnprocessedItems'] = unprocessed
+        return data
+
+    def batch_get_item(self, RequestItems, **params):
+        wire = {}
+        for name, spec in RequestItems.items():
+            wire[name] = dict(spec, Keys=[toWire(key) for key in spec['Keys']])
+        data = self.client.batch_get_item(RequestItems=wire, **params)
+        responses = {}
+        for name, items in (data.get('Responses') or {}).items():
+            responses[name] = [fromWire(item) for item in items]
+        unprocessed = {}
+        for name, spec in (data.get('UnprocessedKeys') or {}).items():
+            unprocessed[name] = dict(spec, Keys=[fromWire(key) for key in spec['Keys']])
+        data['Responses'] = responses
+        data['UnprocessedKeys'] = unprocessed
+        return data
+
+    def _writeRequest(self, request, convert):
+        if 'PutRequest' in request:
+            return {'PutRequest': {'Item': convert(request['PutRequest']['Item'])}}
+        return {'DeleteRequest': {'Key': convert(request['DeleteRequest']['Key'])}}
@@ -0,0 +1,64 @@
+import hashlib
+import serializer
+'''
+etag:
+Entity tags for conditional GETs of notes and note pages.
+
+Notes written by this API carry a 'version' attribute (1 on create, bumped by every
+PATCH), so a note's tag is a hash of its key and version and costs no serialization.
+Older notes without a version fall back to a hash of their serialized attributes, in
+sorted order so the tag doesn't depend on the order DynamoDB returned them in.
+A page's tag is a hash over the tags of its items plus whatever else shapes the body
+(the next cursor, the projected fields).
+
+A compressed body is a different representation, so app.encodeResponse() sends it with
+codedTag(), the tag with the coding appended ("...-gzip"); matches() takes either form.
+
+'''
+
+
+def digest(text):
+    return '"' + hashlib.blake2b(text.encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+
+def noteTag(note):
+    version = note.get('version')
+    if version is not None:
+        return digest(f"{note.get('user_id')}|{note.get('timestamp')}|{note.get('note_id')}|v{version}")
+    return digest(serializer.dumps(sorted(note.items(), key=lambda pair: pair[0])))
+
+
+def pageTag(notes, *extra):
+    parts = [noteTag(note) for note in notes]
+    parts.extend(str(value) for value in extra)
+    return digest('|'.join(parts))
+
+
+def codedTag(tag, coding):
+    if not coding or coding == 'identity':
+        return tag
+    return tag[:-1] + '-' + coding + '"'
+
+
+'''
+True when an If-None-Match header value names 'tag' (or is '*').
+Weak validators (W/"...") compare equal to the strong tag, as RFC 9110 asks for GETs,
+and so do the coded tags of the same body.
+
+'''
+def matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        # the digest is hex, so a '-' can only come from codedTag()
+        dash = candidate.find('-')
+        if dash != -1:
+            candidate = candidate[:dash] + '"'
+        if candidate == tag:
+            return True
+    return False
@@ -0,0 +1,205 @@
+import json
+import os
+import codec
+import serializer
+'''
+export:
+Bulk export of one user's notes as newline-delimited JSON.
+
+    exportNotes(table, user_id, sink)
+
+walks the user's partition oldest first with a paginated Query (queryNotes), turns
+the notes into NDJSON chunks of about CHUNK_BYTES each (ndjsonChunks) and hands every
+chunk to a sink.  Only one page and one chunk are held at a time, so memory stays
+flat however many notes the user has.
+
+After each chunk the sink stores a checkpoint - the key of the last note written plus
+running totals - and a later exportNotes() into the same sink picks up after that key.
+A sink is anything with write(part, data), resume(state), loadCheckpoint() and
+saveCheckpoint(state).  FileSink appends to one file, DirectorySink writes one file
+per chunk and S3Sink one object per chunk.
+
+'''
+PAGE_SIZE = 100
+CHUNK_BYTES = 1024 * 1024
+CHECKPOINT_NAME = '_checkpoint.json'
+
+
+'''
+Every note in the user's partition, oldest first, one Query page at a time.
+Derived items (search postings, the change feed) live in other partitions and never
+show up here.
+
+'''
+def queryNotes(table, user_id, start_key=None, page_size=PAGE_SIZE):
+    params = {
+        'KeyConditionExpression': 'user_id = :uid',
+        'ExpressionAttributeValues': {
+            ':uid': user_id
+        },
+        'Limit': page_size,
+        'ScanIndexForward': True
+    }
+    while True:
+        if start_key:
+            params['ExclusiveStartKey'] = start_key
+        data = table.query(TableName=table.name, **params)
+        for note in data.get('Items', []):
+            yield codec.decodeNote(note)
+        start_key = data.get('LastEvaluatedKey')
+        if not start_key:
+            return
+
+
+'''
+Group notes into NDJSON chunks; yields (data, count, last_note) with data in bytes.
+
+'''
+def ndjsonChunks(notes, chunk_bytes=CHUNK_BYTES):
+    lines = []
+    size = 0
+    last = None
+    for note in notes:
+        line = (serializer.dumps(note) + '\n').encode('utf-8')
+        lines.append(line)
+        size += len(line)
+        last = note
+        if size >= chunk_bytes:
+            yield b''.join(lines), len(lines), last
+            lines = []
+            size = 0
+    if lines:
+        yield b''.join(lines), len(lines), last
+
+
+def noteKey(note):
+    return {
+        'user_id': note['user_id'],
+        'timestamp': serializer.plain(note['timestamp'])
+    }
+
+
+'''
+Export (or resume exporting) user_id's notes into sink.  should_stop() is polled
+between chunks - the Lambda handler uses it to hand back before its timeout - and a
+stopped export returns with complete=False, ready to be resumed.
+
+'''
+def exportNotes(table, user_id, sink, page_size=PAGE_SIZE, chunk_bytes=CHUNK_BYTES, should_stop=None):
+    state = sink.loadCheckpoint()
+    if not state or state.get('user_id') != user_id:
+        state = {'user_id': user_id, 'last_key': None, 'parts': 0, 'notes': 0, 'bytes': 0, 'complete': False}
+    if state['complete']:
+        return state
+    sink.resume(state)
+    notes = queryNotes(table, user_id, state['last_key'], page_size)
+    for data, count, last in ndjsonChunks(notes, chunk_bytes):
+        sink.write(state['parts'], data)
+        state['parts'] += 1
+        state['notes'] += count
+        state['bytes'] += len(data)
+        state['last_key'] = noteKey(last)
+        sink.saveCheckpoint(state)
+        if should_stop and should_stop():
+            return state
+    state['complete'] = True
+    sink.saveCheckpoint(state)
+    return state
+
+
+def loadJson(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def replaceFile(path, data):
+    # write-then-rename, so a crash never leaves a half-written file behind
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+class FileSink(object):
+    '''
+    Appends every chunk to one file; the checkpoint sits next to it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.checkpoint = path + '.checkpoint'
+
+    def loadCheckpoint(self):
+        return loadJson(self.checkpoint)
+
+    def saveCheckpoint(self, state):
+        replaceFile(self.checkpoint, json.dumps(state).encode('utf-8'))
+
+    def resume(self, state):
+        # drop anything written after the last checkpoint (a chunk that was cut off)
+        with open(self.path, 'ab') as f:
+            f.truncate(state['bytes'])
+
+    def write(self, part, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+
+class DirectorySink(object):
+    '''
+    One file per chunk (part-00000.ndjson, ...) plus the checkpoint in a directory.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.checkpoint = os.path.join(directory, CHECKPOINT_NAME)
+        os.makedirs(directory, exist_ok=True)
+
+    def loadCheckpoint(self):
+        return loadJson(self.checkpoint)
+
+    def saveCheckpoint(self, state):
+        replaceFile(self.checkpoint, json.dumps(state).encode('utf-8'))
+
+    def resume(self, state):
+        # parts are rewritten whole, so there's nothing to trim
+        pass
+
+    def write(self, part, data):
+        replaceFile(os.path.join(self.directory, 'part-%05d.ndjson' % part), data)
+
+
+class S3Sink(object):
+    '''
+    One object per chunk under '<prefix>part-00000.ndjson', ..., plus the checkpoint
+    object.  boto3 is imported on first use.
+    '''
+    def __init__(self, bucket, prefix, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('s3')
+        return self._client
+
+    def loadCheckpoint(self):
+        try:
+            data = self.client.get_object(Bucket=self.bucket, Key=self.prefix + CHECKPOINT_NAME)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(data['Body'].read())
+
+    def saveCheckpoint(self, state):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + CHECKPOINT_NAME,
+                               Body=json.dumps(state).encode('utf-8'), ContentType='application/json')
+
+    def resume(self, state):
+        pass
+
+    def write(self, part, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + 'part-%05d.ndjson' % part,
+                               Body=data, ContentType='application/x-ndjson')
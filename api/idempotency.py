@@ -0,0 +1,102 @@
+import hashlib
+import re
+import time
+from os import environ
+'''
+idempotency:
+Idempotency-Key support for POST /note.  The request first claims its key with a
+conditional put of
+
+    user_id   = 'idem#<user_id>#<key>'
+    timestamp = 0
+    state     = 'pending' -> 'done'
+    request   = hash of the request body
+    response  = the stored response once done
+    expires   = LEASE_SECONDS after the claim while pending, TTL_SECONDS once done
+
+A retry inside the window replays the stored response, or gets 409 while the first
+attempt is still running and 422 for a different body.  An expired record counts as
+free, so a claim whose attempt crashed frees up once its lease lapses.
+IDEMPOTENCY_TTL sets the window (default 24 hours), IDEMPOTENCY_LEASE the lease
+(default 10 seconds).
+
+'''
+IDEM_PREFIX = 'idem#'
+MAX_KEY_LENGTH = 128
+TTL_SECONDS = int(environ.get('IDEMPOTENCY_TTL', 86400))
+LEASE_SECONDS = int(environ.get('IDEMPOTENCY_LEASE', 10))
+HEADER = 'Idempotency-Key'
+
+_KEY = re.compile(r'^[\x21-\x7e]{1,%d}$' % MAX_KEY_LENGTH)
+
+
+def validKey(key):
+    return isinstance(key, str) and _KEY.match(key) is not None
+
+
+def recordKey(user_id, key):
+    return {
+        'user_id': IDEM_PREFIX + user_id + '#' + key,
+        'timestamp': 0
+    }
+
+
+def isIdempotencyKey(user_id):
+    return isinstance(user_id, str) and user_id.startswith(IDEM_PREFIX)
+
+
+def requestHash(body):
+    return hashlib.sha256((body or '').encode('utf-8')).hexdigest()
+
+
+def claimParams(user_id, key, request_hash, now=None):
+    if now is None:
+        now = int(time.time())
+    item = recordKey(user_id, key)
+    item.update({
+        'state': 'pending',
+        'request': request_hash,
+        'expires': now + LEASE_SECONDS
+    })
+    return {
+        'Item': item,
+        'ConditionExpression': 'attribute_not_exists(user_id) OR expires < :now',
+        'ExpressionAttributeValues': {
+            ':now': now
+        }
+    }
+
+
+def completeParams(user_id, key, response, now=None):
+    if now is None:
+        now = int(time.time())
+    return {
+        'Key': recordKey(user_id, key),
+        'UpdateExpression': 'SET #state = :done, #response = :response, #expires = :expires',
+        'ExpressionAttributeNames': {
+            '#state': 'state',
+            '#response': 'response',
+            '#expires': 'expires'
+        },
+        'ExpressionAttributeValues': {
+            ':done': 'done',
+            ':expires': now + TTL_SECONDS,
+            ':response': {
+                'statusCode': response['statusCode'],
+                'body': response.get('body') or ''
+            }
+        }
+    }
+
+
+'''
+The response a record replays, or None when it can't be replayed (still pending).
+
+'''
+def storedResponse(record):
+    if record.get('state') != 'done' or not record.get('response'):
+        return None
+    return {
+        'statusCode': int(record['response']['statusCode']),
+        'body': record['response']['body']
+    }
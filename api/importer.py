@@ -0,0 +1,316 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import app
+import codec
+import search_index
+import validation
+'''
+importer:
+Bulk load of notes from the legacy system, streamed from NDJSON or CSV.
+
+    python api/importer.py notes.ndjson --checkpoint notes.ckpt [--workers 8]
+
+Records are read one at a time and normalized with the same stamping as POST /note
+(app.stampNote), except that
+  - the note keeps its original time when the record has one ('timestamp' / 'created',
+    unixtime), and records without one count down from the import's start time, and
+  - note_id is derived from the record's 'id' (or from its key when there is no id) with
+    uuid5, so loading the same record twice writes the same item.
+
+Normalized notes go out 25 to a BatchWriteItem on a pool of worker threads.  All the
+workers share one AdaptiveBackoff: UnprocessedItems (throttling) raise the delay every
+worker waits before its next call, clean responses lower it again.  Each chunk's search
+postings are written with one ADD per term.  Imported notes skip the change feed; a
+client syncing a migrated user has to fetch everything once anyway.  They skip the
+note counters too: invoke app.reconcile_stats_handler once the import is done.
+
+The checkpoint file records how many source records are safely written (chunks finish
+out of order, so only the completed prefix counts).  A chunk whose write raised (a
+throttling error that outlasted the retries, say) counts its notes as failed and holds
+the checkpoint before it, so the import only ends 'complete' once every record is
+accounted for, and a rerun picks the chunk up again.  A rerun with the same checkpoint
+skips those and carries on; anything after them is simply written again, which
+overwrites the same keys, so a resume never duplicates notes.  Two records with the
+same user and timestamp would be one item, so the later one is moved a second on; the
+keys handed out are kept in memory for the whole run (a resume reads the records before
+its offset again to rebuild them), which makes the move the same on every run.
+
+'''
+logger = logging.getLogger('sls_notes_importer')
+
+IMPORT_NAMESPACE = uuid.UUID('8f3c2a6e-5d0b-4a47-9a63-2f6e1b7c9d41')
+IMPORT_WORKERS = 4
+IMPORT_RETRIES = 8
+CHECKPOINT_EVERY = 20 # chunks
+MAX_ERRORS = 100
+NOTE_FIELDS = ('title', 'content', 'cat')
+
+
+def readNdjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def readCsv(stream):
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def readRecords(stream, fmt):
+    if fmt == 'csv':
+        return readCsv(stream)
+    return readNdjson(stream)
+
+
+def sourceFormat(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+'''
+One source record as a stamped note Item; raises ValueError for records that can't
+be imported.  'index' is the record's position in the source, 'base' the import's
+start time (both come back from the checkpoint on resume).  'taken' holds the
+(user_id, timestamp) keys handed out so far: a record landing on one is moved a
+second later, so two records never end up as one item.
+
+'''
+def normalizeRecord(record, index, base, user_id=None, user_name=None, taken=None):
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+    owner = record.get('user_id') or user_id
+    if not owner:
+        raise ValueError("no 'user_id'")
+    owner_name = record.get('user_name') or user_name or owner
+    raw = record.get('timestamp') or record.get('created')
+    if raw in (None, ''):
+        timestamp = int(base) - index
+    else:
+        try:
+            timestamp = int(float(raw))
+        except (TypeError, ValueError):
+            raise ValueError(f"bad timestamp {raw!r}")
+    if taken is not None:
+        while (owner, timestamp) in taken:
+            timestamp += 1
+    item = {}
+    for name in NOTE_FIELDS:
+        if record.get(name) not in (None, ''):
+            item[name] = str(record[name])
+    source_id = record.get('id') or record.get('note_id')
+    seed = owner + '|' + (str(source_id) if source_id not in (None, '') else 't' + str(timestamp))
+    note_id = owner + ':' + str(uuid.uuid5(IMPORT_NAMESPACE, seed))
+    # the same checks POST /note makes, the 400 KB item limit above all
+    validation.NEW_NOTE.check(item, 'record', validation.stampBytes(owner, owner_name))
+    note = app.stampNote(item, owner, owner_name, datetime.fromtimestamp(timestamp), note_id)
+    if taken is not None:
+        taken.add((owner, timestamp))
+    return note
+
+
+class AdaptiveBackoff(object):
+    '''
+    A delay shared by every worker: doubled (plus jitter) on throttling, shrunk by a
+    quarter after each clean call.
+    '''
+    def __init__(self, floor=0.0, initial=0.05, ceiling=5.0):
+        self.floor = floor
+        self.initial = initial
+        self.ceiling = ceiling
+        self.delay = floor
+        self.lock = threading.Lock()
+
+    def wait(self):
+        delay = self.delay
+        if delay > 0:
+            time.sleep(delay + random.uniform(0, delay / 2))
+
+    def throttled(self):
+        with self.lock:
+            self.delay = min(self.ceiling, max(self.initial, self.delay * 2))
+
+    def succeeded(self):
+        with self.lock:
+            self.delay = max(self.floor, self.delay * 0.75 if self.delay > self.initial else self.floor)
+
+
+'''
+Write one chunk (at most 25 notes); returns the notes that were never written.
+
+'''
+def writeChunk(notes, backoff, index=True):
+    if not notes:
+        return []
+    pending = {app.tablename: [{'PutRequest': {'Item': codec.encodeNote(note)}} for note in notes]}
+    for attempt in range(IMPORT_RETRIES):
+        backoff.wait()
+        data = app.table.batch_write_item(RequestItems=pending)
+        pending = data.get('UnprocessedItems') or {}
+        if not pending.get(app.tablename):
+            backoff.succeeded()
+            break
+        backoff.throttled()
+    unwritten = set(request['PutRequest']['Item']['note_id'] for request in pending.get(app.tablename, []))
+    written = [note for note in notes if note['note_id'] not in unwritten]
+    if index and written:
+        by_user = {}
+        for note in written:
+            by_user.setdefault(note['user_id'], []).append(note)
+        for user_id, user_notes in by_user.items():
+            for params in search_index.bulkIndexUpdates(user_id, user_notes):
+                app.table.update_item(TableName=app.tablename, **params)
+    return [note for note in notes if note['note_id'] in unwritten]
+
+
+def loadCheckpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def saveCheckpoint(path, state):
+    if not path:
+        return
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp, path)
+
+
+'''
+Import every record from 'records' (an iterator of dicts).  Returns the final state:
+offset (records done), written, failed, errors (the first MAX_ERRORS problems), and
+complete, true once offset reached the end of the input.  The checkpoint only counts
+records before its offset, so a resume that reads the rest again doesn't count them twice.
+
+'''
+def importRecords(records, checkpoint=None, workers=IMPORT_WORKERS, user_id=None, user_name=None, index=True):
+    state = loadCheckpoint(checkpoint) or {
+        'offset': 0, 'base': int(time.time()), 'written': 0, 'failed': 0, 'errors': [], 'complete': False
+    }
+    backoff = AdaptiveBackoff()
+    lock = threading.Lock()
+
+    def tally(into, written, failures):
+        into['written'] += written
+        into['failed'] += len(failures)
+        for position, message in failures:
+            if len(into['errors']) < MAX_ERRORS:
+                into['errors'].append({'record': position, 'error': message})
+
+    total = 0
+
+    def chunks():
+        # each chunk carries the records rejected since the one before it
+        nonlocal total
+        chunk = []
+        rejected = []
+        taken = set()
+        for position, record in enumerate(records):
+            total = position + 1
+            try:
+                note = normalizeRecord(record, position, state['base'], user_id, user_name, taken)
+            except ValueError as err:
+                if position >= state['offset']:
+                    rejected.append((position, str(err)))
+                continue
+            # records before the offset are only read again to rebuild 'taken'
+            if position < state['offset']:
+                continue
+            chunk.append(note)
+            if len(chunk) == app.BATCH_WRITE_MAX:
+                yield chunk, rejected, position + 1
+                chunk = []
+                rejected = []
+        if chunk or rejected:
+            yield chunk, rejected, total
+
+    # chunks finish out of order: only advance the checkpoint over a contiguous prefix,
+    # and only count a chunk into the checkpoint once it joins that prefix
+    finished = {}
+    stalled = []
+    sequence = 0
+    next_done = 0
+    since_checkpoint = 0
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk, rejected, end in chunks():
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+            future = pool.submit(writeChunk, chunk, backoff, index)
+            in_flight[future] = (sequence, chunk, rejected, end)
+            sequence += 1
+
+            def completed(future, info=in_flight[future]):
+                nonlocal next_done, since_checkpoint
+                seq, notes, rejected, chunk_end = info
+                try:
+                    unwritten = future.result()
+                except Exception as err:
+                    # the chunk never finishes, so the checkpoint stays in front of it
+                    with lock:
+                        stalled.extend(rejected + [(None, f"chunk failed ({err}): {note['note_id']}") for note in notes])
+                    return
+                failures = rejected + [(None, f"not written after {IMPORT_RETRIES} attempts: {note['note_id']}")
+                                       for note in unwritten]
+                with lock:
+                    finished[seq] = (chunk_end, len(notes) - len(unwritten), failures)
+                    while next_done in finished:
+                        chunk_end, written, failures = finished.pop(next_done)
+                        state['offset'] = max(state['offset'], chunk_end)
+                        tally(state, written, failures)
+                        next_done += 1
+                        since_checkpoint += 1
+                    if since_checkpoint >= CHECKPOINT_EVERY:
+                        saveCheckpoint(checkpoint, state)
+                        since_checkpoint = 0
+            future.add_done_callback(completed)
+    state['complete'] = state['offset'] >= total
+    saveCheckpoint(checkpoint, state)
+    # the report also counts what a rerun will go over again
+    report = dict(state, errors=list(state['errors']))
+    for _, written, failures in finished.values():
+        tally(report, written, failures)
+    tally(report, 0, stalled)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import notes from NDJSON or CSV')
+    parser.add_argument('source', help='NDJSON or CSV file, - for stdin')
+    parser.add_argument('--format', choices=('ndjson', 'csv'))
+    parser.add_argument('--checkpoint', help='progress file; rerun with it to resume')
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+    parser.add_argument('--user-id', help='owner for records without a user_id')
+    parser.add_argument('--user-name')
+    parser.add_argument('--no-index', action='store_true', help="don't write search postings")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    fmt = args.format or sourceFormat(args.source)
+    stream = sys.stdin if args.source == '-' else open(args.source, newline='' if fmt == 'csv' else None)
+    with stream:
+        state = importRecords(readRecords(stream, fmt), args.checkpoint, args.workers,
+                              args.user_id, args.user_name, not args.no_index)
+    logger.info(f"imported {state['written']} notes, {state['failed']} failed, {state['offset']} records read")
+    for error in state['errors']:
+        logger.warning(f"record {error['record']}: {error['error']}")
+    return 0 if state['complete'] and not state['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import contextvars
+import functools
+import json
+import random
+import sys
+import threading
+import time
+from os import environ
+'''
+instrumentation:
+Per-invocation timing and DynamoDB capacity metrics for the handlers.
+
+@instrument('get_notes') wraps a handler.  For a sampled invocation it starts a record
+in a context variable; while the handler runs,
+
+    with phase('parse'): ...        adds the block's wall time to the 'parse' phase
+    instrumentTable(table)          times every table call as the 'dynamodb' phase, asks
+                                    for ReturnConsumedCapacity=TOTAL and adds it up
+
+and when the handler returns one line is written to stdout: a CloudWatch Embedded
+Metric Format document in Lambda (CloudWatch turns it into metrics without any API
+calls) or plain JSON elsewhere.  Whatever the handler didn't account for to a phase is
+reported as 'other'.  Worker threads only see the record if their function is wrapped
+with bind(); the time of calls made in parallel adds up, so phases can sum to more
+than the duration.
+
+Settings, all environment variables:
+    METRICS_LEVEL        off | basic (duration, capacity, calls) | detailed (+ phases);
+                         default basic
+    METRICS_SAMPLE_RATE  fraction of invocations measured, default 1.0
+    METRICS_FORMAT       emf | json; default emf inside Lambda, json outside
+    METRICS_NAMESPACE    CloudWatch namespace, default sls-notes
+
+'''
+LEVELS = ('off', 'basic', 'detailed')
+LEVEL = environ.get('METRICS_LEVEL', 'basic').lower()
+if LEVEL not in LEVELS:
+    LEVEL = 'basic'
+try:
+    SAMPLE_RATE = float(environ.get('METRICS_SAMPLE_RATE', '1'))
+except ValueError:
+    SAMPLE_RATE = 1.0
+FORMAT = environ.get('METRICS_FORMAT') or ('emf' if environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'json')
+NAMESPACE = environ.get('METRICS_NAMESPACE', 'sls-notes')
+
+_current = contextvars.ContextVar('sls_notes_invocation', default=None)
+# where records go; tests swap in a list's append
+emit = None
+
+
+class Invocation(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.capacity = 0.0
+        self.calls = 0
+        self.status = None
+        self.lock = threading.Lock()
+
+    def addPhase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def addCall(self, consumed):
+        units = 0.0
+        # a single call returns a dict, the batch calls a list of them
+        for entry in (consumed if isinstance(consumed, list) else [consumed]):
+            if entry:
+                units += float(entry.get('CapacityUnits') or 0)
+        with self.lock:
+            self.calls += 1
+            self.capacity += units
+
+    def record(self):
+        duration = (time.perf_counter() - self.start) * 1000.0
+        metrics = {
+            'Duration': round(duration, 3),
+            'ConsumedCapacity': self.capacity,
+            'TableCalls': self.calls
+        }
+        if LEVEL == 'detailed':
+            accounted = 0.0
+            for name, seconds in self.phases.items():
+                metrics[name + 'Time'] = round(seconds * 1000.0, 3)
+                accounted += seconds * 1000.0
+            metrics['otherTime'] = round(max(0.0, duration - accounted), 3)
+        return metrics
+
+
+def current():
+    return _current.get()
+
+
+def enabled():
+    return LEVEL != 'off'
+
+
+UNITS = {
+    'ConsumedCapacity': 'Count',
+    'TableCalls': 'Count'
+}
+
+
+def formatRecord(handler, status, metrics):
+    if FORMAT != 'emf':
+        return json.dumps(dict(metrics, handler=handler, status=status), separators=(',', ':'))
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['handler']],
+                'Metrics': [{'Name': name, 'Unit': UNITS.get(name, 'Milliseconds')} for name in metrics]
+            }]
+        },
+        'handler': handler,
+        'status': status
+    }
+    document.update(metrics)
+    return json.dumps(document, separators=(',', ':'))
+
+
+def _write(line):
+    if emit is not None:
+        emit(line)
+    else:
+        sys.stdout.write(line + '\n')
+
+
+'''
+Handler decorator; the wrapped handler behaves exactly as before.
+
+'''
+def instrument(handler):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            if LEVEL == 'off' or _current.get() is not None or (SAMPLE_RATE < 1.0 and random.random() >= SAMPLE_RATE):
+                return fn(event, context)
+            invocation = Invocation(handler)
+            token = _current.set(invocation)
+            try:
+                response = fn(event, context)
+                if isinstance(response, dict):
+                    invocation.status = response.get('statusCode')
+                return response
+            except Exception:
+                invocation.status = 'error'
+                raise
+            finally:
+                _current.reset(token)
+                try:
+                    _write(formatRecord(handler, invocation.status, invocation.record()))
+                except Exception:
+                    # metrics must never take a request down
+                    pass
+        return wrapper
+    return decorate
+
+
+class phase(object):
+    '''
+    Context manager that charges the block's wall time to a named phase of the current
+    invocation (a no-op outside a sampled one).
+    '''
+    __slots__ = ('name', 'invocation', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.invocation = _current.get()
+        if self.invocation is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.invocation is not None:
+            self.invocation.addPhase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+'''
+Run fn with the caller's invocation record, for functions handed to a thread pool.
+
+'''
+def bind(fn):
+    invocation = _current.get()
+    if invocation is None:
+        return fn
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        token = _current.set(invocation)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return bound
+
+
+TABLE_CALLS = ('put_item', 'get_item', 'delete_item', 'update_item', 'query', 'scan',
+               'batch_write_item', 'batch_get_item')
+
+
+class InstrumentedTable(object):
+    '''
+    Wraps a table object (DynamoTable, or the tests' FakeTable): every call is timed as
+    the 'dynamodb' phase and its ConsumedCapacity added to the invocation.  Everything
+    else is passed through, and calls made outside a sampled invocation are untouched.
+    '''
+    def __init__(self, table):
+        self.table = table
+
+    def __getattr__(self, name):
+        attr = getattr(self.table, name)
+        if name not in TABLE_CALLS:
+            return attr
+        def call(*args, **params):
+            invocation = _current.get()
+            if invocation is None:
+                return attr(*args, **params)
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+            start = time.perf_counter()
+            try:
+                data = attr(*args, **params)
+            finally:
+                invocation.addPhase('dynamodb', time.perf_counter() - start)
+            invocation.addCall(data.get('ConsumedCapacity') if data else None)
+            return data
+        return call
+
+
+def instrumentTable(table):
+    if table is None or isinstance(table, InstrumentedTable):
+        return table
+    return InstrumentedTable(table)
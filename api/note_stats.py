@@ -0,0 +1,136 @@
+from collections import Counter
+'''
+note_stats:
+Per-user note counters, so GET /notes/stats is one GetItem.
+
+    user_id    = 'stats#<user_id>'
+    timestamp  = 0
+    notes      = number of notes
+    cat:<cat>  = number of notes in category <cat>
+    revision   = bumped by every change to the counters
+
+The counters move with ADD after each note write and can drift (the ADD can't be
+rolled back with the write); the reconcile job recounts and fixes them, guarded by
+'revision' so it never overwrites an ADD that landed while it was counting.
+
+'''
+STATS_PREFIX = 'stats#'
+CATEGORY_PREFIX = 'cat:'
+TOTAL = 'notes'
+
+
+def statsKey(user_id):
+    return {
+        'user_id': STATS_PREFIX + user_id,
+        'timestamp': 0
+    }
+
+
+def isStatsKey(user_id):
+    return isinstance(user_id, str) and user_id.startswith(STATS_PREFIX)
+
+
+def categoryAttribute(cat):
+    return CATEGORY_PREFIX + cat
+
+
+def _count(counter, note, sign):
+    counter[TOTAL] += sign
+    cat = note.get('cat')
+    if isinstance(cat, str) and cat:
+        counter[categoryAttribute(cat)] += sign
+
+
+'''
+How the counters move when a note goes from 'old' to 'new' (either may be None for a
+create or a delete).  Returns a Counter of attribute -> delta without zero entries.
+
+'''
+def statsDelta(old, new):
+    delta = Counter()
+    if old:
+        _count(delta, old, -1)
+    if new:
+        _count(delta, new, 1)
+    return Counter({name: value for name, value in delta.items() if value})
+
+
+def addDeltas(deltas):
+    total = Counter()
+    for delta in deltas:
+        total.update(delta)
+    return Counter({name: value for name, value in total.items() if value})
+
+
+def statsUpdate(user_id, delta):
+    if not delta:
+        return None
+    names = {'#rev': 'revision'}
+    values = {':one': 1}
+    adds = ['#rev :one']
+    for i, (name, value) in enumerate(sorted(delta.items())):
+        names['#s' + str(i)] = name
+        values[':s' + str(i)] = value
+        adds.append('#s%d :s%d' % (i, i))
+    return {
+        'Key': statsKey(user_id),
+        'UpdateExpression': 'ADD ' + ', '.join(adds),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values
+    }
+
+
+'''
+The counters as GET /notes/stats returns them.
+
+'''
+def summary(item):
+    item = item or {}
+    categories = {}
+    for name, value in item.items():
+        if name.startswith(CATEGORY_PREFIX) and int(value) > 0:
+            categories[name[len(CATEGORY_PREFIX):]] = int(value)
+    return {
+        'notes': max(0, int(item.get(TOTAL, 0))),
+        'categories': categories
+    }
+
+
+def countNotes(notes):
+    counted = Counter()
+    for note in notes:
+        _count(counted, note, 1)
+    return dict(counted)
+
+
+def counters(item):
+    # the counter attributes of a stats item, zeros left out
+    return {name: int(value) for name, value in (item or {}).items()
+            if (name == TOTAL or name.startswith(CATEGORY_PREFIX)) and int(value)}
+
+
+'''
+PutItem parameters that replace a user's stats item with recounted values, unless the
+counters moved since 'seen' (the stats item as read during the recount, or None).
+
+'''
+def reconcileParams(user_id, counted, seen=None):
+    item = statsKey(user_id)
+    item.update(counted)
+    if seen is None:
+        item['revision'] = 0
+        return {
+            'Item': item,
+            'ConditionExpression': 'attribute_not_exists(user_id)'
+        }
+    item['revision'] = int(seen.get('revision', 0)) + 1
+    params = {
+        'Item': item,
+        'ExpressionAttributeNames': {'#rev': 'revision'}
+    }
+    if 'revision' in seen:
+        params['ConditionExpression'] = '#rev = :seen'
+        params['ExpressionAttributeValues'] = {':seen': seen['revision']}
+    else:
+        params['ConditionExpression'] = 'attribute_not_exists(#rev)'
+    return params
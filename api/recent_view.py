@@ -0,0 +1,121 @@
+from os import environ
+import search_index
+import change_feed
+import idempotency
+import note_stats
+'''
+recent_view:
+A per-user copy of the newest notes, so the default first page of GET /notes is one
+GetItem instead of a Query.
+
+    user_id   = 'recent#<user_id>'
+    timestamp = 0
+    notes     = the user's newest notes, newest first, exactly as stored
+    complete  = True when 'notes' is every note the user has
+
+The table's stream consumer rebuilds a user's view from a consistent Query of the
+newest VIEW_SIZE + 1 notes whenever they change, so record order doesn't matter.  A
+view holds at most VIEW_MAX_BYTES of notes; GET /notes falls back to the Query for any
+page it can't answer.  RECENT_VIEW_SIZE sets the size; 0 (the default) turns it off.
+
+'''
+VIEW_PREFIX = 'recent#'
+VIEW_SIZE = int(environ.get('RECENT_VIEW_SIZE', 0))
+VIEW_MAX_BYTES = 32 * 1024
+# partitions of derived items: their stream records never change a view
+DERIVED_PREFIXES = (VIEW_PREFIX, search_index.INDEX_PREFIX, change_feed.FEED_PREFIX, idempotency.IDEM_PREFIX,
+                    note_stats.STATS_PREFIX)
+
+
+def viewKey(user_id):
+    return {
+        'user_id': VIEW_PREFIX + user_id,
+        'timestamp': 0
+    }
+
+
+def isViewKey(user_id):
+    return isinstance(user_id, str) and user_id.startswith(VIEW_PREFIX)
+
+
+def isNotePartition(user_id):
+    return isinstance(user_id, str) and not user_id.startswith(DERIVED_PREFIXES)
+
+
+'''
+The users whose notes a batch of stream records touched, each with the sequence number
+of its first record (what the handler reports back when that user's rebuild fails).
+Only the keys are read, so any StreamViewType will do.
+
+'''
+def streamUsers(records):
+    users = {}
+    for record in records:
+        keys = (record.get('dynamodb') or {}).get('Keys') or {}
+        user_id = (keys.get('user_id') or {}).get('S')
+        if isNotePartition(user_id) and user_id not in users:
+            users[user_id] = record['dynamodb'].get('SequenceNumber')
+    return users
+
+
+def queryParams(user_id, size=None):
+    return {
+        'KeyConditionExpression': 'user_id = :uid',
+        'ExpressionAttributeValues': {
+            ':uid': user_id
+        },
+        'Limit': (VIEW_SIZE if size is None else size) + 1,
+        'ScanIndexForward': False,
+        'ConsistentRead': True
+    }
+
+
+def noteBytes(note):
+    # close enough to DynamoDB's item size: names plus values
+    size = 0
+    for name, value in note.items():
+        size += len(name)
+        if isinstance(value, str):
+            size += len(value.encode('utf-8'))
+        elif isinstance(value, (bytes, bytearray)):
+            size += len(value)
+        elif hasattr(value, 'value'):
+            # boto3 Binary
+            size += len(value.value)
+        else:
+            size += 21
+    return size
+
+
+'''
+The view item for a user from the newest notes a queryParams() Query returned.
+
+'''
+def buildView(user_id, notes, size=None):
+    if size is None:
+        size = VIEW_SIZE
+    kept = []
+    total = 0
+    for note in notes[:size]:
+        total += noteBytes(note)
+        if total > VIEW_MAX_BYTES:
+            break
+        kept.append(note)
+    item = viewKey(user_id)
+    item['notes'] = kept
+    item['complete'] = len(kept) == len(notes) and len(notes) <= size
+    return item
+
+
+'''
+The first 'limit' notes of a view, or None when the view can't answer that page
+(missing, or holding fewer notes than asked for while the user has more).
+
+'''
+def firstPage(view, limit):
+    if not view or 'notes' not in view:
+        return None
+    notes = view['notes']
+    if len(notes) < limit and not view.get('complete'):
+        return None
+    return notes[:limit]
@@ -0,0 +1,178 @@
+import re
+import unicodedata
+from decimal import Decimal
+'''
+search_index:
+A per-user inverted index over note titles and content.  Each (user, term) pair is one
+posting item,
+
+    user_id   = 'search#<user_id>#<term>'
+    timestamp = 0
+    notes     = number set of the timestamps of the user's notes containing <term>
+
+so a search reads one item per query term and never scans.  indexUpdates() diffs the
+terms of the old and new version of a note into one ADD/DELETE per changed term.
+
+'''
+INDEX_PREFIX = 'search#'
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+MAX_TERMS_PER_NOTE = 200
+MAX_QUERY_TERMS = 8
+# the note attributes that feed the index
+INDEXED_FIELDS = ('title', 'content')
+
+STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in', 'into',
+    'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that', 'the', 'their', 'then',
+    'there', 'these', 'they', 'this', 'to', 'was', 'will', 'with'
+))
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    # fold case and strip accents so 'Café' and 'cafe' find each other
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    terms = []
+    seen = set()
+    if not isinstance(text, str):
+        return terms
+    for word in _WORD.findall(normalize(text)):
+        word = word.strip('_')
+        if len(word) < MIN_TERM_LENGTH or word in STOPWORDS or word in seen:
+            continue
+        seen.add(word)
+        terms.append(word[:MAX_TERM_LENGTH])
+    return terms
+
+
+def noteTerms(note):
+    if not note:
+        return set()
+    # title terms first so they survive the per-note cap
+    terms = tokenize(note.get('title'))
+    for term in tokenize(note.get('content')):
+        if term not in terms:
+            terms.append(term)
+    return set(terms[:MAX_TERMS_PER_NOTE])
+
+
+def postingKey(user_id, term):
+    return {
+        'user_id': INDEX_PREFIX + user_id + '#' + term,
+        'timestamp': 0
+    }
+
+
+def isIndexKey(user_id):
+    return isinstance(user_id, str) and user_id.startswith(INDEX_PREFIX)
+
+
+'''
+UpdateItem parameters that move a note from old_note's terms to new_note's terms.
+Either side may be None (note created / deleted).
+
+'''
+def indexUpdates(user_id, old_note, new_note):
+    old_terms = noteTerms(old_note)
+    new_terms = noteTerms(new_note)
+    if old_note and (not new_note or old_note.get('timestamp') != new_note.get('timestamp')):
+        # the note went away (or moved): every old posting has to go
+        removed, added = old_terms, new_terms
+    else:
+        removed, added = old_terms - new_terms, new_terms - old_terms
+    updates = []
+    for term in sorted(removed):
+        updates.append(postingUpdate(user_id, term, 'DELETE', old_note['timestamp']))
+    for term in sorted(added):
+        updates.append(postingUpdate(user_id, term, 'ADD', new_note['timestamp']))
+    return updates
+
+
+'''
+Updates that index many new notes of one user at once (ADD, for bulk loads) or drop
+many deleted ones (DELETE, for bulk deletes): one UpdateItem per term carrying every
+matching timestamp.
+
+'''
+def bulkIndexUpdates(user_id, notes, action='ADD'):
+    by_term = {}
+    for note in notes:
+        for term in noteTerms(note):
+            by_term.setdefault(term, set()).add(Decimal(note['timestamp']))
+    updates = []
+    for term in sorted(by_term):
+        params = {
+            'Key': postingKey(user_id, term),
+            'UpdateExpression': action + ' notes :ts',
+            'ExpressionAttributeValues': {
+                ':ts': by_term[term]
+            }
+        }
+        if action == 'DELETE':
+            params['ConditionExpression'] = 'attribute_exists(notes)'
+            params['ReturnValues'] = 'UPDATED_NEW'
+        updates.append(params)
+    return updates
+
+
+def postingUpdate(user_id, term, action, timestamp):
+    params = {
+        'Key': postingKey(user_id, term),
+        'UpdateExpression': action + ' notes :ts',
+        'ExpressionAttributeValues': {
+            ':ts': set([Decimal(timestamp)])
+        }
+    }
+    if action == 'DELETE':
+        # don't create empty postings for terms that were never indexed, and tell the
+        # caller when the set has emptied so the posting can be dropped
+        params['ConditionExpression'] = 'attribute_exists(notes)'
+        params['ReturnValues'] = 'UPDATED_NEW'
+    return params
+
+
+'''
+Once a DELETE has emptied a posting, this removes the leftover item (unless a
+concurrent ADD got there first).
+
+'''
+def postingCleanup(key):
+    return {
+        'Key': key,
+        'ConditionExpression': 'attribute_not_exists(notes)'
+    }
+
+
+'''
+Turn a query string into its terms; every term must match (AND semantics).
+
+'''
+def queryTerms(q):
+    return tokenize(q)[:MAX_QUERY_TERMS]
+
+
+'''
+Intersect the posting items fetched for 'terms' and return the matching note
+timestamps, newest first.
+
+'''
+def matchTimestamps(postings, terms):
+    if not terms:
+        return []
+    by_term = {}
+    for posting in postings:
+        term = posting['user_id'].rsplit('#', 1)[-1]
+        by_term[term] = set(posting.get('notes') or ())
+    matched = None
+    for term in terms:
+        timestamps = by_term.get(term, set())
+        matched = timestamps if matched is None else matched & timestamps
+        if not matched:
+            return []
+    return sorted(matched, reverse=True)
@@ -0,0 +1,75 @@
+import json
+from decimal import Decimal
+'''
+serializer:
+JSON output for everything the handlers return.
+
+DynamoDB hands every number back as a Decimal, which the stdlib encoder can't
+handle natively; the old DecimalEncoder sent each one through the Python-level
+default() hook and turned it into a string, so timestamps went out as "1723331552".
+Here integral Decimals become ints, everything else finite becomes a float, NaN and
+Infinity become strings, and string/number sets become sorted lists.
+
+dumps() makes a single pass: the encoder's C loop walks the data and only calls back
+into Python (plainValue) for the Decimals and sets.  It uses orjson when that is
+installed (falling back to the stdlib encoder for the ints it can't take) and the
+stdlib C encoder with compact separators otherwise.  plain() does
+the same conversion up front for callers that need plain Python values.
+
+'''
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def plainDecimal(value):
+    try:
+        integral = int(value)
+    except (ValueError, OverflowError):
+        # NaN / Infinity have no JSON number form
+        return str(value)
+    if integral == value:
+        return integral
+    return float(value)
+
+
+def plain(obj):
+    kind = type(obj)
+    if kind is dict:
+        return {key: plain(value) for key, value in obj.items()}
+    if kind is list or kind is tuple:
+        return [plain(value) for value in obj]
+    if kind is Decimal:
+        return plainDecimal(obj)
+    if kind is str or kind is int or kind is bool or obj is None:
+        return obj
+    if isinstance(obj, (set, frozenset)):
+        return sorted(plain(value) for value in obj)
+    if isinstance(obj, dict):
+        return {key: plain(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [plain(value) for value in obj]
+    return obj
+
+
+def plainValue(obj):
+    if type(obj) is Decimal:
+        return plainDecimal(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(plain(value) for value in obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=plainValue)
+
+if orjson is not None:
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj, default=plainValue).decode('utf-8')
+        except TypeError:
+            # orjson refuses ints past 64 bits (a note's 1e30, say); the stdlib encoder doesn't
+            return _encoder.encode(obj)
+else:
+    def dumps(obj):
+        return _encoder.encode(obj)
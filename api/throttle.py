@@ -0,0 +1,238 @@
+import contextvars
+import functools
+import math
+import random
+import threading
+import time
+from os import environ
+import botocore.exceptions
+'''
+throttle:
+Retry and admission control around the table calls, so a burst of DynamoDB throttling
+turns into a clean 429 + Retry-After instead of a cascade of 5xx and instant retries.
+
+throttleTable(table) wraps the table object.  A call that fails with a throttling error
+(or a transient 5xx / connection error) is retried with full-jitter exponential backoff,
+but only while
+  - the container's retry bucket still has a token: retries refill at
+    THROTTLE_RETRY_RATE per second up to THROTTLE_RETRY_BURST, so when the table is
+    throttling for everyone a container stops adding load after a handful of retries,
+  - the sleep ends before the invocation's deadline (the Lambda context's remaining
+    time less THROTTLE_MARGIN_MS), and
+  - fewer than THROTTLE_MAX_RETRIES retries were made.
+Otherwise a throttling error is raised as Throttled - a ClientError with HTTP status
+429 - so the handlers' usual ClientError branch answers 429, and follow-up writes that
+only log their errors (search index, change feed) keep doing just that.
+
+THROTTLE_CALL_RATE (calls per second, 0 = off) adds a per-container admission bucket
+in front of every call; a call that can't get a token before the deadline is shed
+without reaching DynamoDB.
+
+@guard sets the deadline for a handler from its context and adds the Retry-After
+header to a 429 it returns.  Calls made on worker threads (the search index update)
+don't see the deadline and are bounded by THROTTLE_MAX_RETRIES alone.
+
+botocore's own retries are set by DYNAMODB_RETRY_MODE / DYNAMODB_MAX_ATTEMPTS (see
+dynamo.py); the default of one attempt leaves the retrying to this module.
+
+'''
+def _setting(name, default, kind=float):
+    try:
+        return kind(environ.get(name, default))
+    except ValueError:
+        return default
+
+
+CALL_RATE = _setting('THROTTLE_CALL_RATE', 0.0)
+CALL_BURST = _setting('THROTTLE_CALL_BURST', 50.0)
+RETRY_RATE = _setting('THROTTLE_RETRY_RATE', 5.0)
+RETRY_BURST = _setting('THROTTLE_RETRY_BURST', 10.0)
+MAX_RETRIES = _setting('THROTTLE_MAX_RETRIES', 4, int)
+BACKOFF_BASE = _setting('THROTTLE_BACKOFF_BASE', 0.025) # seconds, doubled on every retry
+BACKOFF_MAX = _setting('THROTTLE_BACKOFF_MAX', 1.0)
+MARGIN_MS = _setting('THROTTLE_MARGIN_MS', 250.0)
+
+THROTTLE_CODES = frozenset((
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+))
+TRANSIENT_CODES = frozenset((
+    'InternalServerError',
+    'ServiceUnavailable'
+))
+TRANSIENT_ERRORS = (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)
+
+
+class TokenBucket(object):
+    '''
+    'rate' tokens a second up to 'capacity'; shared by every thread in the container.
+    '''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self):
+        # returns 0 when a token was taken, else the seconds until one is due
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            if self.rate <= 0:
+                return math.inf
+            return (1 - self.tokens) / self.rate
+
+
+retries = TokenBucket(RETRY_RATE, RETRY_BURST)
+admission = TokenBucket(CALL_RATE, CALL_BURST) if CALL_RATE > 0 else None
+
+
+class Throttled(botocore.exceptions.ClientError):
+    '''
+    DynamoDB kept throttling (or the admission bucket was empty) and there was no
+    retry budget left; retry_after is the whole seconds a client should wait.
+    '''
+    def __init__(self, code, operation, retry_after):
+        self.retry_after = retry_after
+        super().__init__({
+            'Error': {
+                'Code': code,
+                'Message': f"Request rate too high, retry after {retry_after} seconds"
+            },
+            'ResponseMetadata': {
+                'HTTPStatusCode': 429
+            }
+        }, operation)
+
+
+class Budget(object):
+    __slots__ = ('deadline', 'retry_after')
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.retry_after = None
+
+    def fits(self, seconds):
+        return self.deadline is None or time.monotonic() + seconds < self.deadline
+
+
+_budget = contextvars.ContextVar('sls_notes_budget', default=None)
+
+
+def currentBudget():
+    return _budget.get() or Budget()
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def retryAfter(seconds):
+    if math.isinf(seconds):
+        seconds = BACKOFF_MAX
+    return max(1, int(math.ceil(seconds)))
+
+
+def shed(budget, code, operation, seconds):
+    budget.retry_after = retryAfter(seconds)
+    return Throttled(code, operation, budget.retry_after)
+
+
+def admit(budget, operation):
+    wait = admission.take()
+    if wait <= 0:
+        return
+    if not budget.fits(wait):
+        raise shed(budget, 'RequestLimitExceeded', operation, wait)
+    time.sleep(wait)
+    admission.take()
+
+
+'''
+Make one table call under the retry policy above.
+
+'''
+def call(fn, operation, params):
+    budget = currentBudget()
+    attempt = 0
+    while True:
+        if admission is not None:
+            admit(budget, operation)
+        try:
+            return fn(**params)
+        except botocore.exceptions.ClientError as err:
+            code = err.response.get('Error', {}).get('Code')
+            if code not in THROTTLE_CODES and code not in TRANSIENT_CODES:
+                raise
+            error = err
+        except TRANSIENT_ERRORS as err:
+            code = None
+            error = err
+        delay = backoff(attempt)
+        refill = retries.take() if attempt < MAX_RETRIES else math.inf
+        if refill > 0 or not budget.fits(delay):
+            if code in THROTTLE_CODES:
+                raise shed(budget, code, operation, max(delay, refill)) from error
+            raise error
+        attempt += 1
+        time.sleep(delay)
+
+
+TABLE_CALLS = ('put_item', 'get_item', 'delete_item', 'update_item', 'query', 'scan',
+               'batch_write_item', 'batch_get_item')
+
+
+class ThrottledTable(object):
+    '''
+    Wraps a table object the same way instrumentation.InstrumentedTable does; every
+    table call goes through call(), everything else is passed through.
+    '''
+    def __init__(self, table):
+        self.table = table
+
+    def __getattr__(self, name):
+        attr = getattr(self.table, name)
+        if name not in TABLE_CALLS:
+            return attr
+        def throttled(**params):
+            return call(attr, name, params)
+        return throttled
+
+
+def throttleTable(table):
+    if table is None or isinstance(table, ThrottledTable):
+        return table
+    return ThrottledTable(table)
+
+
+'''
+Handler decorator: bounds the retries by the invocation's remaining time and puts
+Retry-After on a 429 response.
+
+'''
+def guard(fn):
+    @functools.wraps(fn)
+    def wrapper(event, context):
+        deadline = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            deadline = time.monotonic() + (context.get_remaining_time_in_millis() - MARGIN_MS) / 1000.0
+        budget = Budget(deadline)
+        token = _budget.set(budget)
+        try:
+            response = fn(event, context)
+        finally:
+            _budget.reset(token)
+        if budget.retry_after and isinstance(response, dict) and response.get('statusCode') == 429:
+            headers = dict(response.get('headers') or {})
+            headers.setdefault('Retry-After', str(budget.retry_after))
+            response['headers'] = headers
+        return response
+    return wrapper
@@ -0,0 +1,180 @@
+import json
+from decimal import Decimal
+from os import environ
+import codec
+import bulk_delete
+'''
+validation:
+Request body checks for the write routes, done before anything reaches the table.
+
+A schema is declared as field name -> kind and compiled once at import:
+
+    'string'     a string
+    'integer'    a whole number (not a bool)
+    'string?'    a string or null (null removes the attribute on PATCH /note)
+
+Fields not named in a schema may hold any JSON value.  Schema.check() makes one pass
+over an Item: required fields present, declared kinds matched, server-owned attributes
+(the codec's content_z / content_codec, the purge job's expires_bucket) refused, and
+the item's DynamoDB size added up against ITEM_MAX_BYTES (400 KB).  Content that codec.py will store compressed is
+counted at its compressed size, but only when the plain size is over the limit.  For
+PATCH /note only the changed attributes are counted; an update that grows a stored note
+past the limit is still turned away by DynamoDB.
+
+parseBody() refuses a body over its route's limit before parsing it, and parses numbers
+with a fraction as Decimal, which is what boto3 takes (it raises TypeError on a float).
+Everything raises ValueError with a message meant for the client; app.badRequest()
+turns it into a 400.
+
+NOTE_BODY_MAX_BYTES (default 1 MB) caps POST /note and PATCH /note bodies, and
+BATCH_BODY_MAX_BYTES (default 6 MB, API Gateway's own limit for a Lambda payload) caps
+POST /notes/batch and DELETE /notes.  Both count characters of the decoded body.
+
+'''
+def _setting(name, default):
+    try:
+        return int(environ.get(name, default))
+    except ValueError:
+        return default
+
+
+ITEM_MAX_BYTES = 400 * 1024
+NOTE_BODY_MAX = _setting('NOTE_BODY_MAX_BYTES', 1024 * 1024)
+BATCH_BODY_MAX = _setting('BATCH_BODY_MAX_BYTES', 6 * 1024 * 1024)
+# DynamoDB's worst case for a number
+NUMBER_BYTES = 21
+
+
+def _string(value):
+    return isinstance(value, str)
+
+
+def _integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+KINDS = {
+    'string': (_string, 'a string'),
+    'integer': (_integer, 'an integer')
+}
+
+
+class Schema(object):
+    '''
+    A compiled schema; see compileSchema().
+    '''
+    __slots__ = ('fields', 'required', 'reserved')
+
+    def __init__(self, fields, required, reserved):
+        self.fields = fields
+        self.required = required
+        self.reserved = reserved
+
+    def check(self, item, where='Item', reserve=0):
+        if not isinstance(item, dict):
+            raise ValueError(f"'{where}' must be an object")
+        for name in self.required:
+            if item.get(name) is None:
+                raise ValueError(f"Cannot find '{name}' in '{where}'")
+        size = reserve
+        for name, value in item.items():
+            if name in self.reserved:
+                raise ValueError(f"'{name}' in '{where}' is set by the server")
+            field = self.fields.get(name)
+            if field is not None:
+                accepts, nullable, expected = field
+                if not (accepts(value) or (nullable and value is None)):
+                    raise ValueError(f"'{name}' in '{where}' must be {expected}")
+            size += len(name.encode('utf-8')) + valueBytes(value)
+        if size > ITEM_MAX_BYTES:
+            size = storedSize(item, size)
+            if size > ITEM_MAX_BYTES:
+                raise ValueError(f"'{where}' is {size} bytes, over the {ITEM_MAX_BYTES} byte item limit")
+        return size
+
+
+def compileSchema(spec, required=(), reserved=codec.STORED_FIELDS + (bulk_delete.EXPIRY_BUCKET,)):
+    fields = {}
+    for name, kind in spec.items():
+        nullable = kind.endswith('?')
+        accepts, expected = KINDS[kind.rstrip('?')]
+        fields[name] = (accepts, nullable, expected + ' or null' if nullable else expected)
+    return Schema(fields, tuple(required), frozenset(reserved))
+
+
+'''
+Size of an attribute value the way DynamoDB counts it (close enough: numbers are
+counted at their worst case).
+
+'''
+def valueBytes(value):
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bool, type(None))):
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return NUMBER_BYTES
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(name.encode('utf-8')) + 1 + valueBytes(inner) for name, inner in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(1 + valueBytes(inner) for inner in value)
+    return 0
+
+
+def storedSize(item, size):
+    # 'size' with the content swapped for what codec.encodeNote() will store
+    content = item.get(codec.CONTENT_FIELD)
+    packed = codec.compress(content)
+    if packed is None:
+        return size
+    return (size - len(content.encode('utf-8')) + len(packed) - len(codec.CONTENT_FIELD)
+            + len(codec.STORED_FIELD) + len(codec.CODEC_FIELD) + len(codec.CODEC))
+
+
+'''
+Bytes the attributes app.stampNote() adds to a new note will take up.
+
+'''
+def stampBytes(user_id, user_name):
+    user_id = len(user_id.encode('utf-8'))
+    return (len('user_id') + user_id + len('user_name') + len(user_name.encode('utf-8'))
+            + len('note_id') + user_id + 37
+            + len('timestamp') + len('expires') + len('version') + 3 * NUMBER_BYTES
+            + len(bulk_delete.EXPIRY_BUCKET) + 16)
+
+
+'''
+The request body as a dict, or raises ValueError.  A body that is already an object
+(a direct invocation with events/event.json) is taken as it is.
+
+'''
+def parseBody(body, max_bytes):
+    if isinstance(body, dict):
+        return body
+    if not body:
+        raise ValueError("Cannot find 'body' in event")
+    if len(body) > max_bytes:
+        raise ValueError(f"body is over the {max_bytes} byte limit")
+    try:
+        parsed = json.loads(body, parse_float=Decimal)
+    except ValueError:
+        raise ValueError("body is not valid JSON")
+    if not isinstance(parsed, dict):
+        raise ValueError("body must be a JSON object")
+    return parsed
+
+
+NEW_NOTE = compileSchema({
+    'title': 'string',
+    'content': 'string',
+    'cat': 'string'
+})
+NOTE_UPDATE = compileSchema({
+    'timestamp': 'integer',
+    'note_id': 'string',
+    'title': 'string?',
+    'content': 'string?',
+    'cat': 'string?'
+}, required=('timestamp', 'note_id'))
@@ -0,0 +1,91 @@
+'''
+codec_bench:
+What storing note content through api/codec.py buys per note size bucket: the stored
+item size, the write capacity units of a put (1 WCU per started KB), the read capacity
+units of an eventually consistent read (0.5 RCU per started 4 KB), and the CPU time
+encodeNote()/decodeNote() add on the write and read paths.
+
+Content is drawn from a fixed pseudo-random vocabulary so it compresses roughly like
+prose rather than like a repeated sentence.
+
+Usage:
+    python benchmarks/codec_bench.py [--repeat N] [--threshold BYTES] [--level L]
+'''
+import argparse
+import math
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+sys.path.insert(0, ROOT)
+
+import codec
+from tests.fake_table import itemSize
+
+BUCKETS = (256, 1024, 4096, 16384, 65536, 262144)
+
+
+def makeText(size, seed=7):
+    rng = random.Random(seed)
+    letters = 'etaoinshrdlucmfwypvbgkjqxz'
+    vocabulary = [''.join(rng.choice(letters[:rng.randint(8, 26)]) for _ in range(rng.randint(2, 9))) for _ in range(3000)]
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(vocabulary)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def makeNote(size):
+    return {
+        'user_id': 'bench@example.com',
+        'user_name': 'Bench User',
+        'note_id': 'bench@example.com:1b4e28ba-2fa1-11d2-883f-0016d3cca427',
+        'timestamp': Decimal(1723331552),
+        'expires': Decimal(1738883552),
+        'version': Decimal(1),
+        'title': 'A note of %d bytes' % size,
+        'cat': 'general',
+        'content': makeText(size)
+    }
+
+
+def writeUnits(size):
+    return math.ceil(size / 1024)
+
+
+def readUnits(size):
+    return math.ceil(size / 4096) * 0.5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200, help='encodes/decodes per measurement')
+    parser.add_argument('--threshold', type=int, default=codec.COMPRESS_THRESHOLD, help='compression threshold in bytes')
+    parser.add_argument('--level', type=int, default=codec.COMPRESS_LEVEL, help='zlib level')
+    args = parser.parse_args(argv)
+    codec.COMPRESS_THRESHOLD = args.threshold
+    codec.COMPRESS_LEVEL = args.level
+
+    print(f"threshold {args.threshold} bytes, zlib level {args.level}")
+    print(f"{'content':>8} {'item B':>8} {'stored B':>9} {'WCU':>4} {'->':>3} {'RCU':>5} {'->':>5} {'encode us':>10} {'decode us':>10}")
+    for size in BUCKETS:
+        note = makeNote(size)
+        stored = codec.encodeNote(note)
+        plain_size = itemSize(note)
+        stored_size = itemSize(stored)
+        repeat = max(1, args.repeat * 1024 // max(size, 1024))
+        encode = min(timeit.repeat(lambda: codec.encodeNote(note), number=repeat, repeat=5)) / repeat
+        decode = min(timeit.repeat(lambda: codec.decodeNote(dict(stored)), number=repeat, repeat=5)) / repeat
+        print(f"{size:>8} {plain_size:>8} {stored_size:>9} {writeUnits(plain_size):>4} {writeUnits(stored_size):>3}"
+              f" {readUnits(plain_size):>5} {readUnits(stored_size):>5} {encode * 1e6:>10.1f} {decode * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
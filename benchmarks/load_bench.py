@@ -0,0 +1,178 @@
+'''
+load_bench:
+Drives the five API handlers in api/app.py with synthetic API Gateway events (shaped
+like events/event.json) against the in-memory table from tests/fake_table.py, and
+reports throughput plus latency percentiles per handler.
+
+--latency-ms adds a fixed delay to every table call to stand in for the DynamoDB
+round trip; with the default of 0 the numbers are pure handler CPU time.
+
+Usage:
+    python benchmarks/load_bench.py [--requests N] [--concurrency C] [--latency-ms L]
+                                    [--mix add=1,get_note=4,get_notes=4,update=1,delete=1] [--json]
+'''
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('TABLE_NAME', 'notes_bench')
+
+import app
+import instrumentation
+from tests.fake_table import FakeTable
+
+HANDLERS = {
+    'add': ('POST', '/note', app.add_note_handler),
+    'delete': ('DELETE', '/note/t/{timestamp}', app.delete_note_handler),
+    'get_note': ('GET', '/note/n/{note_id}', app.get_note_handler),
+    'get_notes': ('GET', '/notes', app.get_notes_handler),
+    'update': ('PATCH', '/note', app.update_note_handler),
+}
+DEFAULT_MIX = 'add=1,get_note=4,get_notes=4,update=1,delete=1'
+BASE_TIMESTAMP = 1723331552
+
+
+def loadTemplate():
+    with open(os.path.join(ROOT, 'events', 'event.json')) as f:
+        return json.load(f)
+
+
+def seed(table, users, per_user, content_size):
+    notes = []
+    content = ('lorem ipsum dolor sit amet ' * (content_size // 27 + 1))[:content_size]
+    for u in range(users):
+        user_id = 'user%03d@example.com' % u
+        for i in range(per_user):
+            note = {
+                'user_id': user_id,
+                'user_name': 'User %d' % u,
+                'note_id': '%s:%08d-4cbd-45e0-9344-71f3e7a65e39' % (user_id, i),
+                'timestamp': BASE_TIMESTAMP + i,
+                'expires': BASE_TIMESTAMP + i + 180 * 86400,
+                'title': 'Note %d' % i,
+                'content': content,
+                'cat': 'general'
+            }
+            table.put_item(Item=note)
+            notes.append(note)
+    return notes
+
+
+def makeEvent(template, kind, note, content):
+    method, resource, handler = HANDLERS[kind]
+    event = json.loads(json.dumps(template))
+    event['httpMethod'] = method
+    event['resource'] = resource
+    event['headers'] = {'app_user_id': note['user_id'], 'app_user_name': note['user_name']}
+    event['queryStringParameters'] = {'limit': '5'}
+    event['pathParameters'] = {'note_id': note['note_id'], 'timestamp': str(note['timestamp'])}
+    item = {'title': 'Bench note', 'content': content, 'cat': 'general'}
+    if kind == 'update':
+        item.update(timestamp=note['timestamp'], note_id=note['note_id'])
+    event['body'] = json.dumps({'Item': item})
+    return event
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    return samples[max(0, math.ceil(pct / 100.0 * len(samples)) - 1)]
+
+
+def parseMix(text):
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if name not in HANDLERS:
+            raise SystemExit("unknown handler in --mix: %s" % name)
+        mix[name] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--notes-per-user', type=int, default=50)
+    parser.add_argument('--content', type=int, default=512, help='note content bytes')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated DynamoDB latency per call')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    table = FakeTable(name=app.tablename, latency=args.latency_ms / 1000.0)
+    app.setTable(table)
+    # keep the per-invocation metrics work in the measurement, but not their output
+    instrumentation.emit = lambda line: None
+    notes = seed(table, args.users, args.notes_per_user, args.content)
+    template = loadTemplate()
+    content = ('lorem ipsum dolor sit amet ' * (args.content // 27 + 1))[:args.content]
+
+    mix = parseMix(args.mix)
+    rng = random.Random(args.seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+    work = [(kind, makeEvent(template, kind, rng.choice(notes), content)) for kind in kinds]
+
+    results = {kind: [] for kind in mix}
+    errors = {kind: 0 for kind in mix}
+    lock = threading.Lock()
+
+    def invoke(job):
+        kind, event = job
+        handler = HANDLERS[kind][2]
+        t0 = time.perf_counter()
+        ret = handler(event, None)
+        elapsed = time.perf_counter() - t0
+        status = ret.get('statusCode', 500) if isinstance(ret, dict) else 500
+        with lock:
+            results[kind].append(elapsed)
+            if status >= 400:
+                errors[kind] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(invoke, work))
+    wall = time.perf_counter() - started
+
+    report = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(args.requests / wall, 1),
+        'handlers': {}
+    }
+    for kind, samples in results.items():
+        samples.sort()
+        report['handlers'][kind] = {
+            'count': len(samples),
+            'errors': errors[kind],
+            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+            'p90_ms': round(percentile(samples, 90) * 1000, 3),
+            'p99_ms': round(percentile(samples, 99) * 1000, 3),
+            'max_ms': round((samples[-1] if samples else 0) * 1000, 3)
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+    print(f"{report['requests']} requests, concurrency {report['concurrency']}: "
+          f"{report['wall_s']} s, {report['throughput_rps']} req/s")
+    print(f"{'handler':<10} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, stats in report['handlers'].items():
+        print(f"{kind:<10} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>8} {stats['p90_ms']:>8} {stats['p99_ms']:>8} {stats['max_ms']:>8}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+'''
+right_size:
+Profiles the API handlers in api/app.py over a matrix of payload sizes - note content
+length x notes per request (the page 'limit' of GET /notes and /notes/search, the Items
+of POST /notes) - against the in-memory table from tests/fake_table.py, and recommends
+a MemorySize for each function in template.yaml.
+
+Every cell is measured twice: timing runs (wall time and CPU time, the median run is
+kept) and one run under tracemalloc for the peak allocation.  Both are broken down by
+phase: the instrumentation phases the handlers already mark (parse, serialize,
+compress), 'dynamodb' for the table calls, and 'other' for the rest.  Peaks of work
+done on worker threads (the search index update) land in whichever phase was open.
+
+Lambda hands out CPU in proportion to memory, one full vCPU at 1769 MB, so a handler
+that needs c ms of CPU here needs about c * 1769 / MemorySize ms below that.  The
+estimate for a memory size is that, times --cpu-scale (how much slower a Lambda core is
+than this machine), plus the wall time spent off the CPU (--latency-ms stands in for
+the DynamoDB round trips).  The recommendation is the smallest size that holds the
+runtime (--runtime-mb) plus HEADROOM times the worst peak allocation, and gets the
+worst cell of the matrix under --target-ms.
+
+Usage:
+    python benchmarks/right_size.py [--content 256,4096,65536,262144] [--limits 5,20,100]
+                                    [--repeat N] [--latency-ms L] [--cpu-scale S]
+                                    [--target-ms T] [--runtime-mb M] [--json]
+'''
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('TABLE_NAME', 'notes_bench')
+
+import app
+import instrumentation
+import note_stats
+from tests.fake_table import FakeTable
+
+USER_ID = 'bench@example.com'
+USER_NAME = 'Bench User'
+BASE_TIMESTAMP = 1723331552
+# MemorySize steps considered, in MB; Lambda takes any value from 128 to 10240
+MEMORY_STEPS = (128, 256, 384, 512, 768, 1024, 1536, 1769, 2048, 3008)
+FULL_VCPU_MB = 1769
+HEADROOM = 1.5
+TIMEOUT_S = 3
+
+# name -> (template function, handler, takes a notes-per-request size)
+HANDLERS = {
+    'add': ('AddNoteFunction', app.add_note_handler, False),
+    'add_batch': ('AddNotesBatchFunction', app.add_notes_batch_handler, True),
+    'delete': ('DeleteNoteFunction', app.delete_note_handler, False),
+    'get_note': ('GetNoteFunction', app.get_note_handler, False),
+    'get_notes': ('GetNotesFunction', app.get_notes_handler, True),
+    'search': ('SearchNotesFunction', app.search_notes_handler, True),
+    'stats': ('GetNoteStatsFunction', app.get_note_stats_handler, False),
+    'update': ('UpdateNoteFunction', app.update_note_handler, False),
+}
+
+
+class Profile(object):
+    '''
+    Wall time, CPU time and peak allocation per phase of one invocation.
+    '''
+    def __init__(self, tracing):
+        self.tracing = tracing
+        self.phases = {}
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def add(self, name, wall, cpu, peak):
+        with self.lock:
+            entry = self.phases.setdefault(name, [0.0, 0.0, 0])
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] = max(entry[2], peak)
+
+    def fold(self, peak):
+        # tracemalloc keeps one peak, which every phase resets; keep the highest seen
+        with self.lock:
+            self.peak = max(self.peak, peak)
+
+
+_profile = None
+
+
+class measure(object):
+    '''
+    Charges a block to a phase of the invocation being profiled (a no-op otherwise).
+    '''
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = _profile
+        if self.profile is None:
+            return self
+        if self.profile.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            self.profile.fold(peak)
+            tracemalloc.reset_peak()
+            self.base = current
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is None:
+            return False
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        peak = 0
+        if self.profile.tracing:
+            peak = tracemalloc.get_traced_memory()[1]
+            self.profile.fold(peak)
+            peak -= self.base
+        self.profile.add(self.name, wall, cpu, peak)
+        return False
+
+
+class ProfiledPhase(instrumentation.phase):
+    '''
+    instrumentation.phase that also feeds the profile, swapped in for the run.
+    '''
+    __slots__ = ('measure',)
+
+    def __enter__(self):
+        self.measure = measure(self.name)
+        self.measure.__enter__()
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        return self.measure.__exit__(*exc)
+
+
+class ProfiledTable(object):
+    '''
+    Charges every table call to the 'dynamodb' phase.
+    '''
+    def __init__(self, table):
+        self.table = table
+
+    def __getattr__(self, name):
+        attr = getattr(self.table, name)
+        if name not in instrumentation.TABLE_CALLS:
+            return attr
+        def call(*args, **params):
+            with measure('dynamodb'):
+                return attr(*args, **params)
+        return call
+
+
+def makeContent(size):
+    return ('lorem ipsum dolor sit amet ' * (size // 27 + 1))[:size]
+
+
+def makeNote(i, content):
+    return {
+        'user_id': USER_ID,
+        'user_name': USER_NAME,
+        'note_id': '%s:%08d-4cbd-45e0-9344-71f3e7a65e39' % (USER_ID, i),
+        'timestamp': BASE_TIMESTAMP + i,
+        'expires': int(time.time()) + 180 * 86400,
+        'title': 'Note %d' % i,
+        'content': content,
+        'cat': 'general'
+    }
+
+
+def seed(count, content):
+    table = FakeTable(name=app.tablename)
+    app.setTable(ProfiledTable(table))
+    notes = [makeNote(i, content) for i in range(count)]
+    for note in notes:
+        table.put_item(Item=note)
+        app.updateSearchIndex(USER_ID, None, note)
+    app.updateStats(USER_ID, note_stats.countNotes(notes))
+    app.notecache.clear()
+    return table, notes
+
+
+def event(method, resource, body=None, query=None, path=None):
+    return {
+        'resource': resource,
+        'httpMethod': method,
+        'headers': {'app_user_id': USER_ID, 'app_user_name': USER_NAME},
+        'queryStringParameters': query,
+        'pathParameters': path,
+        'body': json.dumps(body) if body is not None else None
+    }
+
+
+'''
+The event for one cell, and a function that puts the table back the way the
+measurement expects it (run before every invocation, outside the measurement).
+
+'''
+def makeCase(kind, table, notes, content, size):
+    note = notes[0]
+    restore = lambda: None
+    if kind == 'add':
+        request = event('POST', '/note', {'Item': {'title': 'Bench note', 'content': content, 'cat': 'general'}})
+    elif kind == 'add_batch':
+        items = [{'title': 'Bench note %d' % i, 'content': content, 'cat': 'general'} for i in range(size)]
+        request = event('POST', '/notes', {'Items': items})
+    elif kind == 'delete':
+        request = event('DELETE', '/note/t/{timestamp}', path={'timestamp': str(note['timestamp'])})
+        restore = lambda: table.put_item(Item=note)
+    elif kind == 'get_note':
+        request = event('GET', '/note/n/{note_id}', path={'note_id': note['note_id']})
+    elif kind == 'get_notes':
+        request = event('GET', '/notes', query={'limit': str(size)})
+    elif kind == 'search':
+        request = event('GET', '/notes/search', query={'q': 'lorem', 'limit': str(size)})
+    elif kind == 'stats':
+        request = event('GET', '/notes/stats')
+    else:
+        item = {'timestamp': note['timestamp'], 'note_id': note['note_id'], 'title': 'Bench note',
+                'content': content, 'cat': 'general'}
+        request = event('PATCH', '/note', {'Item': item})
+        restore = lambda: table.put_item(Item=note)
+    return request, restore
+
+
+def invoke(handler, request, restore, table, tracing):
+    global _profile
+    restore()
+    app.notecache.clear()
+    del table.calls[:]
+    profile = Profile(tracing)
+    if tracing:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+    _profile = profile
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    try:
+        response = handler(request, None)
+    finally:
+        cpu = time.process_time() - c0
+        wall = time.perf_counter() - t0
+        _profile = None
+    peak = 0
+    if tracing:
+        profile.fold(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        peak = profile.peak - base
+    status = response.get('statusCode', 500) if isinstance(response, dict) else 500
+    return wall, cpu, peak, profile, status
+
+
+def phaseTable(timed, traced, wall, cpu):
+    phases = {}
+    for name, (phase_wall, phase_cpu, _) in sorted(timed.phases.items()):
+        phases[name] = {
+            'wall_ms': round(phase_wall * 1000, 3),
+            'cpu_ms': round(phase_cpu * 1000, 3),
+            'peak_kb': round(traced.phases.get(name, (0, 0, 0))[2] / 1024.0, 1)
+        }
+    phases['other'] = {
+        'wall_ms': round(max(0.0, wall - sum(p[0] for p in timed.phases.values())) * 1000, 3),
+        'cpu_ms': round(max(0.0, cpu - sum(p[1] for p in timed.phases.values())) * 1000, 3),
+        'peak_kb': None
+    }
+    return phases
+
+
+def profileCell(kind, content_size, size, args):
+    function, handler, _ = HANDLERS[kind]
+    content = makeContent(content_size)
+    table, notes = seed(max(args.limits), content)
+    table.latency = args.latency_ms / 1000.0
+    request, restore = makeCase(kind, table, notes, content, size)
+    # warm up: first calls build caches and lazy imports
+    invoke(handler, request, restore, table, False)
+    runs = sorted((invoke(handler, request, restore, table, False) for _ in range(args.repeat)), key=lambda run: run[0])
+    wall, cpu, _, timed, status = runs[len(runs) // 2]
+    _, _, peak, traced, _ = invoke(handler, request, restore, table, True)
+    return {
+        'handler': kind,
+        'function': function,
+        'content': content_size,
+        'size': size,
+        'status': status,
+        'wall_ms': round(wall * 1000, 3),
+        'cpu_ms': round(cpu * 1000, 3),
+        'peak_kb': round(peak / 1024.0, 1),
+        'phases': phaseTable(timed, traced, wall, cpu)
+    }
+
+
+def estimateMs(cell, memory, cpu_scale):
+    cpu = cell['cpu_ms'] * cpu_scale
+    offcpu = max(0.0, cell['wall_ms'] - cell['cpu_ms'])
+    return cpu * max(1.0, FULL_VCPU_MB / float(memory)) + offcpu
+
+
+'''
+Smallest MemorySize step that fits the worst peak and keeps the slowest cell under the
+target, with the estimated duration of the slowest cell at 128 MB and at that size.
+
+'''
+def recommend(cells, args):
+    peak_mb = max(cell['peak_kb'] for cell in cells) / 1024.0
+    needed_mb = args.runtime_mb + HEADROOM * peak_mb
+    target = min(args.target_ms, TIMEOUT_S * 1000.0)
+    choice = None
+    for memory in MEMORY_STEPS:
+        if memory < needed_mb:
+            continue
+        if max(estimateMs(cell, memory, args.cpu_scale) for cell in cells) <= target:
+            choice = memory
+            break
+    if choice is None:
+        choice = MEMORY_STEPS[-1]
+    slowest = max(cells, key=lambda cell: cell['cpu_ms'] * args.cpu_scale + cell['wall_ms'])
+    return {
+        'function': cells[0]['function'],
+        'peak_mb': round(peak_mb, 2),
+        'needed_mb': round(needed_mb, 1),
+        'slowest': {'content': slowest['content'], 'size': slowest['size']},
+        'est_ms_at_128': round(estimateMs(slowest, MEMORY_STEPS[0], args.cpu_scale), 1),
+        'memory_mb': choice,
+        'est_ms': round(estimateMs(slowest, choice, args.cpu_scale), 1),
+        'meets_target': max(estimateMs(cell, choice, args.cpu_scale) for cell in cells) <= target
+    }
+
+
+def parseSizes(text):
+    try:
+        return [int(value) for value in text.split(',') if value]
+    except ValueError:
+        raise SystemExit("expected a comma separated list of integers: %s" % text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--content', type=parseSizes, default=[256, 4096, 65536, 262144], help='note content bytes')
+    parser.add_argument('--limits', type=parseSizes, default=[5, 20, 100], help='notes per page / batch')
+    parser.add_argument('--handlers', default=','.join(HANDLERS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated DynamoDB latency per call')
+    parser.add_argument('--cpu-scale', type=float, default=1.0, help='Lambda vCPU time per local CPU second')
+    parser.add_argument('--target-ms', type=float, default=1000.0, help='latency goal for the slowest cell')
+    parser.add_argument('--runtime-mb', type=float, default=70.0, help='memory of the runtime, boto3 and app.py')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+    kinds = [kind for kind in args.handlers.split(',') if kind]
+    for kind in kinds:
+        if kind not in HANDLERS:
+            raise SystemExit("unknown handler in --handlers: %s" % kind)
+
+    instrumentation.emit = lambda line: None
+    instrumentation.phase = ProfiledPhase
+    cells = {kind: [] for kind in kinds}
+    for kind in kinds:
+        sizes = args.limits if HANDLERS[kind][2] else [None]
+        for content_size in args.content:
+            for size in sizes:
+                cells[kind].append(profileCell(kind, content_size, size, args))
+
+    report = {
+        'settings': {
+            'latency_ms': args.latency_ms,
+            'cpu_scale': args.cpu_scale,
+            'target_ms': args.target_ms,
+            'runtime_mb': args.runtime_mb
+        },
+        'functions': {kind: recommend(cells[kind], args) for kind in kinds},
+        'cells': [cell for kind in kinds for cell in cells[kind]]
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"{'handler':<10} {'content':>8} {'size':>5} {'status':>6} {'wall ms':>9} {'cpu ms':>9} {'peak KB':>9}  phases (wall/cpu ms, peak KB)")
+    for cell in report['cells']:
+        phases = '  '.join(f"{name} {p['wall_ms']:.2f}/{p['cpu_ms']:.2f}" + (f"/{p['peak_kb']:.0f}" if p['peak_kb'] is not None else '')
+                           for name, p in cell['phases'].items())
+        size = '-' if cell['size'] is None else cell['size']
+        print(f"{cell['handler']:<10} {cell['content']:>8} {size:>5} {cell['status']:>6} {cell['wall_ms']:>9.2f} "
+              f"{cell['cpu_ms']:>9.2f} {cell['peak_kb']:>9.1f}  {phases}")
+    print()
+    print(f"{'function':<24} {'peak MB':>8} {'needs MB':>9} {'ms @128':>9} {'MemorySize':>11} {'ms':>8}")
+    for kind, rec in report['functions'].items():
+        flag = '' if rec['meets_target'] else '  (over target)'
+        print(f"{rec['function']:<24} {rec['peak_mb']:>8.2f} {rec['needed_mb']:>9.1f} {rec['est_ms_at_128']:>9.1f} "
+              f"{rec['memory_mb']:>11} {rec['est_ms']:>8.1f}{flag}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
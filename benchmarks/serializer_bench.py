@@ -0,0 +1,65 @@
+'''
+serializer_bench:
+Compares the old DecimalEncoder path (json.dumps with a default() hook per Decimal)
+with serializer.dumps() on note pages shaped like what DynamoDB hands back:
+Decimal timestamps/expires, a few short strings and a content body.
+
+Usage:
+    python benchmarks/serializer_bench.py [--repeat N] [--content BYTES]
+'''
+import argparse
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+import serializer
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def makeNote(i, content_size):
+    return {
+        'user_id': 'bench@example.com',
+        'user_name': 'Bench User',
+        'note_id': 'bench@example.com:%08d-4cbd-45e0-9344-71f3e7a65e39' % i,
+        'timestamp': Decimal('%d.0' % (1723331552 - i)),
+        'expires': Decimal('%d.0' % (1738883552 - i)),
+        'title': 'Note number %d' % i,
+        'cat': 'general',
+        'content': ('lorem ipsum dolor sit amet ' * (content_size // 27 + 1))[:content_size]
+    }
+
+
+def makePage(count, content_size):
+    items = [makeNote(i, content_size) for i in range(count)]
+    return {'Items': items, 'Count': count, 'next': None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200, help='encodes per measurement')
+    parser.add_argument('--content', type=int, default=512, help='content bytes per note')
+    args = parser.parse_args(argv)
+
+    backend = 'orjson' if serializer.orjson is not None else 'json'
+    print(f"serializer backend: {backend}")
+    print(f"{'notes':>6} {'DecimalEncoder us':>18} {'serializer us':>14} {'speedup':>8} {'bytes old':>10} {'bytes new':>10}")
+    for count in (1, 5, 25, 100):
+        page = makePage(count, args.content)
+        old = min(timeit.repeat(lambda: json.dumps(page, cls=DecimalEncoder), number=args.repeat, repeat=5)) / args.repeat
+        new = min(timeit.repeat(lambda: serializer.dumps(page), number=args.repeat, repeat=5)) / args.repeat
+        old_size = len(json.dumps(page, cls=DecimalEncoder).encode('utf-8'))
+        new_size = len(serializer.dumps(page).encode('utf-8'))
+        print(f"{count:>6} {old * 1e6:>18.1f} {new * 1e6:>14.1f} {old / new:>7.2f}x {old_size:>10} {new_size:>10}")
+
+
+if __name__ == '__main__':
+    main()
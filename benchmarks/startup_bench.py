@@ -0,0 +1,154 @@
+'''
+startup_bench:
+Measures what a cold start costs each of the API handlers in api/app.py:
+
+  * import  - time to import the app module in a fresh interpreter
+  * first   - latency of the first invocation (builds the DynamoDB client)
+  * warm    - latency of a second invocation in the same process
+
+Every sample runs in its own subprocess so nothing is cached between rounds.  The
+DynamoDB client is real, but its HTTP send is short-circuited with canned responses
+(botocore 'before-send' hook), so the numbers cover client construction, request
+serialization and response parsing without any network or AWS account.
+
+Usage:
+    python benchmarks/startup_bench.py [--rounds N] [--json]
+'''
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'api')
+
+HANDLERS = [
+    'add_note_handler',
+    'delete_note_handler',
+    'get_note_handler',
+    'get_notes_handler',
+    'update_note_handler',
+]
+
+# runs inside the child interpreter; prints one JSON line of timings
+CHILD = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+
+import dynamo
+from botocore.awsrequest import AWSResponse
+
+NOTE = {"user_id": {"S": "bench@example.com"}, "timestamp": {"N": "1723331552"},
+        "note_id": {"S": "bench@example.com:eebf7dfc-4cbd-45e0-9344-71f3e7a65e39"},
+        "title": {"S": "My First Note"}, "content": {"S": "Content of my first note"},
+        "cat": {"S": "general"}, "expires": {"N": "1738883552"}}
+CANNED = {
+    "Query": {"Items": [NOTE], "Count": 1, "ScannedCount": 1},
+    "GetItem": {"Item": NOTE},
+}
+
+class Raw(object):
+    def __init__(self, body):
+        self.body = body
+    def stream(self, **kwargs):
+        yield self.body
+
+def fake_send(request, **kwargs):
+    op = request.headers.get("X-Amz-Target", b"").decode().split(".")[-1]
+    body = json.dumps(CANNED.get(op, {})).encode()
+    return AWSResponse(request.url, 200, {"x-amzn-requestid": "bench"}, Raw(body))
+
+getClient = dynamo.getClient
+def patched():
+    first = dynamo._client is None
+    client = getClient()
+    if first:
+        client.meta.events.register("before-send.dynamodb", fake_send)
+    return client
+dynamo.getClient = patched
+
+handler = getattr(app, sys.argv[1])
+event = json.loads(sys.argv[2])
+t2 = time.perf_counter()
+handler(json.loads(json.dumps(event)), None)
+t3 = time.perf_counter()
+handler(json.loads(json.dumps(event)), None)
+t4 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first": t3 - t2, "warm": t4 - t3}))
+'''
+
+
+def makeEvent(handler):
+    headers = {
+        'app_user_id': 'bench@example.com',
+        'app_user_name': 'Bench User'
+    }
+    item = {
+        'title': 'My First Note',
+        'content': 'Content of my first note',
+        'cat': 'general'
+    }
+    if handler == 'update_note_handler':
+        item = dict(item, timestamp=1723331552, note_id='bench@example.com:eebf7dfc-4cbd-45e0-9344-71f3e7a65e39')
+    return {
+        'body': json.dumps({'Item': item}),
+        'headers': headers,
+        'queryStringParameters': {'limit': '5'},
+        'pathParameters': {
+            'note_id': 'bench@example.com:eebf7dfc-4cbd-45e0-9344-71f3e7a65e39',
+            'timestamp': '1723331552'
+        }
+    }
+
+
+def runOnce(handler):
+    env = dict(os.environ)
+    env.setdefault('TABLE_NAME', 'notes_bench')
+    env.setdefault('AWS_REGION', 'us-east-1')
+    env.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    env['PYTHONPATH'] = API_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD, handler, json.dumps(makeEvent(handler))],
+        env=env, cwd=API_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 2),
+        'p90_ms': round(samples[max(0, math.ceil(0.9 * len(samples)) - 1)] * 1000, 2),
+        'max_ms': round(samples[-1] * 1000, 2)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=10, help='cold processes per handler')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = {}
+    for handler in HANDLERS:
+        runs = [runOnce(handler) for _ in range(args.rounds)]
+        report[handler] = {phase: summarize([run[phase] for run in runs]) for phase in ('import', 'first', 'warm')}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+    print(f"{'handler':<22} {'phase':<7} {'median ms':>10} {'p90 ms':>10} {'max ms':>10}")
+    for handler, phases in report.items():
+        for phase, stats in phases.items():
+            print(f"{handler:<22} {phase:<7} {stats['median_ms']:>10} {stats['p90_ms']:>10} {stats['max_ms']:>10}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
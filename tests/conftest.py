@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, "api")
+
+# the Lambda bundle is api/ itself, so its modules import each other top-level
+for path in (API_DIR, ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("TABLE_NAME", "notes_table_test")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+
+
+@pytest.fixture()
+def table():
+    """ A fresh in-memory notes table wired into app """
+    import app
+    from tests.fake_table import FakeTable
+
+    previous = app.table
+    fake = FakeTable(name=app.tablename)
+    app.setTable(fake)
+    yield fake
+    app.setTable(previous)
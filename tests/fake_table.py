@@ -0,0 +1,730 @@
+import copy
+import math
+import re
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+import botocore.exceptions
+
+"""
+In-memory stand-in for the notes table.
+
+FakeTable has the same methods (and the same plain-Python values in and out) as
+api/dynamo.py's DynamoTable, so it can be swapped in with app.setTable().  It honors
+the user_id/timestamp key schema and the note_id-index GSI, and understands enough of
+DynamoDB's expression language for the handlers: key conditions, condition/filter
+expressions, update expressions (SET/REMOVE/ADD/DELETE) and projections, plus
+Limit/ScanIndexForward/ExclusiveStartKey paging.  Errors are raised as botocore
+ClientErrors shaped like the real service's.
+"""
+
+MISSING = object()
+
+
+def clientError(code, message, status=400, operation="FakeTable"):
+    return botocore.exceptions.ClientError(
+        {
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"RequestId": "fake-request-id", "HTTPStatusCode": status},
+        },
+        operation,
+    )
+
+
+def validationError(message):
+    return clientError("ValidationException", message)
+
+
+def toStored(value):
+    """Normalize a Python value the way DynamoDB round-trips it."""
+    if isinstance(value, bool) or value is None or isinstance(value, (str, Decimal)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if hasattr(value, "value") and isinstance(getattr(value, "value"), (bytes, bytearray)):
+        return bytes(value.value)
+    if isinstance(value, dict):
+        return {k: toStored(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [toStored(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        if len(value) == 0:
+            raise validationError("One or more parameter values were invalid: An number set  may not be empty")
+        return set(toStored(v) for v in value)
+    raise TypeError("Unsupported type %r" % type(value))
+
+
+def writeUnits(*items):
+    """Write capacity units of a write touching the given item versions (1 per started KB)."""
+    return float(max([math.ceil(itemSize(item) / 1024.0) for item in items if item] or [1]))
+
+
+def readUnits(items, consistent=False):
+    """Read capacity units of reading the given items (0.5 per started 4 KB, 1 if consistent)."""
+    size = sum(itemSize(item) for item in items if item)
+    return max(1, math.ceil(size / 4096.0)) * (1.0 if consistent else 0.5)
+
+
+def itemSize(item):
+    """Approximate DynamoDB item size in bytes (attribute names + values)."""
+    def size(value):
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        if isinstance(value, bytes):
+            return len(value)
+        if isinstance(value, Decimal):
+            return min(21, (len(value.as_tuple().digits) + 1) // 2 + 1)
+        if isinstance(value, bool) or value is None:
+            return 1
+        if isinstance(value, dict):
+            return 3 + sum(len(k.encode("utf-8")) + size(v) for k, v in value.items())
+        if isinstance(value, (list, set)):
+            return 3 + sum(size(v) + 1 for v in value)
+        return 0
+    return sum(len(k.encode("utf-8")) + size(v) for k, v in item.items())
+
+
+# --------------------------------------------------------------------------------------
+# expression language
+# --------------------------------------------------------------------------------------
+TOKEN = re.compile(r"\s*(?:(<>|<=|>=|[=<>(),.+\-\[\]])|(#[A-Za-z0-9_]+)|(:[A-Za-z0-9_]+)|([A-Za-z_][A-Za-z0-9_]*)|(\d+))")
+KEYWORDS = {"AND", "OR", "NOT", "BETWEEN", "IN", "SET", "REMOVE", "ADD", "DELETE"}
+COMPARATORS = {"=", "<>", "<", "<=", ">", ">="}
+
+
+class Parser(object):
+    def __init__(self, text, names, values):
+        self.tokens = []
+        pos = 0
+        text = text or ""
+        while pos < len(text):
+            if text[pos:].strip() == "":
+                break
+            match = TOKEN.match(text, pos)
+            if not match:
+                raise validationError("Invalid expression: unexpected input at %r" % text[pos:])
+            op, name, value, ident, number = match.groups()
+            if op:
+                self.tokens.append(("op", op))
+            elif name:
+                if name not in (names or {}):
+                    raise validationError("An expression attribute name used in the document path is not defined; attribute name: %s" % name)
+                self.tokens.append(("name", names[name]))
+            elif value:
+                if value not in (values or {}):
+                    raise validationError("An expression attribute value used in expression is not defined; attribute value: %s" % value)
+                self.tokens.append(("value", toStored(values[value])))
+            elif ident:
+                if ident.upper() in KEYWORDS:
+                    self.tokens.append(("kw", ident.upper()))
+                else:
+                    self.tokens.append(("ident", ident))
+            else:
+                self.tokens.append(("num", int(number)))
+            pos = match.end()
+        self.pos = 0
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (text and token[1] != text):
+            raise validationError("Invalid expression: expected %s near token %r" % (text or kind, token[1]))
+        self.pos += 1
+        return token
+
+    def accept(self, kind, text=None):
+        token = self.peek()
+        if token[0] == kind and (text is None or token[1] == text):
+            self.pos += 1
+            return True
+        return False
+
+    def done(self):
+        return self.pos >= len(self.tokens)
+
+    # paths -----------------------------------------------------------------------
+    def path(self):
+        kind, text = self.take()
+        if kind not in ("ident", "name"):
+            raise validationError("Invalid expression: expected an attribute name near %r" % text)
+        parts = [text]
+        while True:
+            if self.accept("op", "."):
+                kind, text = self.take()
+                if kind not in ("ident", "name"):
+                    raise validationError("Invalid expression: bad document path")
+                parts.append(text)
+            elif self.accept("op", "["):
+                parts.append(self.take("num")[1])
+                self.take("op", "]")
+            else:
+                return ("path", tuple(parts))
+
+    # conditions ------------------------------------------------------------------
+    def condition(self):
+        node = self.conjunction()
+        while self.accept("kw", "OR"):
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept("kw", "AND"):
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept("kw", "NOT"):
+            return ("not", self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        if self.peek() == ("op", "("):
+            self.take()
+            node = self.condition()
+            self.take("op", ")")
+            return node
+        kind, text = self.peek()
+        if kind == "ident" and text in ("attribute_exists", "attribute_not_exists", "begins_with", "contains", "attribute_type"):
+            self.take()
+            self.take("op", "(")
+            args = [self.operand()]
+            while self.accept("op", ","):
+                args.append(self.operand())
+            self.take("op", ")")
+            return ("func", text, args)
+        left = self.operand()
+        if self.accept("kw", "BETWEEN"):
+            low = self.operand()
+            self.take("kw", "AND")
+            high = self.operand()
+            return ("between", left, low, high)
+        if self.accept("kw", "IN"):
+            self.take("op", "(")
+            options = [self.operand()]
+            while self.accept("op", ","):
+                options.append(self.operand())
+            self.take("op", ")")
+            return ("in", left, options)
+        kind, op = self.take("op")
+        if op not in COMPARATORS:
+            raise validationError("Invalid expression: unexpected operator %r" % op)
+        return ("cmp", op, left, self.operand())
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == "value":
+            self.take()
+            return ("value", text)
+        if kind == "ident" and text == "size" and self.peek(1) == ("op", "("):
+            self.take()
+            self.take("op", "(")
+            path = self.path()
+            self.take("op", ")")
+            return ("size", path)
+        return self.path()
+
+    # updates ---------------------------------------------------------------------
+    def update(self):
+        actions = []
+        while not self.done():
+            kind, clause = self.take("kw")
+            while True:
+                path = self.path()
+                if clause == "SET":
+                    self.take("op", "=")
+                    actions.append(("SET", path, self.setValue()))
+                elif clause == "REMOVE":
+                    actions.append(("REMOVE", path, None))
+                elif clause in ("ADD", "DELETE"):
+                    actions.append((clause, path, self.operand()))
+                else:
+                    raise validationError("Invalid UpdateExpression: unknown clause %s" % clause)
+                if not self.accept("op", ","):
+                    break
+        return actions
+
+    def setValue(self):
+        node = self.setOperand()
+        if self.accept("op", "+"):
+            return ("plus", node, self.setOperand())
+        if self.accept("op", "-"):
+            return ("minus", node, self.setOperand())
+        return node
+
+    def setOperand(self):
+        kind, text = self.peek()
+        if kind == "ident" and text in ("if_not_exists", "list_append") and self.peek(1) == ("op", "("):
+            self.take()
+            self.take("op", "(")
+            first = self.setValue()
+            self.take("op", ",")
+            second = self.setValue()
+            self.take("op", ")")
+            return (text, first, second)
+        return self.operand()
+
+    # projections -----------------------------------------------------------------
+    def projection(self):
+        paths = [self.path()]
+        while self.accept("op", ","):
+            paths.append(self.path())
+        return paths
+
+
+def resolve(item, path):
+    value = item
+    for part in path[1]:
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return MISSING
+            value = value[part]
+        else:
+            if not isinstance(value, dict) or part not in value:
+                return MISSING
+            value = value[part]
+    return value
+
+
+def evalOperand(item, node):
+    if node[0] == "value":
+        return node[1]
+    if node[0] == "size":
+        value = resolve(item, node[1])
+        if value is MISSING:
+            return MISSING
+        if isinstance(value, str):
+            return Decimal(len(value.encode("utf-8")))
+        return Decimal(len(value))
+    return resolve(item, node)
+
+
+def comparable(a, b):
+    return a is not MISSING and b is not MISSING and type(a) == type(b) and not isinstance(a, (dict, list, set))
+
+
+def evalCondition(item, node):
+    kind = node[0]
+    if kind == "and":
+        return evalCondition(item, node[1]) and evalCondition(item, node[2])
+    if kind == "or":
+        return evalCondition(item, node[1]) or evalCondition(item, node[2])
+    if kind == "not":
+        return not evalCondition(item, node[1])
+    if kind == "cmp":
+        op, left, right = node[1], evalOperand(item, node[2]), evalOperand(item, node[3])
+        if op == "=":
+            return left is not MISSING and left == right
+        if op == "<>":
+            return left is MISSING or left != right
+        if not comparable(left, right):
+            return False
+        return {"<": left < right, "<=": left <= right, ">": left > right, ">=": left >= right}[op]
+    if kind == "between":
+        value, low, high = (evalOperand(item, n) for n in node[1:])
+        return comparable(value, low) and comparable(value, high) and low <= value <= high
+    if kind == "in":
+        value = evalOperand(item, node[1])
+        return value is not MISSING and any(value == evalOperand(item, n) for n in node[2])
+    if kind == "func":
+        name, args = node[1], node[2]
+        value = evalOperand(item, args[0])
+        if name == "attribute_exists":
+            return value is not MISSING
+        if name == "attribute_not_exists":
+            return value is MISSING
+        if name == "begins_with":
+            prefix = evalOperand(item, args[1])
+            return comparable(value, prefix) and isinstance(value, (str, bytes)) and value.startswith(prefix)
+        if name == "contains":
+            needle = evalOperand(item, args[1])
+            if isinstance(value, str) and isinstance(needle, str):
+                return needle in value
+            return isinstance(value, (list, set)) and needle in value
+        if name == "attribute_type":
+            return value is not MISSING
+    raise validationError("Invalid expression node %r" % (kind,))
+
+
+def evalSetValue(item, node):
+    kind = node[0]
+    if kind == "plus" or kind == "minus":
+        left, right = evalSetValue(item, node[1]), evalSetValue(item, node[2])
+        if not isinstance(left, Decimal) or not isinstance(right, Decimal):
+            raise validationError("An operand in the update expression has an incorrect data type")
+        return left + right if kind == "plus" else left - right
+    if kind == "if_not_exists":
+        value = resolve(item, node[1])
+        return evalSetValue(item, node[2]) if value is MISSING else value
+    if kind == "list_append":
+        return list(evalSetValue(item, node[1])) + list(evalSetValue(item, node[2]))
+    value = evalOperand(item, node)
+    if value is MISSING:
+        raise validationError("The provided expression refers to an attribute that does not exist in the item")
+    return copy.deepcopy(value)
+
+
+def assign(item, path, value):
+    parts = path[1]
+    target = item
+    for part in parts[:-1]:
+        target = target[part] if isinstance(part, int) else target.setdefault(part, {})
+    target[parts[-1]] = value
+
+
+def removePath(item, path):
+    parts = path[1]
+    target = item
+    for part in parts[:-1]:
+        target = resolve({"_": target}, ("path", ("_", part)))
+        if target is MISSING:
+            return
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+    elif isinstance(target, list) and parts[-1] < len(target):
+        del target[parts[-1]]
+
+
+def applyUpdate(item, actions):
+    for action, path, node in actions:
+        if action == "SET":
+            assign(item, path, evalSetValue(item, node))
+        elif action == "REMOVE":
+            removePath(item, path)
+        elif action == "ADD":
+            value = evalOperand(item, node)
+            current = resolve(item, path)
+            if isinstance(value, Decimal):
+                assign(item, path, (current if current is not MISSING else Decimal(0)) + value)
+            elif isinstance(value, set):
+                assign(item, path, (current if current is not MISSING else set()) | value)
+            else:
+                raise validationError("ADD action only supports Number and Set types")
+        elif action == "DELETE":
+            value = evalOperand(item, node)
+            current = resolve(item, path)
+            if current is not MISSING:
+                remaining = current - value
+                if remaining:
+                    assign(item, path, remaining)
+                else:
+                    removePath(item, path)
+
+
+def project(item, paths):
+    """Projection of top-level attributes (all the handlers ever ask for)."""
+    if not paths:
+        return copy.deepcopy(item)
+    out = {}
+    for path in paths:
+        name = path[1][0]
+        if name in item:
+            out[name] = copy.deepcopy(item[name])
+    return out
+
+
+# --------------------------------------------------------------------------------------
+# the table
+# --------------------------------------------------------------------------------------
+class FakeTable(object):
+    def __init__(self, name="notes_table", hash_key="user_id", range_key="timestamp",
+                 indexes=None, latency=0.0):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = {"note_id-index": ("note_id", None), "expires-index": ("expires_bucket", "expires")} if indexes is None else indexes
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.partitions = {}
+        self.index_data = {index: {} for index in self.indexes}
+        self.calls = []
+
+    # helpers ---------------------------------------------------------------------
+    def _call(self, operation, params):
+        self.calls.append((operation, params))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _consumed(self, params, result, units):
+        # ReturnConsumedCapacity: TOTAL / INDEXES both get the table total here
+        if params.get("ReturnConsumedCapacity") in ("TOTAL", "INDEXES"):
+            capacity = {"TableName": self.name, "CapacityUnits": units}
+            result["ConsumedCapacity"] = [capacity] if "RequestItems" in params else capacity
+        return result
+
+    def _keyOf(self, key, operation="GetItem"):
+        expected = {self.hash_key, self.range_key}
+        if set(key) != expected:
+            raise clientError("ValidationException", "The provided key element does not match the schema", operation=operation)
+        hash_value, range_value = toStored(key[self.hash_key]), toStored(key[self.range_key])
+        if not isinstance(hash_value, str) or not isinstance(range_value, Decimal):
+            raise clientError("ValidationException", "The provided key element does not match the schema", operation=operation)
+        return hash_value, range_value
+
+    def _get(self, hash_value, range_value):
+        return self.partitions.get(hash_value, {}).get(range_value)
+
+    def _put(self, item):
+        key = (item[self.hash_key], item[self.range_key])
+        self._unindex(self._get(*key), key)
+        self.partitions.setdefault(key[0], {})[key[1]] = item
+        for index, (index_hash, index_range) in self.indexes.items():
+            if index_hash in item:
+                self.index_data[index].setdefault(item[index_hash], {})[key] = item
+
+    def _delete(self, hash_value, range_value):
+        partition = self.partitions.get(hash_value, {})
+        old = partition.pop(range_value, None)
+        if not partition:
+            self.partitions.pop(hash_value, None)
+        self._unindex(old, (hash_value, range_value))
+        return old
+
+    def _unindex(self, old, key):
+        if old is None:
+            return
+        for index, (index_hash, index_range) in self.indexes.items():
+            if index_hash in old:
+                bucket = self.index_data[index].get(old[index_hash], {})
+                bucket.pop(key, None)
+                if not bucket:
+                    self.index_data[index].pop(old[index_hash], None)
+
+    def _check(self, current, params, operation):
+        expression = params.get("ConditionExpression")
+        if not expression:
+            return
+        node = Parser(expression, params.get("ExpressionAttributeNames"), params.get("ExpressionAttributeValues")).condition()
+        if not evalCondition(current or {}, node):
+            raise clientError("ConditionalCheckFailedException", "The conditional request failed", operation=operation)
+
+    def _projection(self, params):
+        expression = params.get("ProjectionExpression")
+        if not expression:
+            return None
+        return Parser(expression, params.get("ExpressionAttributeNames"), None).projection()
+
+    def _keyDict(self, item, index=None):
+        key = {self.hash_key: item[self.hash_key], self.range_key: item[self.range_key]}
+        if index:
+            index_hash, index_range = self.indexes[index]
+            key[index_hash] = item[index_hash]
+            if index_range:
+                key[index_range] = item[index_range]
+        return key
+
+    def allItems(self):
+        with self.lock:
+            items = []
+            for hash_value in sorted(self.partitions):
+                partition = self.partitions[hash_value]
+                items.extend(copy.deepcopy(partition[r]) for r in sorted(partition))
+            return items
+
+    def __bool__(self):
+        # the handlers test 'if table:' for test mode; an empty table is still a table
+        return True
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(partition) for partition in self.partitions.values())
+
+    # single item operations ------------------------------------------------------
+    def put_item(self, **params):
+        self._call("PutItem", params)
+        item = toStored(params["Item"])
+        for key in (self.hash_key, self.range_key):
+            if item.get(key) is None:
+                raise validationError("One or more parameter values were invalid: Missing the key %s in the item" % key)
+        hash_value, range_value = self._keyOf({k: item[k] for k in (self.hash_key, self.range_key)}, "PutItem")
+        with self.lock:
+            old = self._get(hash_value, range_value)
+            self._check(old, params, "PutItem")
+            self._put(item)
+        result = {}
+        if params.get("ReturnValues") == "ALL_OLD" and old is not None:
+            result["Attributes"] = copy.deepcopy(old)
+        return self._consumed(params, result, writeUnits(old, item))
+
+    def get_item(self, **params):
+        self._call("GetItem", params)
+        hash_value, range_value = self._keyOf(params["Key"], "GetItem")
+        with self.lock:
+            item = self._get(hash_value, range_value)
+            result = {"Item": project(item, self._projection(params))} if item is not None else {}
+            return self._consumed(params, result, readUnits([item], params.get("ConsistentRead")))
+
+    def delete_item(self, **params):
+        self._call("DeleteItem", params)
+        hash_value, range_value = self._keyOf(params["Key"], "DeleteItem")
+        with self.lock:
+            old = self._get(hash_value, range_value)
+            self._check(old, params, "DeleteItem")
+            self._delete(hash_value, range_value)
+        result = {}
+        if params.get("ReturnValues") == "ALL_OLD" and old is not None:
+            result["Attributes"] = copy.deepcopy(old)
+        return self._consumed(params, result, writeUnits(old))
+
+    def update_item(self, **params):
+        self._call("UpdateItem", params)
+        hash_value, range_value = self._keyOf(params["Key"], "UpdateItem")
+        actions = Parser(params.get("UpdateExpression"), params.get("ExpressionAttributeNames"),
+                         params.get("ExpressionAttributeValues")).update()
+        for action, path, node in actions:
+            if path[1][0] in (self.hash_key, self.range_key):
+                raise validationError("One or more parameter values were invalid: Cannot update attribute %s. This attribute is part of the key" % path[1][0])
+        with self.lock:
+            old = self._get(hash_value, range_value)
+            self._check(old, params, "UpdateItem")
+            new = copy.deepcopy(old) if old is not None else {self.hash_key: hash_value, self.range_key: range_value}
+            applyUpdate(new, actions)
+            self._put(new)
+        returns = params.get("ReturnValues", "NONE")
+        touched = set(path[1][0] for action, path, node in actions)
+        result = {}
+        if returns == "ALL_NEW":
+            result["Attributes"] = copy.deepcopy(new)
+        elif returns == "ALL_OLD" and old is not None:
+            result["Attributes"] = copy.deepcopy(old)
+        elif returns == "UPDATED_NEW":
+            result["Attributes"] = {k: copy.deepcopy(v) for k, v in new.items() if k in touched}
+        elif returns == "UPDATED_OLD" and old is not None:
+            result["Attributes"] = {k: copy.deepcopy(v) for k, v in old.items() if k in touched}
+        return self._consumed(params, result, writeUnits(old, new))
+
+    # multi item operations -------------------------------------------------------
+    def _candidates(self, index, key_node):
+        if index is None:
+            hash_value = self._hashValueOf(key_node, self.hash_key)
+            partition = self.partitions.get(hash_value, {}) if hash_value is not None else {}
+            return [partition[r] for r in sorted(partition)], (lambda item: (item[self.range_key],))
+        if index not in self.indexes:
+            raise validationError("The table does not have the specified index: %s" % index)
+        index_hash, index_range = self.indexes[index]
+        hash_value = self._hashValueOf(key_node, index_hash)
+        items = list(self.index_data[index].get(hash_value, {}).values()) if hash_value is not None else []
+        def order(item):
+            prefix = (item[index_range],) if index_range else ()
+            return prefix + (item[self.hash_key], item[self.range_key])
+        return sorted(items, key=order), order
+
+    def _hashValueOf(self, node, attribute):
+        if node[0] == "and":
+            return self._hashValueOf(node[1], attribute) or self._hashValueOf(node[2], attribute)
+        if node[0] == "cmp" and node[1] == "=" and node[2][0] == "path" and node[2][1] == (attribute,):
+            return node[3][1]
+        return None
+
+    def _page(self, items, order, params, index, key_node):
+        if not params.get("ScanIndexForward", True):
+            items = list(reversed(items))
+        start = params.get("ExclusiveStartKey")
+        if start:
+            start = toStored(start)
+            marker = order(start)
+            forward = params.get("ScanIndexForward", True)
+            items = [item for item in items if (order(item) > marker if forward else order(item) < marker)]
+        filter_node = None
+        if params.get("FilterExpression"):
+            filter_node = Parser(params["FilterExpression"], params.get("ExpressionAttributeNames"),
+                                 params.get("ExpressionAttributeValues")).condition()
+        projection = self._projection(params)
+        limit = params.get("Limit")
+        if limit is not None and int(limit) <= 0:
+            raise validationError("1 validation error detected: Value at 'limit' failed to satisfy constraint: Member must have value greater than or equal to 1")
+        out, scanned, last = [], 0, None
+        for item in items:
+            if key_node is not None and not evalCondition(item, key_node):
+                continue
+            scanned += 1
+            if filter_node is None or evalCondition(item, filter_node):
+                out.append(project(item, projection))
+            if limit is not None and scanned >= int(limit):
+                last = item
+                break
+        result = {"Count": len(out), "ScannedCount": scanned}
+        if params.get("Select") == "COUNT":
+            result["Items"] = []
+        else:
+            result["Items"] = out
+        if last is not None:
+            # like the real service, hitting Limit always yields a LastEvaluatedKey
+            result["LastEvaluatedKey"] = self._keyDict(last, index)
+        return result
+
+    def query(self, **params):
+        self._call("Query", params)
+        if not params.get("KeyConditionExpression"):
+            raise validationError("Either the KeyConditions or KeyConditionExpression parameter must be specified in the request.")
+        key_node = Parser(params["KeyConditionExpression"], params.get("ExpressionAttributeNames"),
+                          params.get("ExpressionAttributeValues")).condition()
+        index = params.get("IndexName")
+        with self.lock:
+            items, order = self._candidates(index, key_node)
+            result = copy.deepcopy(self._page(items, order, params, index, key_node))
+        return self._consumed(params, result, readUnits(result["Items"], params.get("ConsistentRead")))
+
+    def scan(self, **params):
+        self._call("Scan", params)
+        with self.lock:
+            items = [partition[r] for h in sorted(self.partitions) for partition in [self.partitions[h]] for r in sorted(partition)]
+            order = lambda item: (item[self.hash_key], item[self.range_key])
+            segments = params.get("TotalSegments")
+            if segments:
+                segment = params.get("Segment", 0)
+                items = [item for item in items if zlib.crc32(item[self.hash_key].encode("utf-8")) % segments == segment]
+            result = copy.deepcopy(self._page(items, order, params, None, None))
+        return self._consumed(params, result, readUnits(result["Items"], params.get("ConsistentRead")))
+
+    def batch_write_item(self, RequestItems, **params):
+        self._call("BatchWriteItem", RequestItems)
+        requests = RequestItems.get(self.name, [])
+        if len(requests) > 25:
+            raise validationError("Too many items requested for the BatchWriteItem call")
+        seen = set()
+        for request in requests:
+            if "PutRequest" in request:
+                item = request["PutRequest"]["Item"]
+                key = self._keyOf({k: item.get(k) for k in (self.hash_key, self.range_key)}, "BatchWriteItem")
+            else:
+                key = self._keyOf(request["DeleteRequest"]["Key"], "BatchWriteItem")
+            if key in seen:
+                raise validationError("Provided list of item keys contains duplicates")
+            seen.add(key)
+        units = 0.0
+        with self.lock:
+            for request in requests:
+                if "PutRequest" in request:
+                    item = toStored(request["PutRequest"]["Item"])
+                    units += writeUnits(item)
+                    self._put(item)
+                else:
+                    units += 1.0
+                    self._delete(*self._keyOf(request["DeleteRequest"]["Key"], "BatchWriteItem"))
+        return self._consumed(dict(params, RequestItems=RequestItems), {"UnprocessedItems": {}}, units)
+
+    def batch_get_item(self, RequestItems, **params):
+        self._call("BatchGetItem", RequestItems)
+        spec = RequestItems.get(self.name, {"Keys": []})
+        if len(spec["Keys"]) > 100:
+            raise validationError("Too many items requested for the BatchGetItem call")
+        projection = self._projection(spec)
+        found = []
+        with self.lock:
+            for key in spec["Keys"]:
+                item = self._get(*self._keyOf(key, "BatchGetItem"))
+                if item is not None:
+                    found.append(project(item, projection))
+        units = sum(readUnits([item], spec.get("ConsistentRead")) for item in found)
+        return self._consumed(dict(params, RequestItems=RequestItems), {"Responses": {self.name: found}, "UnprocessedKeys": {}}, units)
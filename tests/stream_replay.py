@@ -0,0 +1,132 @@
+import copy
+import os
+import random
+import sys
+
+from boto3.dynamodb.types import TypeSerializer
+
+from tests.fake_table import FakeTable
+
+"""
+Local stand-in for a DynamoDB stream on the notes table.
+
+StreamingTable is a FakeTable that records every item it writes or removes as a
+synthetic stream record (INSERT / MODIFY / REMOVE, NEW_AND_OLD_IMAGES, DynamoDB JSON),
+so a stream consumer can be fed exactly what the handlers wrote:
+
+    table = StreamingTable(name=app.tablename)
+    app.setTable(table)
+    app.add_note_handler(event, None)
+    app.recent_view_stream_handler(table.drain(), None)
+
+drain() hands back the pending records as one Lambda event, optionally shuffled to
+mimic records of different shards arriving in any order.  Run as a script it replays a
+random mix of note writes through the recent view consumer and checks every user's
+first page against a plain Query:
+
+    python -m tests.stream_replay
+"""
+
+_serializer = TypeSerializer()
+
+
+def toStream(item):
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+def streamRecord(event_name, keys, new=None, old=None, sequence=0):
+    record = {
+        "eventID": str(sequence),
+        "eventName": event_name,
+        "eventSource": "aws:dynamodb",
+        "dynamodb": {
+            "Keys": toStream(keys),
+            "SequenceNumber": "%021d" % sequence,
+            "StreamViewType": "NEW_AND_OLD_IMAGES",
+        },
+    }
+    if new is not None:
+        record["dynamodb"]["NewImage"] = toStream(new)
+    if old is not None:
+        record["dynamodb"]["OldImage"] = toStream(old)
+    return record
+
+
+class StreamingTable(FakeTable):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records = []
+        self.sequence = 0
+
+    def _record(self, event_name, key, new, old):
+        self.sequence += 1
+        keys = {self.hash_key: key[0], self.range_key: key[1]}
+        self.records.append(streamRecord(event_name, keys, copy.deepcopy(new), copy.deepcopy(old), self.sequence))
+
+    def _put(self, item):
+        key = (item[self.hash_key], item[self.range_key])
+        old = self._get(*key)
+        super()._put(item)
+        self._record("MODIFY" if old is not None else "INSERT", key, item, old)
+
+    def _delete(self, hash_value, range_value):
+        old = super()._delete(hash_value, range_value)
+        if old is not None:
+            self._record("REMOVE", (hash_value, range_value), None, old)
+        return old
+
+    def drain(self, shuffle=False, seed=None):
+        records, self.records = self.records, []
+        if shuffle:
+            random.Random(seed).shuffle(records)
+        return {"Records": records}
+
+
+def replay(rounds=200, users=3, seed=1):
+    import json
+    import app
+    import instrumentation
+    import recent_view
+
+    instrumentation.emit = lambda line: None
+    if not recent_view.VIEW_SIZE:
+        recent_view.VIEW_SIZE = 10
+    rng = random.Random(seed)
+    table = StreamingTable(name=app.tablename)
+    app.setTable(table)
+    owners = ["user%d@example.com" % i for i in range(users)]
+    written = {owner: [] for owner in owners}
+    for i in range(rounds):
+        owner = rng.choice(owners)
+        headers = {"app_user_id": owner, "app_user_name": owner}
+        if written[owner] and rng.random() < 0.3:
+            timestamp = written[owner].pop(rng.randrange(len(written[owner])))
+            app.delete_note_handler({"headers": headers, "pathParameters": {"timestamp": str(timestamp)}}, None)
+        else:
+            item = {"title": "note %d" % i, "content": "x" * rng.choice((10, 2000, 20000)),
+                    "timestamp": 1700000000 + i}
+            table.put_item(Item=dict(item, user_id=owner, note_id="%s:%d" % (owner, i)))
+            written[owner].append(item["timestamp"])
+        if rng.random() < 0.5:
+            app.recent_view_stream_handler(table.drain(shuffle=True, seed=i), None)
+    app.recent_view_stream_handler(table.drain(), None)
+
+    mismatches = 0
+    for owner in owners:
+        event = {"headers": {"app_user_id": owner}, "queryStringParameters": {"limit": "5"}}
+        served = json.loads(app.get_notes_handler(event, None)["body"])
+        expected = table.query(KeyConditionExpression="user_id = :uid", ExpressionAttributeValues={":uid": owner},
+                               Limit=5, ScanIndexForward=False)["Items"]
+        if [n["timestamp"] for n in served["Items"]] != [int(n["timestamp"]) for n in expected]:
+            mismatches += 1
+            print("mismatch for %s" % owner)
+    views = len([item for item in table.allItems() if recent_view.isViewKey(item["user_id"])])
+    print("%d writes, %d views, %d mismatches" % (rounds, views, mismatches))
+    return mismatches
+
+
+if __name__ == "__main__":
+    # python -m tests.stream_replay, from the repository root
+    os.environ.setdefault("TABLE_NAME", "notes_table_replay")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+    sys.exit(1 if replay() else 0)
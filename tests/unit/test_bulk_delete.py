@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+import app
+import bulk_delete
+import change_feed
+import note_stats
+import search_index
+from tests.unit.test_handler import USER_ID, apigw_event, note_count, seed_notes
+
+
+def add_batch(count, title="Packing list"):
+    items = [{"title": title, "content": "passport tickets", "cat": "trip"} for i in range(count)]
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)
+    return json.loads(ret["body"])["Items"]
+
+
+def delete_notes(body):
+    ret = app.delete_notes_handler(apigw_event("DELETE", "/notes", body=body), None)
+    return ret["statusCode"], json.loads(ret["body"])
+
+
+def test_delete_by_timestamps(table):
+    notes = add_batch(5)
+    status, data = delete_notes({"timestamps": [notes[0]["timestamp"], notes[3]["timestamp"], 42]})
+
+    assert status == 200
+    assert data == {"deleted": 2, "failed": [], "more": False}
+    assert note_count(table) == 3
+
+
+def test_delete_by_range_cleans_up_after_the_notes(table):
+    notes = add_batch(30)
+    table.calls.clear()
+    status, data = delete_notes({"from": notes[0]["timestamp"]})
+
+    assert data["deleted"] == 30 and not data["more"]
+    assert note_count(table) == 0
+    # one DELETE per term and one counter update for the whole lot, not per note
+    assert len([op for op, _ in table.calls if op == "UpdateItem"]) == 4 + 1
+    assert [item for item in table.allItems() if search_index.isIndexKey(item["user_id"])] == []
+    stats = table.get_item(Key=note_stats.statsKey(USER_ID))["Item"]
+    assert note_stats.summary(stats) == {"notes": 0, "categories": {}}
+    tombstones = [item for item in table.allItems() if change_feed.isFeedKey(item["user_id"]) and item["op"] == "delete"]
+    assert len(tombstones) == 30
+
+
+def test_delete_by_note_ids_only_touches_own_notes(table):
+    notes = add_batch(3)
+    other = seed_notes(table, 1, user_id="someone.else@example.com")[0]
+    refs = [notes[0]["note_id"], "%s:%s" % (notes[1]["note_id"], notes[1]["timestamp"]), other["note_id"]]
+    status, data = delete_notes({"note_ids": refs})
+
+    assert data["deleted"] == 2
+    assert note_count(table) == 2
+
+
+def test_range_delete_continues_across_requests(table, monkeypatch):
+    monkeypatch.setattr(bulk_delete, "MAX_NOTES", 10)
+    seed_notes(table, 25)
+    results = []
+    more = True
+    while more:
+        status, data = delete_notes({"to": 1723331552 + 1000})
+        results.append(data["deleted"])
+        more = data["more"]
+    assert results == [10, 10, 5]
+    assert note_count(table) == 0
+
+
+@pytest.mark.parametrize("body", [
+    None, [], {}, {"timestamps": []}, {"timestamps": [1], "from": 1}, {"from": 5, "to": 1},
+    {"timestamps": ["soon"]}, {"note_ids": [1]}, {"timestamps": list(range(bulk_delete.MAX_REFS + 1))},
+])
+def test_bad_requests(table, body):
+    ret = app.delete_notes_handler(apigw_event("DELETE", "/notes", body=body), None)
+    assert ret["statusCode"] == 400
+
+
+def test_purge_removes_expired_notes(table):
+    seed_notes(table, 7)
+    seed_notes(table, 3, user_id="someone.else@example.com")
+    fresh = add_batch(2)
+
+    # seeded notes predate expires-index: only the scan finds them
+    assert app.purge_expired_handler({}, None) == {"purged": 0, "complete": True}
+    assert app.purge_expired_handler({"scan": True}, None) == {"purged": 10, "complete": True}
+    assert sorted(item["note_id"] for item in table.allItems() if "note_id" in item) == sorted(n["note_id"] for n in fresh)
+
+
+def test_purge_reads_the_expiry_index(table, monkeypatch):
+    stale = add_batch(3)
+    monkeypatch.setattr(app.time, "time", lambda: int(stale[0]["timestamp"]) + 181 * 86400)
+    fresh = add_batch(2)
+    table.calls.clear()
+
+    assert app.purge_expired_handler({}, None) == {"purged": 3, "complete": True}
+    assert sorted(item["note_id"] for item in table.allItems() if "note_id" in item) == sorted(n["note_id"] for n in fresh)
+    assert "Scan" not in [op for op, _ in table.calls]
+    assert all(params["IndexName"] == bulk_delete.EXPIRY_INDEX for op, params in table.calls if op == "Query" and "IndexName" in params)
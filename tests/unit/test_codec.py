@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import app
+import codec
+from tests.unit.test_handler import USER_ID, apigw_event
+
+BIG = "the quick brown fox jumps over the lazy dog. " * 200
+
+
+@pytest.fixture()
+def compressing(monkeypatch):
+    monkeypatch.setattr(codec, "COMPRESS_THRESHOLD", 1024)
+
+
+def stored_note(table, timestamp):
+    return table.get_item(Key={"user_id": USER_ID, "timestamp": timestamp})["Item"]
+
+
+def test_encode_decode_round_trip(compressing):
+    note = {"title": "t", "content": BIG}
+    stored = codec.encodeNote(note)
+    assert "content" not in stored
+    assert stored["content_codec"] == "zlib"
+    assert len(stored["content_z"]) < len(BIG) // 10
+    assert codec.decodeNote(dict(stored)) == note
+    # small and incompressible content stays a plain string
+    assert codec.encodeNote({"content": "short"}) == {"content": "short"}
+
+
+def test_handlers_store_compressed_and_read_plain(table, compressing):
+    ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "big", "content": BIG}}), None)
+    note = json.loads(ret["body"])
+    assert note["content"] == BIG
+    assert "content_z" in stored_note(table, note["timestamp"])
+
+    got = json.loads(app.get_note_handler(apigw_event("GET", "/note/n/{note_id}", path={"note_id": note["note_id"]}), None)["body"])
+    assert got["content"] == BIG and "content_z" not in got
+    page = json.loads(app.get_notes_handler(apigw_event("GET", "/notes", query={"fields": "content"}), None)["body"])
+    assert page["Items"][0]["content"] == BIG
+    found = json.loads(app.search_notes_handler(apigw_event("GET", "/notes/search", query={"q": "lazy fox"}), None)["body"])
+    assert found["Count"] == 1
+
+
+def test_update_switches_representation(table, compressing):
+    note = json.loads(app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "big", "content": BIG}}), None)["body"])
+    edit = {"timestamp": note["timestamp"], "note_id": note["note_id"], "content": "now short"}
+    app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": edit}), None)
+
+    stored = stored_note(table, note["timestamp"])
+    assert stored["content"] == "now short"
+    assert "content_z" not in stored and "content_codec" not in stored
+
+    edit["content"] = BIG
+    app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": edit}), None)
+    stored = stored_note(table, note["timestamp"])
+    assert "content" not in stored and "content_z" in stored
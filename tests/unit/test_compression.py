@@ -0,0 +1,71 @@
+import base64
+import gzip
+import json
+
+import app
+import compression
+from tests.unit.test_handler import USER_ID, USER_NAME, apigw_event, seed_notes
+
+
+def test_negotiate():
+    assert compression.negotiate(None) is None
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("gzip, deflate") == "gzip"
+    assert compression.negotiate("gzip;q=0, deflate") is None
+    assert compression.negotiate("*") == compression.supported()[0]
+    assert compression.negotiate("br;q=0.5, gzip;q=0.8") == "gzip"
+
+
+def test_large_listing_is_gzipped(table):
+    seed_notes(table, 40)
+    headers = {"app_user_id": USER_ID, "app_user_name": USER_NAME, "accept-encoding": "gzip"}
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"limit": "40"}, headers=headers), None)
+
+    assert ret["isBase64Encoded"] is True
+    assert ret["headers"]["Content-Encoding"] == "gzip"
+    assert ret["headers"]["Vary"] == "Accept-Encoding"
+    page = json.loads(gzip.decompress(base64.b64decode(ret["body"])))
+    assert page["Count"] == 40
+
+
+def test_small_or_unaccepted_responses_stay_plain(table):
+    seed_notes(table, 40)
+    headers = {"app_user_id": USER_ID, "app_user_name": USER_NAME, "Accept-Encoding": "gzip"}
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"limit": "1"}, headers=headers), None)
+    assert "isBase64Encoded" not in ret
+    assert "Content-Encoding" not in ret["headers"]
+    assert ret["headers"]["Vary"] == "Accept-Encoding"
+
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"limit": "40"}), None)
+    assert json.loads(ret["body"])["Count"] == 40
+
+
+def test_base64_request_body_is_decoded(table):
+    event = apigw_event("POST", "/note", body={"Item": {"title": "binary"}})
+    event["body"] = base64.b64encode(event["body"].encode("utf-8")).decode("ascii")
+    event["isBase64Encoded"] = True
+    assert app.add_note_handler(event, None)["statusCode"] == 200
+
+
+def test_compressed_body_gets_its_own_etag(table):
+    seed_notes(table, 40)
+    event = apigw_event("GET", "/notes", query={"limit": "40"})
+    plain = app.get_notes_handler(event, None)["headers"]["ETag"]
+    event["headers"]["accept-encoding"] = "gzip"
+    ret = app.get_notes_handler(event, None)
+    coded = ret["headers"]["ETag"]
+    assert coded != plain
+    assert coded == plain[:-1] + '-gzip"'
+
+    event["headers"]["if-none-match"] = coded
+    ret = app.get_notes_handler(event, None)
+    assert ret["statusCode"] == 304
+    assert ret["headers"]["ETag"] == coded
+    assert ret["headers"]["Vary"] == "Accept-Encoding"
+
+    del event["headers"]["accept-encoding"]
+    event["headers"]["if-none-match"] = plain
+    ret = app.get_notes_handler(event, None)
+    assert ret["statusCode"] == 304
+    assert ret["headers"]["ETag"] == plain
+    assert ret["headers"]["Vary"] == "Accept-Encoding"
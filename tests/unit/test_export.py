@@ -0,0 +1,58 @@
+import json
+
+import app
+import export
+from tests.unit.test_handler import USER_ID, seed_notes
+
+
+def read_ndjson(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_export_to_file(table, tmp_path):
+    notes = seed_notes(table, 25)
+    seed_notes(table, 3, user_id="someone.else@example.com")
+    path = str(tmp_path / "notes.ndjson")
+
+    state = export.exportNotes(app.table, USER_ID, export.FileSink(path), page_size=7, chunk_bytes=1000)
+
+    assert state["complete"] and state["notes"] == 25 and state["parts"] > 1
+    assert [n["note_id"] for n in read_ndjson(path)] == [n["note_id"] for n in notes]
+    # every page is a bounded Query on the user's partition
+    assert all(params["Limit"] == 7 for op, params in table.calls if op == "Query")
+
+
+def test_export_resumes_from_checkpoint(table, tmp_path):
+    notes = seed_notes(table, 20)
+    sink = export.DirectorySink(str(tmp_path / "dump"))
+    stops = iter([False, True])
+
+    state = export.exportNotes(app.table, USER_ID, sink, page_size=5, chunk_bytes=500, should_stop=lambda: next(stops))
+    assert not state["complete"] and state["parts"] == 2
+    assert sink.loadCheckpoint()["last_key"]["timestamp"] == notes[state["notes"] - 1]["timestamp"]
+
+    state = export.exportNotes(app.table, USER_ID, sink, page_size=5, chunk_bytes=500)
+    assert state["complete"] and state["notes"] == 20
+    exported = []
+    for part in range(state["parts"]):
+        exported.extend(read_ndjson(str(tmp_path / "dump" / ("part-%05d.ndjson" % part))))
+    assert [n["timestamp"] for n in exported] == [n["timestamp"] for n in notes]
+
+
+def test_file_sink_drops_a_cut_off_chunk(table, tmp_path):
+    seed_notes(table, 4)
+    path = str(tmp_path / "notes.ndjson")
+    sink = export.FileSink(path)
+    export.exportNotes(app.table, USER_ID, sink, chunk_bytes=300, should_stop=lambda: True)
+    with open(path, "ab") as f:
+        f.write(b'{"half a note')
+
+    state = export.exportNotes(app.table, USER_ID, sink, chunk_bytes=300)
+    assert [n["title"] for n in read_ndjson(path)] == ["Note 0", "Note 1", "Note 2", "Note 3"]
+    assert state["notes"] == 4
+
+
+def test_export_handler_requires_user_and_bucket(table, monkeypatch):
+    monkeypatch.delenv("EXPORT_BUCKET", raising=False)
+    assert app.export_notes_handler({"user_id": USER_ID}, None)["statusCode"] == 400
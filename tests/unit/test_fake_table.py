@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+import botocore.exceptions
+import pytest
+
+from tests.fake_table import FakeTable
+
+
+@pytest.fixture()
+def notes():
+    table = FakeTable()
+    for i in range(5):
+        table.put_item(Item={"user_id": "u", "timestamp": 100 + i, "note_id": "u:%d" % i, "title": "t%d" % i})
+    table.put_item(Item={"user_id": "v", "timestamp": 100, "note_id": "v:0", "title": "other"})
+    return table
+
+
+def test_query_orders_and_pages(notes):
+    params = {
+        "KeyConditionExpression": "user_id = :uid",
+        "ExpressionAttributeValues": {":uid": "u"},
+        "ScanIndexForward": False,
+        "Limit": 2,
+    }
+    first = notes.query(**params)
+    assert [i["timestamp"] for i in first["Items"]] == [Decimal(104), Decimal(103)]
+    second = notes.query(ExclusiveStartKey=first["LastEvaluatedKey"], **params)
+    assert [i["timestamp"] for i in second["Items"]] == [Decimal(102), Decimal(101)]
+
+
+def test_query_range_and_projection(notes):
+    data = notes.query(
+        KeyConditionExpression="user_id = :uid AND #t BETWEEN :a AND :b",
+        ExpressionAttributeNames={"#t": "timestamp"},
+        ExpressionAttributeValues={":uid": "u", ":a": 101, ":b": 102},
+        ProjectionExpression="note_id, #t",
+    )
+    assert data["Items"] == [{"note_id": "u:1", "timestamp": Decimal(101)}, {"note_id": "u:2", "timestamp": Decimal(102)}]
+
+
+def test_query_gsi(notes):
+    data = notes.query(IndexName="note_id-index", KeyConditionExpression="note_id = :n",
+                       ExpressionAttributeValues={":n": "v:0"}, Limit=1)
+    assert data["Items"][0]["title"] == "other"
+
+
+def test_condition_expression(notes):
+    with pytest.raises(botocore.exceptions.ClientError) as err:
+        notes.put_item(Item={"user_id": "u", "timestamp": 100}, ConditionExpression="attribute_not_exists(user_id)")
+    assert err.value.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+def test_update_expression(notes):
+    data = notes.update_item(
+        Key={"user_id": "u", "timestamp": 100},
+        UpdateExpression="SET title = :t, hits = if_not_exists(hits, :zero) + :one REMOVE note_id ADD tags :tags",
+        ExpressionAttributeValues={":t": "new", ":zero": 0, ":one": 1, ":tags": {"a"}},
+        ReturnValues="UPDATED_NEW",
+    )
+    assert data["Attributes"] == {"title": "new", "hits": Decimal(1), "tags": {"a"}}
+    item = notes.get_item(Key={"user_id": "u", "timestamp": 100})["Item"]
+    assert "note_id" not in item
+
+
+def test_key_schema_is_enforced(notes):
+    with pytest.raises(botocore.exceptions.ClientError) as err:
+        notes.delete_item(Key={"user_id": "u"})
+    assert err.value.response["Error"]["Message"] == "The provided key element does not match the schema"
@@ -2,71 +2,407 @@ import json
 
 import pytest
 
-from hello_world import app
+import app
+import change_feed
 
+USER_ID = "robert.fairchild@yahoo.com"
+USER_NAME = "Rob Fairchild"
 
-@pytest.fixture()
-def apigw_event():
-    """ Generates API GW Event"""
 
+def apigw_event(method, resource, body=None, query=None, path=None, headers=None):
+    """ Generates an API GW proxy event like the ones API Gateway sends the handlers """
+    if headers is None:
+        headers = {"app_user_id": USER_ID, "app_user_name": USER_NAME}
     return {
-        "body": '{ "test": "body"}',
-        "resource": "/{proxy+}",
-        "requestContext": {
-            "resourceId": "123456",
-            "apiId": "1234567890",
-            "resourcePath": "/{proxy+}",
-            "httpMethod": "POST",
-            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
-            "accountId": "123456789012",
-            "identity": {
-                "apiKey": "",
-                "userArn": "",
-                "cognitoAuthenticationType": "",
-                "caller": "",
-                "userAgent": "Custom User Agent String",
-                "user": "",
-                "cognitoIdentityPoolId": "",
-                "cognitoIdentityId": "",
-                "cognitoAuthenticationProvider": "",
-                "sourceIp": "127.0.0.1",
-                "accountId": "",
-            },
-            "stage": "prod",
-        },
-        "queryStringParameters": {"foo": "bar"},
-        "headers": {
-            "Via": "1.1 08f323deadbeefa7af34d5feb414ce27.cloudfront.net (CloudFront)",
-            "Accept-Language": "en-US,en;q=0.8",
-            "CloudFront-Is-Desktop-Viewer": "true",
-            "CloudFront-Is-SmartTV-Viewer": "false",
-            "CloudFront-Is-Mobile-Viewer": "false",
-            "X-Forwarded-For": "127.0.0.1, 127.0.0.2",
-            "CloudFront-Viewer-Country": "US",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Upgrade-Insecure-Requests": "1",
-            "X-Forwarded-Port": "443",
-            "Host": "1234567890.execute-api.us-east-1.amazonaws.com",
-            "X-Forwarded-Proto": "https",
-            "X-Amz-Cf-Id": "aaaaaaaaaae3VYQb9jd-nvCd-de396Uhbp027Y2JvkCPNLmGJHqlaA==",
-            "CloudFront-Is-Tablet-Viewer": "false",
-            "Cache-Control": "max-age=0",
-            "User-Agent": "Custom User Agent String",
-            "CloudFront-Forwarded-Proto": "https",
-            "Accept-Encoding": "gzip, deflate, sdch",
-        },
-        "pathParameters": {"proxy": "/examplepath"},
-        "httpMethod": "POST",
-        "stageVariables": {"baz": "qux"},
-        "path": "/examplepath",
+        "resource": resource,
+        "httpMethod": method,
+        "headers": headers,
+        "queryStringParameters": query,
+        "pathParameters": path,
+        "body": json.dumps(body) if body is not None else None,
     }
 
 
-def test_lambda_handler(apigw_event):
+def seed_notes(table, count, user_id=USER_ID, start=1723331552):
+    notes = []
+    for i in range(count):
+        note = {
+            "user_id": user_id,
+            "user_name": USER_NAME,
+            "note_id": "%s:note-%04d" % (user_id, i),
+            "timestamp": start + i,
+            "expires": start + i + 180 * 86400,
+            "title": "Note %d" % i,
+            "content": "Content of note %d" % i,
+            "cat": "general" if i % 2 else "work",
+        }
+        table.put_item(Item=note)
+        notes.append(note)
+    return notes
 
-    ret = app.lambda_handler(apigw_event, "")
+
+def note_count(table):
+    return len([item for item in table.allItems() if "note_id" in item])
+
+
+def test_add_note(table):
+    ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "My First Note", "content": "Hi", "cat": "general"}}), None)
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert data["note_id"].startswith(USER_ID + ":")
+    assert isinstance(data["timestamp"], int)
+    stored = table.get_item(Key={"user_id": USER_ID, "timestamp": data["timestamp"]})["Item"]
+    assert stored["title"] == "My First Note"
+    assert stored["user_name"] == USER_NAME
+
+
+def test_add_notes_batch(table):
+    items = [{"title": "queued %d" % i, "content": "x", "cat": "general"} for i in range(30)]
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)
     data = json.loads(ret["body"])
 
     assert ret["statusCode"] == 200
-    assert "message" in ret["body"]
-    assert data["message"] == "hello world"
+    assert data["failed"] == 0
+    assert [r["status"] for r in data["Items"]] == ["written"] * 30
+    timestamps = [r["timestamp"] for r in data["Items"]]
+    assert timestamps == sorted(set(timestamps))
+    assert note_count(table) == 30
+    # the newest note's timestamp, two batches of notes, then two batches of change feed entries
+    assert [op for op, params in table.calls if op != "UpdateItem"] == ["Query"] + ["BatchWriteItem"] * 4
+
+
+def test_add_notes_batch_never_overwrites(table):
+    add = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "single"}}), None)
+    assert add["statusCode"] == 200
+    for batch in range(2):
+        items = [{"title": "batch %d note %d" % (batch, i)} for i in range(10)]
+        ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)
+        assert json.loads(ret["body"])["failed"] == 0
+
+    assert note_count(table) == 21
+    stats = json.loads(app.get_note_stats_handler(apigw_event("GET", "/notes/stats"), None)["body"])
+    assert stats["notes"] == 21
+
+
+def test_add_note_after_batch_keeps_batch_notes(table):
+    items = [{"title": "batch note %d" % i} for i in range(50)]
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)
+    assert json.loads(ret["body"])["failed"] == 0
+    for i in range(3):
+        ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "single %d" % i}}), None)
+        assert ret["statusCode"] == 200
+
+    assert note_count(table) == 53
+    hits = json.loads(app.search_notes_handler(apigw_event("GET", "/notes/search", query={"q": "batch"}), None)["body"])
+    assert all(note["title"].startswith("batch") for note in hits["Items"])
+
+
+def test_add_notes_batch_reports_unprocessed(table, monkeypatch):
+    write = table.batch_write_item
+
+    def throttled(RequestItems, **params):
+        requests = RequestItems[table.name]
+        write(RequestItems={table.name: requests[:-1]})
+        return {"UnprocessedItems": {table.name: requests[-1:]}}
+
+    monkeypatch.setattr(table, "batch_write_item", throttled)
+    monkeypatch.setattr(app, "BATCH_WRITE_BACKOFF", 0)
+    items = [{"title": "queued %d" % i} for i in range(3)]
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 207
+    assert data["failed"] == 1
+    assert data["Items"][-1]["status"] == "failed"
+
+
+def test_add_notes_batch_rejects_empty(table):
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": []}), None)
+    assert ret["statusCode"] == 400
+
+
+def test_delete_note(table):
+    note = seed_notes(table, 1)[0]
+    ret = app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path={"timestamp": str(note["timestamp"])}), None)
+
+    assert ret["statusCode"] == 200
+    assert note_count(table) == 0
+
+
+def test_get_note(table):
+    note = seed_notes(table, 3)[1]
+    event = apigw_event("GET", "/note/n/{note_id}", path={"note_id": note["note_id"]})
+    ret = app.get_note_handler(event, None)
+
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["title"] == note["title"]
+
+
+def test_get_note_missing(table):
+    ret = app.get_note_handler(apigw_event("GET", "/note/n/{note_id}", path={"note_id": USER_ID + ":nope"}), None)
+    assert ret["statusCode"] == 204
+
+
+def test_get_note_cache_is_invalidated_by_delete(table):
+    if app.notecache is None:
+        pytest.skip("note cache disabled")
+    note = seed_notes(table, 1)[0]
+    event = apigw_event("GET", "/note/n/{note_id}", path={"note_id": note["note_id"]})
+    app.get_note_handler(event, None)
+    app.get_note_handler(event, None)
+    assert [op for op, params in table.calls].count("Query") == 1
+
+    app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path={"timestamp": str(note["timestamp"])}), None)
+    assert app.get_note_handler(event, None)["statusCode"] == 204
+
+
+def test_get_note_etag_and_304(table):
+    ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "tagged"}}), None)
+    note = json.loads(ret["body"])
+    event = apigw_event("GET", "/note/n/{note_id}", path={"note_id": note["note_id"]})
+    first = app.get_note_handler(event, None)
+    tag = first["headers"]["ETag"]
+
+    event["headers"]["if-none-match"] = tag
+    ret = app.get_note_handler(event, None)
+    assert ret["statusCode"] == 304
+    assert "body" not in ret
+
+    edit = {"timestamp": note["timestamp"], "note_id": note["note_id"], "cat": "work"}
+    ret = app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": edit}), None)
+    assert json.loads(ret["body"])["version"] == 2
+    ret = app.get_note_handler(event, None)
+    assert ret["statusCode"] == 200
+    assert ret["headers"]["ETag"] != tag
+
+
+def test_get_notes_page_etag(table):
+    seed_notes(table, 4)
+    event = apigw_event("GET", "/notes", query={"limit": "2"})
+    tag = app.get_notes_handler(event, None)["headers"]["ETag"]
+
+    event["headers"]["If-None-Match"] = 'W/"stale", ' + tag
+    assert app.get_notes_handler(event, None)["statusCode"] == 304
+    event["queryStringParameters"]["view"] = "summary"
+    assert app.get_notes_handler(event, None)["statusCode"] == 200
+
+
+def test_get_notes_pages_with_cursor(table):
+    seed_notes(table, 12)
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        query = {"limit": "5"}
+        if cursor:
+            query["cursor"] = cursor
+        ret = app.get_notes_handler(apigw_event("GET", "/notes", query=query), None)
+        assert ret["statusCode"] == 200
+        page = json.loads(ret["body"])
+        seen.extend(note["timestamp"] for note in page["Items"])
+        pages += 1
+        cursor = page["next"]
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert seen == sorted(seen, reverse=True)
+    assert len(seen) == 12
+
+
+def test_get_notes_rejects_foreign_cursor(table):
+    seed_notes(table, 6)
+    page = json.loads(app.get_notes_handler(apigw_event("GET", "/notes", query={"limit": "2"}), None)["body"])
+    headers = {"app_user_id": "someone.else@example.com", "app_user_name": "Else"}
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"cursor": page["next"]}, headers=headers), None)
+    assert ret["statusCode"] == 400
+
+
+def test_get_notes_rejects_bad_start(table):
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"start": "abc"}), None)
+    assert ret["statusCode"] == 400
+    assert table.calls == []
+
+
+def test_get_notes_caps_limit(table):
+    seed_notes(table, 3)
+    app.get_notes_handler(apigw_event("GET", "/notes", query={"limit": "100000"}), None)
+    assert table.calls[-1][1]["Limit"] == app.NOTES_PAGE_MAX
+
+
+def test_get_notes_summary_view_projects_fields(table):
+    seed_notes(table, 3)
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"view": "summary"}), None)
+    items = json.loads(ret["body"])["Items"]
+
+    assert ret["statusCode"] == 200
+    assert set(items[0]) == {"user_id", "timestamp", "note_id", "title", "cat"}
+    assert "#p1" in table.calls[-1][1]["ExpressionAttributeNames"]
+
+
+def test_get_notes_fields_rejects_bad_names(table):
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"fields": "title,content)"}), None)
+    assert ret["statusCode"] == 400
+    ret = app.get_notes_handler(apigw_event("GET", "/notes", query={"view": "everything"}), None)
+    assert ret["statusCode"] == 400
+
+
+def test_get_notes_time_range(table):
+    notes = seed_notes(table, 10)
+    query = {"from": str(notes[2]["timestamp"]), "to": str(notes[5]["timestamp"]), "limit": "100"}
+    data = json.loads(app.get_notes_handler(apigw_event("GET", "/notes", query=query), None)["body"])
+
+    assert [n["timestamp"] for n in data["Items"]] == [n["timestamp"] for n in reversed(notes[2:6])]
+    assert "BETWEEN" in table.calls[-1][1]["KeyConditionExpression"]
+
+    query = {"from": str(notes[8]["timestamp"])}
+    data = json.loads(app.get_notes_handler(apigw_event("GET", "/notes", query=query), None)["body"])
+    assert data["Count"] == 2
+    assert app.get_notes_handler(apigw_event("GET", "/notes", query={"from": "9", "to": "1"}), None)["statusCode"] == 400
+
+
+def sync(since):
+    ret = app.get_note_changes_handler(apigw_event("GET", "/notes/changes", query={"since": str(since)}), None)
+    return ret["statusCode"], json.loads(ret["body"])
+
+
+def test_note_changes_sync(table, monkeypatch):
+    monkeypatch.setattr(change_feed, "SAFETY_LAG", 0)
+    status, data = sync(0)
+    assert status == 410
+    watermark = data["watermark"]
+
+    items = [{"title": title} for title in ("one", "two", "three")]
+    added = json.loads(app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)["body"])["Items"]
+    status, data = sync(watermark)
+    assert status == 200
+    assert sorted(n["title"] for n in data["Items"]) == ["one", "three", "two"]
+    assert data["deleted"] == []
+    watermark = data["watermark"]
+
+    status, data = sync(watermark)
+    assert data["Items"] == [] and data["deleted"] == [] and data["watermark"] == watermark
+
+    edit = {"timestamp": added[0]["timestamp"], "note_id": added[0]["note_id"], "cat": "work"}
+    app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": edit}), None)
+    app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path={"timestamp": str(added[1]["timestamp"])}), None)
+    status, data = sync(watermark)
+    assert [n["cat"] for n in data["Items"]] == ["work"]
+    assert data["deleted"] == [{"note_id": added[1]["note_id"], "timestamp": added[1]["timestamp"]}]
+    # the feed lives in its own partition, so listings don't see it
+    assert json.loads(app.get_notes_handler(apigw_event("GET", "/notes"), None)["body"])["Count"] == 2
+
+
+def test_note_changes_hold_back_unsettled_changes(table, monkeypatch):
+    monkeypatch.setattr(change_feed, "SAFETY_LAG", 0)
+    watermark = sync(0)[1]["watermark"]
+    monkeypatch.setattr(change_feed, "SAFETY_LAG", 60 * 1000000)
+    app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "just now"}}), None)
+
+    status, data = sync(watermark)
+    assert status == 200
+    assert data["Items"] == [] and data["watermark"] == watermark
+
+    monkeypatch.setattr(change_feed, "SAFETY_LAG", 0)
+    assert [n["title"] for n in sync(watermark)[1]["Items"]] == ["just now"]
+
+
+def test_get_notes_by_id_uses_batch_get_when_key_is_known(table):
+    notes = seed_notes(table, 4)
+    ids = ",".join("%s:%d" % (n["note_id"], n["timestamp"]) for n in notes[:3])
+    ret = app.get_notes_by_id_handler(apigw_event("GET", "/notes/by-id", query={"ids": ids}), None)
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert [n["note_id"] for n in data["Items"]] == [n["note_id"] for n in notes[:3]]
+    assert [op for op, params in table.calls if op != "PutItem"] == ["BatchGetItem"]
+
+
+def test_get_notes_by_id_falls_back_to_gsi(table):
+    notes = seed_notes(table, 2)
+    ids = notes[0]["note_id"] + "," + USER_ID + ":missing"
+    data = json.loads(app.get_notes_by_id_handler(apigw_event("GET", "/notes/by-id", query={"ids": ids}), None)["body"])
+
+    assert [n["note_id"] for n in data["Items"]] == [notes[0]["note_id"]]
+    assert data["missing"] == [USER_ID + ":missing"]
+
+
+def test_update_note(table):
+    note = seed_notes(table, 1)[0]
+    item = {"timestamp": note["timestamp"], "note_id": note["note_id"], "title": "Renamed", "content": "New", "cat": "general"}
+    ret = app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": item}), None)
+
+    assert ret["statusCode"] == 200
+    stored = table.get_item(Key={"user_id": USER_ID, "timestamp": note["timestamp"]})["Item"]
+    assert stored["title"] == "Renamed"
+
+
+def test_update_note_writes_only_supplied_fields(table):
+    note = seed_notes(table, 1)[0]
+    item = {"timestamp": note["timestamp"], "note_id": note["note_id"], "cat": "personal", "title": None}
+    ret = app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": item}), None)
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert data["cat"] == "personal"
+    assert "content" not in data
+    writes = [(op, params) for op, params in table.calls if params.get("Key", {}).get("user_id") == USER_ID]
+    assert [op for op, params in writes] == ["UpdateItem"]
+    assert writes[0][1]["ReturnValues"] == "ALL_OLD"
+    stored = table.get_item(Key={"user_id": USER_ID, "timestamp": note["timestamp"]})["Item"]
+    assert stored["cat"] == "personal"
+    assert "title" not in stored
+    assert stored["content"] == note["content"]
+    assert stored["expires"] != note["expires"]
+
+
+def test_update_note_checks_note_id(table):
+    note = seed_notes(table, 1)[0]
+    item = {"timestamp": note["timestamp"], "note_id": USER_ID + ":bogus", "title": "hijacked"}
+    ret = app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": item}), None)
+
+    assert ret["statusCode"] != 200
+    assert table.get_item(Key={"user_id": USER_ID, "timestamp": note["timestamp"]})["Item"]["title"] == note["title"]
+    assert not [i for i in table.allItems() if change_feed.isFeedKey(i["user_id"])]
+
+
+def test_update_note_missing_note(table):
+    item = {"timestamp": 1, "note_id": USER_ID + ":nope", "title": "ghost"}
+    ret = app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": item}), None)
+
+    assert ret["statusCode"] != 200
+    assert note_count(table) == 0
+
+
+def test_router_dispatches_and_rejects(table):
+    seed_notes(table, 2)
+    ret = app.router_handler(apigw_event("GET", "/notes"), None)
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["Count"] == 2
+
+    assert app.router_handler(apigw_event("PUT", "/note"), None)["statusCode"] == 405
+    assert app.router_handler(apigw_event("GET", "/nowhere"), None)["statusCode"] == 404
+
+
+# looked up by note_id alone, no user headers needed
+ANONYMOUS_ROUTES = {("GET", "/note/n/{note_id}"), ("GET", "/notes/by-id")}
+
+
+@pytest.mark.parametrize("route", sorted(app.ROUTES))
+@pytest.mark.parametrize("headers", ["absent", None])
+def test_every_route_needs_the_user_headers(table, route, headers):
+    method, resource = route
+    event = apigw_event(method, resource, body={"Item": {"title": "x"}}, query={"q": "words", "since": "0", "ids": "n"},
+                        path={"timestamp": "1", "note_id": "n"})
+    if headers == "absent":
+        del event["headers"]
+    else:
+        event["headers"] = headers
+    ret = app.ROUTES[route](event, None)
+
+    if route in ANONYMOUS_ROUTES:
+        assert ret["statusCode"] < 400
+    else:
+        assert ret["statusCode"] == 400
+        assert "headers" in json.loads(ret["body"])["error"]
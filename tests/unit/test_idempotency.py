@@ -0,0 +1,109 @@
+import json
+import time
+
+import pytest
+
+import app
+import idempotency
+from tests.fake_table import clientError
+from tests.unit.test_handler import USER_ID, USER_NAME, apigw_event, note_count
+
+NOTE = {"Item": {"title": "Retry me", "content": "once only", "cat": "general"}}
+
+
+def keyed_event(key, body=NOTE):
+    return apigw_event("POST", "/note", body=body,
+                       headers={"app_user_id": USER_ID, "app_user_name": USER_NAME, "Idempotency-Key": key})
+
+
+@pytest.fixture()
+def idemcache(monkeypatch):
+    cache = app.cache.TTLCache(16, 60)
+    monkeypatch.setattr(app, "idemcache", cache)
+    return cache
+
+
+def test_retry_replays_the_first_response(table, idemcache):
+    first = app.add_note_handler(keyed_event("abc-123"), None)
+    idemcache.clear()
+    second = app.add_note_handler(keyed_event("abc-123"), None)
+
+    assert first["statusCode"] == second["statusCode"] == 200
+    assert json.loads(second["body"])["note_id"] == json.loads(first["body"])["note_id"]
+    assert second["headers"]["Idempotent-Replayed"] == "true"
+    assert note_count(table) == 1
+
+
+def test_cached_key_skips_the_table(table, idemcache):
+    first = app.add_note_handler(keyed_event("abc-123"), None)
+    calls = len(table.calls)
+    second = app.add_note_handler(keyed_event("abc-123"), None)
+
+    assert second["body"] == first["body"]
+    assert len(table.calls) == calls
+
+
+def test_key_reused_for_another_body(table, idemcache):
+    app.add_note_handler(keyed_event("abc-123"), None)
+    ret = app.add_note_handler(keyed_event("abc-123", {"Item": {"title": "Something else"}}), None)
+    assert ret["statusCode"] == 422
+    assert note_count(table) == 1
+
+
+def test_pending_claim_is_a_conflict(table, idemcache):
+    event = keyed_event("abc-123")
+    table.put_item(**idempotency.claimParams(USER_ID, "abc-123", idempotency.requestHash(event["body"])))
+    ret = app.add_note_handler(event, None)
+    assert ret["statusCode"] == 409
+    assert ret["headers"]["Retry-After"] == "1"
+    assert note_count(table) == 0
+
+
+def test_expired_claim_can_be_taken_again(table, idemcache):
+    event = keyed_event("abc-123")
+    stale = idempotency.claimParams(USER_ID, "abc-123", "old", now=1000)
+    table.put_item(**stale)
+    ret = app.add_note_handler(event, None)
+    assert ret["statusCode"] == 200
+    record = table.get_item(Key=idempotency.recordKey(USER_ID, "abc-123"))["Item"]
+    assert record["state"] == "done" and record["expires"] > 1000 + idempotency.TTL_SECONDS
+
+
+def test_invalid_key(table, idemcache):
+    ret = app.add_note_handler(keyed_event("x" * (idempotency.MAX_KEY_LENGTH + 1)), None)
+    assert ret["statusCode"] == 400
+    assert note_count(table) == 0
+
+
+def test_lapsed_pending_lease_can_be_taken_again(table, idemcache):
+    event = keyed_event("abc-123")
+    now = int(time.time())
+    # an attempt that crashed between the claim and completing it
+    table.put_item(**idempotency.claimParams(USER_ID, "abc-123", idempotency.requestHash(event["body"]),
+                                             now=now - idempotency.LEASE_SECONDS - 1))
+    ret = app.add_note_handler(event, None)
+
+    assert ret["statusCode"] == 200
+    record = table.get_item(Key=idempotency.recordKey(USER_ID, "abc-123"))["Item"]
+    assert record["state"] == "done" and record["expires"] >= now + idempotency.TTL_SECONDS
+
+
+def test_pending_claim_only_holds_a_lease(table, idemcache):
+    now = int(time.time())
+    item = idempotency.claimParams(USER_ID, "abc-123", "hash", now=now)["Item"]
+    assert item["expires"] == now + idempotency.LEASE_SECONDS < now + idempotency.TTL_SECONDS
+
+
+def test_failed_completion_still_answers_200(table, idemcache, monkeypatch):
+    update = table.update_item
+
+    def throttled(**params):
+        if params["Key"]["user_id"].startswith(idempotency.IDEM_PREFIX):
+            raise clientError("ProvisionedThroughputExceededException", "slow down")
+        return update(**params)
+    monkeypatch.setattr(table, "update_item", throttled)
+    monkeypatch.setattr(app.throttle, "MAX_RETRIES", 0)
+    ret = app.add_note_handler(keyed_event("abc-123"), None)
+
+    assert ret["statusCode"] == 200
+    assert note_count(table) == 1
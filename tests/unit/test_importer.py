@@ -0,0 +1,137 @@
+import io
+import json
+
+import app
+import importer
+import search_index
+import validation
+from tests.fake_table import clientError
+from tests.unit.test_handler import USER_ID, note_count
+
+
+def ndjson(records):
+    return io.StringIO("".join(json.dumps(r) + "\n" for r in records))
+
+
+def legacy(count, start=1600000000):
+    return [{"id": "legacy-%d" % i, "user_id": USER_ID, "title": "Legacy %d" % i, "content": "imported words",
+             "timestamp": start + i} for i in range(count)]
+
+
+def test_import_ndjson_is_idempotent(table, tmp_path):
+    state = importer.importRecords(importer.readNdjson(ndjson(legacy(60))), workers=3)
+    assert state["written"] == 60 and state["failed"] == 0
+    assert note_count(table) == 60
+
+    # loading the same source again rewrites the same items
+    importer.importRecords(importer.readNdjson(ndjson(legacy(60))), workers=3)
+    assert note_count(table) == 60
+    stored = table.get_item(Key={"user_id": USER_ID, "timestamp": 1600000000})["Item"]
+    assert stored["note_id"] == importer.normalizeRecord(legacy(1)[0], 0, 0)["note_id"]
+    assert stored["expires"] > 1600000000 + 180 * 86400
+    posting = table.get_item(Key=search_index.postingKey(USER_ID, "imported"))["Item"]
+    assert len(posting["notes"]) == 60
+
+
+def test_import_csv_and_bad_records(table):
+    source = io.StringIO("id,title,content,timestamp\n1,first,a,1600000000\n2,second,b,not-a-time\n3,third,c,\n")
+    state = importer.importRecords(importer.readCsv(source), user_id=USER_ID, user_name="Importer")
+
+    assert state["written"] == 2
+    assert state["failed"] == 1 and state["errors"][0]["record"] == 1
+    titles = sorted(item["title"] for item in table.allItems() if "note_id" in item)
+    assert titles == ["first", "third"]
+
+
+def test_import_resumes_from_checkpoint(table, tmp_path):
+    checkpoint = str(tmp_path / "import.ckpt")
+    importer.saveCheckpoint(checkpoint, {"offset": 50, "base": 1700000000, "written": 50, "failed": 0, "errors": [], "complete": False})
+
+    state = importer.importRecords(importer.readNdjson(ndjson(legacy(80))), checkpoint=checkpoint)
+    assert state["written"] == 80 and state["offset"] == 80 and state["complete"]
+    assert note_count(table) == 30
+    assert json.load(open(checkpoint))["complete"] is True
+
+
+def test_import_backs_off_on_throttling(table, monkeypatch):
+    write = table.batch_write_item
+    throttled = []
+
+    def flaky(RequestItems, **params):
+        requests = RequestItems[table.name]
+        if len(throttled) < 2:
+            throttled.append(len(requests))
+            write(RequestItems={table.name: requests[:5]})
+            return {"UnprocessedItems": {table.name: requests[5:]}}
+        return write(RequestItems=RequestItems, **params)
+
+    monkeypatch.setattr(table, "batch_write_item", flaky)
+    backoff = importer.AdaptiveBackoff(initial=0.001)
+    monkeypatch.setattr(importer, "AdaptiveBackoff", lambda: backoff)
+    state = importer.importRecords(importer.readNdjson(ndjson(legacy(25))), workers=1, index=False)
+
+    assert state["written"] == 25
+    assert throttled == [25, 20]
+    assert note_count(table) == 25
+
+
+def test_import_failed_chunk_is_not_complete(table, monkeypatch, tmp_path):
+    write = importer.writeChunk
+
+    def failing(notes, backoff, index=True):
+        if notes[0]["title"] == "Legacy 25":
+            raise clientError("ValidationException", "Item size has exceeded the maximum allowed size")
+        return write(notes, backoff, index)
+
+    monkeypatch.setattr(importer, "writeChunk", failing)
+    checkpoint = str(tmp_path / "import.ckpt")
+    state = importer.importRecords(importer.readNdjson(ndjson(legacy(100))), checkpoint=checkpoint, workers=1)
+
+    assert state["written"] == 75 and state["failed"] == 25
+    assert state["offset"] == 25 and not state["complete"]
+    assert json.load(open(checkpoint))["complete"] is False
+
+
+def test_import_rejects_oversized_records(table):
+    records = legacy(3)
+    records[1]["content"] = "".join(chr(0x4e00 + (i * 7919) % 20000) for i in range(validation.ITEM_MAX_BYTES))
+    state = importer.importRecords(importer.readNdjson(ndjson(records)))
+
+    assert state["written"] == 2 and state["failed"] == 1 and state["complete"]
+    assert "item limit" in state["errors"][0]["error"]
+
+
+def test_import_rerun_after_failed_chunk_counts_once(table, monkeypatch, tmp_path):
+    write = importer.writeChunk
+
+    def failing(notes, backoff, index=True):
+        if notes[0]["title"] == "Legacy 25":
+            raise clientError("ProvisionedThroughputExceededException", "Rate exceeded")
+        return write(notes, backoff, index)
+
+    monkeypatch.setattr(importer, "writeChunk", failing)
+    checkpoint = str(tmp_path / "import.ckpt")
+    importer.importRecords(importer.readNdjson(ndjson(legacy(100))), checkpoint=checkpoint, workers=1)
+    monkeypatch.setattr(importer, "writeChunk", write)
+    state = importer.importRecords(importer.readNdjson(ndjson(legacy(100))), checkpoint=checkpoint, workers=1)
+
+    assert state["written"] == 100 and state["failed"] == 0 and state["complete"]
+    assert note_count(table) == 100
+    assert json.load(open(checkpoint))["written"] == 100
+
+
+def test_import_same_second_records_across_chunks(table, tmp_path):
+    records = legacy(30)
+    records[29]["timestamp"] = records[0]["timestamp"]
+    checkpoint = str(tmp_path / "import.ckpt")
+    state = importer.importRecords(importer.readNdjson(ndjson(records)), checkpoint=checkpoint, workers=2)
+
+    assert state["written"] == 30
+    assert note_count(table) == 30
+    titles = set(item["title"] for item in table.allItems() if "note_id" in item)
+    assert "Legacy 0" in titles and "Legacy 29" in titles
+
+    # a resume past the clash moves the record to the same place again
+    importer.saveCheckpoint(checkpoint, dict(json.load(open(checkpoint)), offset=25, complete=False))
+    importer.importRecords(importer.readNdjson(ndjson(records)), checkpoint=checkpoint)
+    assert note_count(table) == 30
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import app
+import instrumentation
+from tests.unit.test_handler import apigw_event, seed_notes
+
+
+@pytest.fixture()
+def records(monkeypatch):
+    lines = []
+    monkeypatch.setattr(instrumentation, "emit", lines.append)
+    monkeypatch.setattr(instrumentation, "LEVEL", "detailed")
+    monkeypatch.setattr(instrumentation, "FORMAT", "json")
+    return lines
+
+
+def test_handler_emits_phases_and_capacity(table, records):
+    seed_notes(table, 3)
+    ret = app.get_notes_handler(apigw_event("GET", "/notes"), None)
+
+    assert ret["statusCode"] == 200
+    record = json.loads(records[-1])
+    assert record["handler"] == "get_notes"
+    assert record["status"] == 200
+    assert record["TableCalls"] == 1
+    assert record["ConsumedCapacity"] == 0.5
+    assert record["dynamodbTime"] > 0
+    assert "serializeTime" in record and "otherTime" in record
+    assert table.calls[-1][1]["ReturnConsumedCapacity"] == "TOTAL"
+
+
+def test_router_records_the_routed_handler_once(table, records):
+    app.router_handler(apigw_event("POST", "/note", body={"Item": {"title": "counted words here"}}), None)
+
+    assert len(records) == 1
+    record = json.loads(records[0])
+    assert record["handler"] == "add_note"
+    assert "parseTime" in record and "validateTime" in record
+    # the note, its search postings (written from worker threads), its change feed entry
+    # and the note counters
+    assert record["TableCalls"] == 1 + 3 + 1 + 1
+
+
+def test_emf_format(table, records, monkeypatch):
+    monkeypatch.setattr(instrumentation, "FORMAT", "emf")
+    app.get_note_handler(apigw_event("GET", "/note/n/{note_id}", path={"note_id": "nobody:1"}), None)
+
+    document = json.loads(records[-1])
+    metrics = document["_aws"]["CloudWatchMetrics"][0]
+    assert metrics["Dimensions"] == [["handler"]]
+    assert {"Name": "Duration", "Unit": "Milliseconds"} in metrics["Metrics"]
+    assert document["handler"] == "get_note" and "Duration" in document
+
+
+def test_sampling_and_off(table, records, monkeypatch):
+    monkeypatch.setattr(instrumentation, "SAMPLE_RATE", 0.0)
+    app.get_notes_handler(apigw_event("GET", "/notes"), None)
+    monkeypatch.setattr(instrumentation, "SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(instrumentation, "LEVEL", "off")
+    app.get_notes_handler(apigw_event("GET", "/notes"), None)
+
+    assert records == []
+    assert all("ReturnConsumedCapacity" not in params for op, params in table.calls)
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import app
+import note_stats
+from tests.unit.test_throttle import Context
+from tests.unit.test_handler import USER_ID, apigw_event, seed_notes
+
+
+def stats():
+    ret = app.get_note_stats_handler(apigw_event("GET", "/notes/stats"), None)
+    assert ret["statusCode"] == 200
+    return json.loads(ret["body"])
+
+
+def add(title, cat=None):
+    item = {"title": title}
+    if cat:
+        item["cat"] = cat
+    return json.loads(app.add_note_handler(apigw_event("POST", "/note", body={"Item": item}), None)["body"])
+
+
+def test_counters_follow_every_write(table):
+    assert stats() == {"notes": 0, "categories": {}}
+
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": [
+        {"title": "one", "cat": "work"}, {"title": "two", "cat": "work"}, {"title": "three", "cat": "home"}]}), None)
+    note = json.loads(ret["body"])["Items"][0]
+    assert stats() == {"notes": 3, "categories": {"work": 2, "home": 1}}
+
+    change = {"timestamp": note["timestamp"], "note_id": note["note_id"], "cat": "home"}
+    app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": change}), None)
+    assert stats() == {"notes": 3, "categories": {"work": 1, "home": 2}}
+
+    app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path={"timestamp": str(note["timestamp"])}), None)
+    assert stats() == {"notes": 2, "categories": {"work": 1, "home": 1}}
+
+
+def test_stats_is_one_read(table):
+    add("one", "work")
+    table.calls.clear()
+    stats()
+    assert [op for op, _ in table.calls] == ["GetItem"]
+
+
+def test_reconcile_recounts_drifted_users(table):
+    seed_notes(table, 5)
+    seed_notes(table, 2, user_id="someone.else@example.com")
+    add("counted", "work")
+
+    result = app.reconcile_stats_handler({}, None)
+    assert result == {"users": 2, "fixed": 2, "complete": True}
+    assert stats() == {"notes": 6, "categories": {"work": 4, "general": 2}}
+    assert app.reconcile_stats_handler({}, None)["fixed"] == 0
+
+
+def test_reconcile_one_user(table):
+    seed_notes(table, 3)
+    assert app.reconcile_stats_handler({"user_id": USER_ID}, None) == {"users": 1, "fixed": 1}
+    assert stats()["notes"] == 3
+
+
+def test_reconcile_never_overwrites_a_newer_add(table):
+    add("one", "work")
+    seen = table.get_item(Key=note_stats.statsKey(USER_ID))["Item"]
+    app.updateStats(USER_ID, note_stats.statsDelta(None, {"cat": "work"}))
+    with pytest.raises(Exception) as err:
+        table.put_item(**note_stats.reconcileParams(USER_ID, {"notes": 1, "cat:work": 1}, seen))
+    assert err.value.response["Error"]["Code"] == "ConditionalCheckFailedException"
+
+
+def test_reconcile_resumes_where_it_stopped(table, monkeypatch):
+    seed_notes(table, 5)
+    seed_notes(table, 2, user_id="someone.else@example.com")
+
+    # out of time before the scan: nothing done, every segment left to go
+    monkeypatch.setattr(app, "STATS_SCAN_MARGIN_MS", 100000)
+    result = app.reconcile_stats_handler({}, Context(50000))
+    assert result["complete"] is False and result["fixed"] == 0
+    assert not any(segment["done"] for segment in result["segments"])
+
+    # out of time after the scan: the drifted users are handed on
+    monkeypatch.setattr(app, "STATS_SCAN_MARGIN_MS", 0)
+    monkeypatch.setattr(app, "STATS_MARGIN_MS", 100000)
+    result = app.reconcile_stats_handler(json.loads(json.dumps(result)), Context(50000))
+    assert result["complete"] is False and sorted(result["pending"]) == sorted([USER_ID, "someone.else@example.com"])
+
+    result = app.reconcile_stats_handler(json.loads(json.dumps(result)), None)
+    assert result["complete"] is True and result["fixed"] == 2
+    assert stats()["notes"] == 5
+
+
+@pytest.mark.parametrize("event", [{"httpMethod": "GET"}, {"httpMethod": "GET", "headers": None}])
+def test_stats_without_headers(table, event):
+    ret = app.get_note_stats_handler(event, None)
+    assert ret["statusCode"] == 400
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import app
+import recent_view
+from tests.stream_replay import StreamingTable
+from tests.unit.test_handler import USER_ID, apigw_event, seed_notes
+
+
+@pytest.fixture()
+def stream(monkeypatch):
+    monkeypatch.setattr(recent_view, "VIEW_SIZE", 10)
+    previous = app.table
+    table = StreamingTable(name=app.tablename)
+    app.setTable(table)
+    yield table
+    app.setTable(previous)
+
+
+def first_page(query=None):
+    return app.get_notes_handler(apigw_event("GET", "/notes", query=query), None)
+
+
+def test_first_page_comes_from_the_view(stream):
+    seed_notes(stream, 8)
+    app.recent_view_stream_handler(stream.drain(shuffle=True, seed=3), None)
+    stream.calls.clear()
+
+    ret = first_page()
+    data = json.loads(ret["body"])
+    assert [op for op, _ in stream.calls] == ["GetItem"]
+    assert [n["title"] for n in data["Items"]] == ["Note 7", "Note 6", "Note 5", "Note 4", "Note 3"]
+
+    # same page, same cursor and ETag as the Query would give
+    stream.delete_item(Key=recent_view.viewKey(USER_ID))
+    queried = first_page()
+    assert queried["body"] == ret["body"]
+    assert queried["headers"]["ETag"] == ret["headers"]["ETag"]
+
+
+def test_view_follows_writes_and_deletes(stream):
+    seed_notes(stream, 3)
+    app.recent_view_stream_handler(stream.drain(), None)
+    ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "Newest"}}), None)
+    newest = json.loads(ret["body"])
+    app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path={"timestamp": "1723331553"}), None)
+    app.recent_view_stream_handler(stream.drain(), None)
+
+    view = stream.get_item(Key=recent_view.viewKey(USER_ID))["Item"]
+    assert [n["title"] for n in view["notes"]] == ["Newest", "Note 2", "Note 0"]
+    assert view["complete"]
+    assert json.loads(first_page()["body"])["Items"][0]["note_id"] == newest["note_id"]
+
+
+def test_pages_the_view_cannot_answer_use_the_query(stream):
+    seed_notes(stream, 12)
+    app.recent_view_stream_handler(stream.drain(), None)
+
+    for query in ({"limit": "20"}, {"from": "1723331552"}, {"cursor": json.loads(first_page()["body"])["next"]}):
+        stream.calls.clear()
+        assert first_page(query)["statusCode"] == 200
+        assert [op for op, _ in stream.calls] == ["Query"]
+
+
+def test_projection_from_the_view(stream):
+    seed_notes(stream, 2)
+    app.recent_view_stream_handler(stream.drain(), None)
+    data = json.loads(first_page({"view": "summary"})["body"])
+    assert set(data["Items"][0]) == {"user_id", "timestamp", "note_id", "title", "cat"}
+
+
+def test_view_is_capped_by_size(stream, monkeypatch):
+    monkeypatch.setattr(recent_view, "VIEW_MAX_BYTES", 300)
+    seed_notes(stream, 6)
+    app.recent_view_stream_handler(stream.drain(), None)
+    view = stream.get_item(Key=recent_view.viewKey(USER_ID))["Item"]
+    assert 0 < len(view["notes"]) < 5 and not view["complete"]
+    stream.calls.clear()
+    first_page()
+    assert [op for op, _ in stream.calls] == ["GetItem", "Query"]
+
+
+def test_derived_partitions_are_ignored(stream):
+    seed_notes(stream, 1)
+    app.recent_view_stream_handler(stream.drain(), None)
+    assert recent_view.streamUsers(stream.drain()["Records"]) == {}
@@ -0,0 +1,68 @@
+import json
+
+import app
+import change_feed
+import note_stats
+import search_index
+from tests.unit.test_handler import USER_ID, apigw_event
+
+
+def add_note(title, content):
+    ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": title, "content": content, "cat": "general"}}), None)
+    return json.loads(ret["body"])
+
+
+def search(q):
+    ret = app.search_notes_handler(apigw_event("GET", "/notes/search", query={"q": q}), None)
+    return ret["statusCode"], json.loads(ret["body"])
+
+
+def test_tokenize_normalizes_and_drops_stopwords():
+    assert search_index.tokenize("The Café, the CAFE and a crème-brûlée!") == ["cafe", "creme", "brulee"]
+
+
+def test_index_updates_diff_terms():
+    old = {"timestamp": 1, "title": "alpha beta", "content": ""}
+    new = {"timestamp": 1, "title": "beta gamma", "content": ""}
+    updates = search_index.indexUpdates("u", old, new)
+    assert [(u["Key"]["user_id"], u["UpdateExpression"]) for u in updates] == [
+        ("search#u#alpha", "DELETE notes :ts"),
+        ("search#u#gamma", "ADD notes :ts"),
+    ]
+
+
+def test_search_finds_notes_by_all_terms(table):
+    note = add_note("Grocery list", "milk eggs bread")
+    status, data = search("bread milk")
+
+    assert status == 200
+    assert [n["note_id"] for n in data["Items"]] == [note["note_id"]]
+    assert search("bread butter")[1]["Items"] == []
+    assert "Scan" not in [op for op, params in table.calls]
+
+
+def test_search_follows_updates_and_deletes(table):
+    note = add_note("Trip", "pack passport")
+    item = {"timestamp": note["timestamp"], "note_id": note["note_id"], "title": "Trip", "content": "pack tickets"}
+    app.update_note_handler(apigw_event("PATCH", "/note", body={"Item": item}), None)
+
+    assert search("passport")[1]["Items"] == []
+    assert len(search("tickets")[1]["Items"]) == 1
+
+    app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path={"timestamp": str(note["timestamp"])}), None)
+    assert search("tickets")[1]["Items"] == []
+    # emptied postings are cleaned up along with the note; only the change feed and the
+    # (now zero) counters are left
+    leftover = [item for item in table.allItems() if not change_feed.isFeedKey(item["user_id"])]
+    assert [item["user_id"] for item in leftover] == [note_stats.statsKey(USER_ID)["user_id"]]
+
+
+def test_index_items_stay_out_of_listings(table):
+    add_note("Hello", "world")
+    data = json.loads(app.get_notes_handler(apigw_event("GET", "/notes"), None)["body"])
+    assert data["Count"] == 1
+    assert data["Items"][0]["user_id"] == USER_ID
+
+
+def test_search_requires_words(table):
+    assert search("the a")[0] == 400
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import app
+import throttle
+from tests.fake_table import clientError
+from tests.unit.test_handler import apigw_event, note_count, seed_notes
+
+NOTE = {"Item": {"title": "Busy", "content": "table"}}
+
+
+class Context(object):
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture()
+def policy(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(throttle.time, "sleep", sleeps.append)
+    monkeypatch.setattr(throttle, "retries", throttle.TokenBucket(0, 10))
+    monkeypatch.setattr(throttle, "admission", None)
+    return sleeps
+
+
+def throttle_puts(table, monkeypatch, failures):
+    put = table.put_item
+    left = [failures]
+
+    def flaky(**params):
+        if left[0]:
+            left[0] -= 1
+            table.calls.append(("PutItem", params))
+            raise clientError("ProvisionedThroughputExceededException", "Rate exceeded")
+        return put(**params)
+    monkeypatch.setattr(table, "put_item", flaky)
+
+
+def test_throttled_call_is_retried(table, policy, monkeypatch):
+    throttle_puts(table, monkeypatch, 2)
+    ret = app.add_note_handler(apigw_event("POST", "/note", body=NOTE), Context(3000))
+
+    assert ret["statusCode"] == 200
+    assert note_count(table) == 1
+    assert len(policy) == 2
+
+
+def test_out_of_retries_sheds_with_429(table, policy, monkeypatch):
+    throttle_puts(table, monkeypatch, 100)
+    ret = app.add_note_handler(apigw_event("POST", "/note", body=NOTE), Context(3000))
+
+    assert ret["statusCode"] == 429
+    assert int(ret["headers"]["Retry-After"]) >= 1
+    assert json.loads(ret["body"])["code"] == "ProvisionedThroughputExceededException"
+    assert len([op for op, _ in table.calls if op == "PutItem"]) == throttle.MAX_RETRIES + 1
+
+
+def test_no_retry_past_the_deadline(table, policy, monkeypatch):
+    throttle_puts(table, monkeypatch, 1)
+    ret = app.add_note_handler(apigw_event("POST", "/note", body=NOTE), Context(throttle.MARGIN_MS))
+
+    assert ret["statusCode"] == 429
+    assert policy == []
+
+
+def test_empty_retry_bucket_sheds_at_once(table, policy, monkeypatch):
+    monkeypatch.setattr(throttle, "retries", throttle.TokenBucket(0, 0))
+    throttle_puts(table, monkeypatch, 1)
+    ret = app.add_note_handler(apigw_event("POST", "/note", body=NOTE), None)
+
+    assert ret["statusCode"] == 429
+    assert note_count(table) == 0
+
+
+def test_admission_bucket_sheds_before_calling(table, policy, monkeypatch):
+    seed_notes(table, 2)
+    monkeypatch.setattr(throttle, "admission", throttle.TokenBucket(0, 0))
+    calls = len(table.calls)
+    ret = app.get_notes_handler(apigw_event("GET", "/notes"), Context(3000))
+
+    assert ret["statusCode"] == 429
+    assert len(table.calls) == calls
+
+
+def test_other_errors_are_not_retried(table, policy, monkeypatch):
+    def broken(**params):
+        raise clientError("ValidationException", "nope")
+    monkeypatch.setattr(table, "put_item", broken)
+    ret = app.add_note_handler(apigw_event("POST", "/note", body=NOTE), Context(3000))
+
+    assert ret["statusCode"] == 400
+    assert policy == []
+
+
+def test_token_bucket_refills():
+    bucket = throttle.TokenBucket(2, 1)
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 0.5
@@ -0,0 +1,122 @@
+import json
+import random
+import string
+from decimal import Decimal
+
+import pytest
+
+import app
+import validation
+from tests.unit.test_handler import USER_ID, apigw_event, note_count, seed_notes
+
+
+def noise(size):
+    # random letters and digits: zlib only gets them down to about 3/4
+    rng = random.Random(3)
+    return "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(size))
+
+
+@pytest.mark.parametrize("item, message", [
+    ([], "must be an object"),
+    ({"title": 5}, "'title' in 'Item' must be a string"),
+    ({"content_z": "x"}, "is set by the server"),
+])
+def test_new_note_schema(item, message):
+    with pytest.raises(ValueError, match=message):
+        validation.NEW_NOTE.check(item)
+
+
+def test_update_schema():
+    validation.NOTE_UPDATE.check({"timestamp": 1, "note_id": "n", "title": None, "extra": [1, "two"]})
+    with pytest.raises(ValueError, match="Cannot find 'note_id'"):
+        validation.NOTE_UPDATE.check({"timestamp": 1})
+    with pytest.raises(ValueError, match="must be an integer"):
+        validation.NOTE_UPDATE.check({"timestamp": True, "note_id": "n"})
+    with pytest.raises(ValueError, match="must be an integer"):
+        validation.NOTE_UPDATE.check({"timestamp": "1723331552", "note_id": "n"})
+
+
+def test_item_size_counts_compressed_content():
+    validation.NEW_NOTE.check({"content": "lorem ipsum " * 50000})
+    with pytest.raises(ValueError, match="item limit"):
+        validation.NEW_NOTE.check({"content": noise(validation.ITEM_MAX_BYTES * 3 // 2)})
+
+
+def test_parse_body():
+    assert validation.parseBody('{"Item": {"rating": 4.5}}', 100)["Item"]["rating"] == Decimal("4.5")
+    assert validation.parseBody({"Item": {}}, 1) == {"Item": {}}
+    for body, message in ((None, "Cannot find 'body'"), ("x" * 101, "byte limit"), ("{", "not valid JSON"), ("[]", "JSON object")):
+        with pytest.raises(ValueError, match=message):
+            validation.parseBody(body, 100)
+
+
+@pytest.mark.parametrize("event", [
+    apigw_event("POST", "/note"),
+    apigw_event("POST", "/note", body={"Items": []}),
+    apigw_event("POST", "/note", body={"Item": {"title": ["not", "text"]}}),
+    apigw_event("POST", "/note", body={"Item": {"title": "x"}}, headers={"app_user_id": USER_ID}),
+])
+def test_add_note_rejects_before_any_table_call(table, event):
+    ret = app.add_note_handler(event, None)
+
+    assert ret["statusCode"] == 400
+    assert json.loads(ret["body"])["error"].startswith("add_note() - ")
+    assert table.calls == []
+
+
+def test_add_note_rejects_oversized_item(table):
+    event = apigw_event("POST", "/note", body={"Item": {"title": "big", "content": noise(validation.ITEM_MAX_BYTES * 3 // 2)}})
+    ret = app.add_note_handler(event, None)
+
+    assert ret["statusCode"] == 400
+    assert "item limit" in json.loads(ret["body"])["error"]
+    assert note_count(table) == 0
+
+
+def test_add_note_stores_fractions_as_decimal(table):
+    ret = app.add_note_handler(apigw_event("POST", "/note", body={"Item": {"title": "t", "rating": 4.5}}), None)
+    timestamp = json.loads(ret["body"])["timestamp"]
+
+    assert ret["statusCode"] == 200
+    assert table.get_item(Key={"user_id": USER_ID, "timestamp": timestamp})["Item"]["rating"] == Decimal("4.5")
+
+
+def test_add_note_returns_numbers_past_64_bits(table):
+    event = apigw_event("POST", "/note")
+    event["body"] = '{"Item": {"title": "t", "n": 1e30, "m": 123456789012345678901234}}'
+    ret = app.add_note_handler(event, None)
+
+    assert ret["statusCode"] == 200
+    note = json.loads(ret["body"])
+    assert note["n"] == 10 ** 30 and note["m"] == 123456789012345678901234
+
+
+def test_batch_names_the_bad_item(table):
+    items = [{"title": "fine"}, {"title": "fine"}, {"cat": 7}]
+    ret = app.add_notes_batch_handler(apigw_event("POST", "/notes/batch", body={"Items": items}), None)
+
+    assert ret["statusCode"] == 400
+    assert "'cat' in 'Items[2]'" in json.loads(ret["body"])["error"]
+    assert note_count(table) == 0
+
+
+def test_update_note_bad_requests_do_not_crash(table):
+    note = seed_notes(table, 1)[0]
+    edit = {"timestamp": note["timestamp"], "note_id": note["note_id"], "title": "x"}
+    events = [
+        apigw_event("PATCH", "/note"),
+        apigw_event("PATCH", "/note", body={"Item": edit}, headers={"app_user_id": USER_ID}),
+        apigw_event("PATCH", "/note", body={"Item": {"note_id": note["note_id"]}}),
+    ]
+    for event in events:
+        ret = app.update_note_handler(event, None)
+        assert ret["statusCode"] == 400
+        assert set(ret) == {"statusCode", "headers", "body"}
+    assert table.get_item(Key={"user_id": USER_ID, "timestamp": note["timestamp"]})["Item"]["title"] == note["title"]
+
+
+@pytest.mark.parametrize("path", [None, {}, {"timestamp": "soon"}])
+def test_delete_note_bad_timestamp(table, path):
+    ret = app.delete_note_handler(apigw_event("DELETE", "/note/t/{timestamp}", path=path), None)
+    assert ret["statusCode"] == 400
+    assert table.calls == []